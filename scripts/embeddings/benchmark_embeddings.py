@@ -0,0 +1,706 @@
+#!/usr/bin/env python3
+"""
+Offline Embedding Throughput Benchmark
+
+Measures local_batch_embeddings.py and dual_gpu_embeddings.py without production
+Supabase, the GPU boxes or Modal. Everything they talk to is replaced by local
+stand-in servers:
+
+- CLIP server: /health, /generate_single_embedding, /generate_batch_embeddings and
+  /generate_embeddings_from_storage (JSON, raw and multipart uploads or storage
+  paths fetched from the Supabase stand-in; JSON or packed float responses) with
+  configurable latency, jitter, failure rate and GPU concurrency
+- Supabase: PostgREST (claim/release/bulk-write RPCs, counts, per-row updates)
+  and public storage, over an in-memory synthetic portfolio_images backlog
+- Windows GPU listener (dual_gpu_embeddings.py only): /health, /trigger, /status,
+  running local_batch_embeddings.py against a second stand-in CLIP server
+
+Each configuration of the --parallel x --batch-size sweep runs the real script as
+a subprocess against a fresh backlog. Throughput is images written per second from
+launch to the last write; latency is per image, from claim to DB write. Bytes
+served by storage and uploaded to the CLIP servers are reported per run.
+
+Usage:
+    python scripts/embeddings/benchmark_embeddings.py --parallel 2,4,8 --batch-size 50,100
+    python scripts/embeddings/benchmark_embeddings.py --script dual --images 3000
+    python scripts/embeddings/benchmark_embeddings.py --extra-args="--streaming --micro-batch 16"
+    python scripts/embeddings/benchmark_embeddings.py --clip-failure-rate 0.05 --modal  # Failover
+    python scripts/embeddings/benchmark_embeddings.py --onboarding-pct 5  # Priority lanes
+    python scripts/embeddings/benchmark_embeddings.py --extra-args="--server-fetch"  # No client re-upload
+    python scripts/embeddings/benchmark_embeddings.py --serve  # Just run the stand-ins
+
+Requirements:
+    pip install aiohttp supabase python-dotenv requests
+"""
+
+import os
+import sys
+import asyncio
+import argparse
+import hashlib
+import json
+import math
+import random
+import shlex
+import struct
+import tempfile
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+from aiohttp import ClientSession, web
+
+# Fix Windows console encoding for emojis
+if sys.platform == 'win32':
+    try:
+        sys.stdout.reconfigure(encoding='utf-8')
+        sys.stderr.reconfigure(encoding='utf-8')
+    except:
+        pass
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+SCRIPTS = {
+    "local": os.path.join(SCRIPT_DIR, "local_batch_embeddings.py"),
+    "dual": os.path.join(SCRIPT_DIR, "dual_gpu_embeddings.py"),
+}
+
+EMBEDDING_DIM = 768
+
+# supabase-py only checks the key's shape; the stand-in ignores it
+FAKE_SERVICE_ROLE_KEY = "eyJhbGciOiJIUzI1NiIsInR5cCI6IkpXVCJ9.eyJyb2xlIjoic2VydmljZV9yb2xlIn0.benchmark"
+
+# Same unit vector for every image - the scripts only check its length
+_UNIT_VECTOR = [1.0 / math.sqrt(EMBEDDING_DIM)] * EMBEDDING_DIM
+EMBEDDING_ROWS = {
+    "application/x-embedding-f32": struct.pack(f"<{EMBEDDING_DIM}f", *_UNIT_VECTOR),
+    "application/x-embedding-f16": struct.pack(f"<{EMBEDDING_DIM}e", *_UNIT_VECTOR),
+}
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    """Nearest-rank percentile (None for no values)"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(len(ordered) * pct / 100) - 1))]
+
+
+async def start_site(app: web.Application) -> Tuple[web.AppRunner, str]:
+    """Serve an app on a free localhost port, returning its base URL"""
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    host, port = runner.addresses[0][:2]
+    return runner, f"http://{host}:{port}"
+
+
+class StandInClipServer:
+    """CLIP inference server stand-in with a simple latency/failure model"""
+
+    def __init__(
+        self,
+        name: str,
+        latency: float,
+        per_image: float,
+        jitter: float,
+        failure_rate: float,
+        slots: int
+    ):
+        """
+        Args:
+            name: Label used in reports
+            latency: Fixed seconds per request (network + model overhead)
+            per_image: Extra seconds per image in the request
+            jitter: Log-normal sigma applied to each request's latency (0 = none)
+            failure_rate: Probability a request answers HTTP 500
+            slots: Requests processed at once (1 = one GPU, requests queue behind each other)
+        """
+        self.name = name
+        self.latency = latency
+        self.per_image = per_image
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self._gpu = asyncio.Semaphore(max(1, slots))
+        self.request_times: List[float] = []
+        self.images = 0
+        self.failures = 0
+        self.bytes_received = 0
+        # Supabase stand-in base URL for /generate_embeddings_from_storage (set once it runs)
+        self.storage_url: Optional[str] = None
+        self._storage_session: Optional[ClientSession] = None
+
+        self.app = web.Application(client_max_size=256 * 1024 * 1024)
+        self.app.router.add_get("/health", self.health)
+        self.app.router.add_post("/generate_single_embedding", self.single)
+        self.app.router.add_post("/generate_batch_embeddings", self.batch)
+        self.app.router.add_post("/generate_embeddings_from_storage", self.from_storage)
+        self.app.on_cleanup.append(self._close_storage_session)
+
+    def reset(self):
+        self.request_times = []
+        self.images = 0
+        self.failures = 0
+        self.bytes_received = 0
+
+    async def _close_storage_session(self, app: web.Application):
+        if self._storage_session is not None:
+            await self._storage_session.close()
+
+    async def health(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            "status": "ok",
+            "gpu_available": True,
+            "model_loaded": True,
+            "model_name": f"ViT-L-14 (stand-in: {self.name})",
+            "embedding_dim": EMBEDDING_DIM,
+            "input_formats": ["image", "application/x-clip-tensor-u8"] + (["storage_path"] if self.storage_url else []),
+        })
+
+    async def _count_images(self, request: web.Request, batch: bool) -> int:
+        """Consume the upload and count the images in it"""
+        if request.content_type == "application/json":
+            body = await request.read()
+            self.bytes_received += len(body)
+            return len(json.loads(body).get("images", [])) if batch else 1
+        if request.content_type == "multipart/form-data":
+            count = 0
+            reader = await request.multipart()
+            async for part in reader:
+                data = await part.read()  # Read before adding - += would race across requests
+                self.bytes_received += len(data)
+                count += 1
+            return count
+        body = await request.read()
+        self.bytes_received += len(body)
+        return 1
+
+    async def _infer(self, count: int) -> bool:
+        """Simulate one forward pass; False if this request should fail"""
+        delay = self.latency + self.per_image * count
+        if self.jitter:
+            delay *= random.lognormvariate(0, self.jitter)
+
+        start = time.time()
+        async with self._gpu:
+            await asyncio.sleep(delay)
+        self.request_times.append(time.time() - start)
+
+        if random.random() < self.failure_rate:
+            self.failures += 1
+            return False
+        self.images += count
+        return True
+
+    def _respond(self, request: web.Request, count: int, batch: bool) -> web.Response:
+        for part in request.headers.get("Accept", "").split(","):
+            media_type = part.split(";")[0].strip().lower()
+            if media_type in EMBEDDING_ROWS:
+                return web.Response(
+                    body=EMBEDDING_ROWS[media_type] * count,
+                    content_type=media_type,
+                    headers={"X-Embedding-Dim": str(EMBEDDING_DIM), "X-Embedding-Count": str(count)}
+                )
+        if batch:
+            return web.json_response({"embeddings": [_UNIT_VECTOR] * count})
+        return web.json_response({"embedding": _UNIT_VECTOR})
+
+    async def single(self, request: web.Request) -> web.Response:
+        await self._count_images(request, batch=False)
+        if not await self._infer(1):
+            return web.Response(status=500, text="stand-in failure")
+        return self._respond(request, 1, batch=False)
+
+    async def batch(self, request: web.Request) -> web.Response:
+        count = await self._count_images(request, batch=True)
+        if count == 0:
+            return web.Response(status=400, text="No images provided")
+        if not await self._infer(count):
+            return web.Response(status=500, text="stand-in failure")
+        return self._respond(request, count, batch=True)
+
+    async def from_storage(self, request: web.Request) -> web.Response:
+        """Fetch the images from the Supabase stand-in, then embed them like a batch"""
+        body = await request.read()
+        self.bytes_received += len(body)
+        images = json.loads(body).get("images", [])
+        if not images:
+            return web.Response(status=400, text="No images provided")
+
+        if self._storage_session is None:
+            self._storage_session = ClientSession()
+
+        async def fetch(storage_path: str) -> int:
+            url = f"{self.storage_url}/storage/v1/object/public/portfolio-images/{storage_path}"
+            async with self._storage_session.get(url) as response:
+                await response.read()
+                return response.status
+
+        statuses = await asyncio.gather(*(fetch(img["storage_path"]) for img in images))
+        errors = {
+            i: [f"download_http_{status}", status in (400, 404, 410)]
+            for i, status in enumerate(statuses) if status != 200
+        }
+        if not await self._infer(len(images) - len(errors)):
+            return web.Response(status=500, text="stand-in failure")
+
+        for part in request.headers.get("Accept", "").split(","):
+            media_type = part.split(";")[0].strip().lower()
+            if media_type in EMBEDDING_ROWS:
+                zero_row = bytes(len(EMBEDDING_ROWS[media_type]))
+                headers = {"X-Embedding-Dim": str(EMBEDDING_DIM), "X-Embedding-Count": str(len(images))}
+                if errors:
+                    headers["X-Embedding-Failed"] = ",".join(str(i) for i in errors)
+                    headers["X-Embedding-Errors"] = json.dumps({str(i): error for i, error in errors.items()})
+                return web.Response(
+                    body=b"".join(zero_row if i in errors else EMBEDDING_ROWS[media_type] for i in range(len(images))),
+                    content_type=media_type,
+                    headers=headers
+                )
+        return web.json_response({
+            "embeddings": {img["id"]: _UNIT_VECTOR for i, img in enumerate(images) if i not in errors},
+            "errors": {images[i]["id"]: {"error": error[0], "permanent": error[1]} for i, error in errors.items()},
+        })
+
+
+class StandInSupabase:
+    """PostgREST + storage stand-in over an in-memory portfolio_images backlog"""
+
+    def __init__(self, db_latency: float, storage_latency: float, image_kb: int, onboarding_pct: float = 0.0):
+        """
+        Args:
+            db_latency: Seconds added to every PostgREST request
+            storage_latency: Seconds added to every image download
+            image_kb: Size of each synthetic image
+            onboarding_pct: Share of the backlog (%) in the onboarding lane, spread through it
+        """
+        self.db_latency = db_latency
+        self.onboarding_pct = onboarding_pct
+        self.storage_latency = storage_latency
+        self.image_size = image_kb * 1024
+        # Shared filler - each image only differs in its first bytes, which is
+        # enough to give it a unique content hash without holding N images in memory
+        self._filler = os.urandom(self.image_size)
+        self.images: Dict[str, Dict] = {}
+        self.salt = ""
+        self.bytes_served = 0
+
+        self.app = web.Application(client_max_size=256 * 1024 * 1024)
+        self.app.router.add_get("/storage/v1/object/public/portfolio-images/{path:.*}", self.storage)
+        self.app.router.add_post("/rest/v1/rpc/{name}", self.rpc)
+        self.app.router.add_patch("/rest/v1/{table}", self.update)
+
+    def reset(self, count: int):
+        """Replace the backlog with `count` fresh pending images"""
+        self.salt = uuid.uuid4().hex  # New content every run, so no cache can carry over
+        self.bytes_served = 0
+        self.created_at = time.time()
+        rng = random.Random(self.salt)
+        artist_ids = [str(uuid.uuid4()) for _ in range(max(1, count // 20))]
+        self.images = {}
+        for i in range(count):
+            image_id = str(uuid.uuid4())
+            self.images[image_id] = {
+                "id": image_id,
+                "artist_id": artist_ids[i % len(artist_ids)],
+                "storage_original_path": f"benchmark/{image_id}.jpg",
+                "priority_class": "onboarding" if rng.random() * 100 < self.onboarding_pct else "backfill",
+                "status": "pending",
+                "claimed_by": None,
+                "lease_expires_at": 0.0,
+                "attempts": 0,
+                "next_attempt_at": 0.0,
+                "claimed_at": None,
+                "written_at": None,
+            }
+
+    def results(self, started_at: float) -> Dict:
+        """Throughput and per-image latency since `started_at`"""
+        written = [img for img in self.images.values() if img["written_at"] and img["status"] == "active"]
+        failed = sum(1 for img in self.images.values() if img["status"] == "failed")
+        pending = sum(1 for img in self.images.values() if img["status"] == "pending")
+        latencies = [img["written_at"] - img["claimed_at"] for img in written if img["claimed_at"]]
+        span = (max(img["written_at"] for img in written) - started_at) if written else 0.0
+        # Queue latency of the onboarding lane (the whole backlog is inserted at reset)
+        onboarding = [img["written_at"] - self.created_at for img in written if img["priority_class"] == "onboarding"]
+        return {
+            "written": len(written),
+            "failed": failed,
+            "pending": pending,
+            "seconds": span,
+            "images_per_second": len(written) / span if span else 0.0,
+            "p50": percentile(latencies, 50),
+            "p99": percentile(latencies, 99),
+            "onboarding_p99": percentile(onboarding, 99),
+            "mb_downloaded": self.bytes_served / 1024 / 1024,
+        }
+
+    async def storage(self, request: web.Request) -> web.Response:
+        await asyncio.sleep(self.storage_latency)
+        head = hashlib.sha256(f"{self.salt}:{request.match_info['path']}".encode()).digest()
+        body = head + self._filler[len(head):]
+        self.bytes_served += len(body)
+        return web.Response(body=body, content_type="image/jpeg")
+
+    async def rpc(self, request: web.Request) -> web.Response:
+        await asyncio.sleep(self.db_latency)
+        name = request.match_info["name"]
+        params = await request.json() if request.can_read_body else {}
+        now = time.time()
+
+        if name == "claim_pending_images":
+            # Same two passes as the SQL: weighted share per lane, then leftovers in
+            # priority order. Location filters are ignored (synthetic images have no
+            # artist locations).
+            limit = params.get("p_limit", 100)
+            lanes = ["onboarding", "sync", "backfill"]
+            weights = {lane: max(0, params.get(f"p_{lane}_weight", default)) for lane, default in zip(lanes, (8, 3, 1))}
+            total_weight = max(1, sum(weights.values()))
+            claimed = []
+            for first_pass in (True, False):
+                for lane in lanes:
+                    quota = min(limit - len(claimed), math.ceil(limit * weights[lane] / total_weight) if first_pass else limit)
+                    for img in self.images.values():
+                        if quota <= 0:
+                            break
+                        if (img["status"] != "pending" or img["lease_expires_at"] > now
+                                or img["next_attempt_at"] > now or img["priority_class"] != lane):
+                            continue
+                        img["claimed_by"] = params["p_worker_id"]
+                        img["lease_expires_at"] = now + params.get("p_lease_seconds", 600)
+                        img["claimed_at"] = img["claimed_at"] or now
+                        claimed.append({
+                            **{key: img[key] for key in ("id", "storage_original_path", "artist_id", "priority_class")},
+                            "queued_seconds": now - self.created_at,
+                        })
+                        quota -= 1
+            return web.json_response(claimed)
+
+        if name == "release_image_claims":
+            released = 0
+            for img in self.images.values():
+                if img["claimed_by"] == params.get("p_worker_id"):
+                    img["claimed_by"] = None
+                    img["lease_expires_at"] = 0.0
+                    released += 1
+            return web.json_response(released)
+
+        if name == "bulk_update_image_embeddings":
+            updated = 0
+            for update in params.get("updates", []):
+                img = self.images.get(update["id"])
+                if img is None or img["status"] != "pending":
+                    continue
+                if update["status"] == "active" and not update.get("embedding"):
+                    continue
+                self._write(img, update["status"], now)
+                updated += 1
+            return web.json_response(updated)
+
+        if name == "record_embedding_failures":
+            # Same rules as the SQL, without the jitter
+            max_attempts = params.get("p_max_attempts", 5)
+            base_delay = params.get("p_base_delay_seconds", 300)
+            dead_lettered = 0
+            for failure in params.get("failures", []):
+                img = self.images.get(failure["id"])
+                if img is None or img["status"] != "pending":
+                    continue
+                img["attempts"] += 1
+                img["claimed_by"] = None
+                img["lease_expires_at"] = 0.0
+                if failure.get("permanent") or img["attempts"] >= max_attempts:
+                    img["status"] = "failed"
+                    dead_lettered += 1
+                else:
+                    img["next_attempt_at"] = now + min(86400, base_delay * 2 ** (img["attempts"] - 1))
+            return web.json_response(dead_lettered)
+
+        if name == "count_pending_embedding_images":
+            return web.json_response(sum(
+                1 for img in self.images.values() if img["status"] == "pending" and img["next_attempt_at"] <= now
+            ))
+
+        # increment_pipeline_progress, update_complete_artist_pipelines, ...
+        return web.json_response(0)
+
+    def _write(self, img: Dict, status: str, now: float):
+        img["status"] = status
+        img["claimed_by"] = None
+        img["lease_expires_at"] = 0.0
+        if status == "active":
+            img["written_at"] = now
+
+    async def update(self, request: web.Request) -> web.Response:
+        """Per-row fallback writes (portfolio_images?id=eq.<id>, returns updated rows), everything else is a no-op"""
+        await asyncio.sleep(self.db_latency)
+        if request.match_info["table"] == "portfolio_images":
+            image_id = request.query.get("id", "").removeprefix("eq.")
+            img = self.images.get(image_id)
+            body = await request.json()
+            if img is not None and img["status"] == "pending" and "status" in body:
+                self._write(img, body["status"], time.time())
+                return web.json_response([{"id": image_id, "status": img["status"]}])
+        return web.json_response([])
+
+
+class StandInWindowsListener:
+    """Windows GPU listener stand-in: /trigger runs local_batch_embeddings.py in the background"""
+
+    def __init__(self, env: Dict[str, str], log_path: str):
+        self.env = env
+        self.log_path = log_path
+        self.process: Optional[asyncio.subprocess.Process] = None
+
+        self.app = web.Application()
+        self.app.router.add_get("/health", self.health)
+        self.app.router.add_post("/trigger", self.trigger)
+        self.app.router.add_get("/status", self.status)
+
+    async def health(self, request: web.Request) -> web.Response:
+        return web.json_response({"status": "ok", "auth_required": False})
+
+    async def trigger(self, request: web.Request) -> web.Response:
+        if self.process and self.process.returncode is None:
+            return web.json_response({"error": "Job already running"}, status=409)
+
+        payload = await request.json()
+        cmd = [
+            sys.executable, SCRIPTS["local"],
+            "--parallel", str(payload.get("parallel", 6)),
+            "--max-batches", str(payload.get("max_batches", 100)),
+            "--batch-size", str(payload.get("batch_size", 100))
+        ]
+        for key in ("city", "region", "country"):
+            if payload.get(key):
+                cmd += [f"--{key}", payload[key]]
+        log = open(self.log_path, "a")
+        self.process = await asyncio.create_subprocess_exec(
+            *cmd, env=self.env, cwd=self.env["BENCHMARK_WORKDIR"], stdout=log, stderr=asyncio.subprocess.STDOUT
+        )
+        log.close()
+        return web.json_response({"status": "started"}, status=202)
+
+    async def status(self, request: web.Request) -> web.Response:
+        if self.process is None:
+            return web.json_response({"status": "idle"})
+        if self.process.returncode is None:
+            return web.json_response({"status": "running", "progress": {}})
+        if self.process.returncode != 0:
+            return web.json_response({"status": "error", "error": f"exit code {self.process.returncode}"})
+        return web.json_response({"status": "completed"})
+
+
+class Benchmark:
+    """Start the stand-ins and run the scripts against them"""
+
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.runners: List[web.AppRunner] = []
+        self.supabase = StandInSupabase(args.db_latency, args.storage_latency, args.image_kb, args.onboarding_pct)
+        clip_args = dict(jitter=args.clip_jitter, failure_rate=args.clip_failure_rate, slots=args.gpu_slots)
+        self.local_clip = StandInClipServer("A2000", args.clip_latency, args.clip_per_image, **clip_args)
+        # The Windows box is a faster GPU (see GPU_4080_RATIO in dual_gpu_embeddings.py)
+        self.windows_clip = StandInClipServer(
+            "RTX 4080", args.clip_latency, args.clip_per_image * 2 / 3, **clip_args
+        )
+        self.modal_clip = StandInClipServer(
+            "Modal", args.modal_latency, args.clip_per_image, jitter=args.clip_jitter, failure_rate=0.0, slots=8
+        )
+        self.urls: Dict[str, str] = {}
+
+    async def start(self):
+        servers = {"supabase": self.supabase, "local_clip": self.local_clip, "windows_clip": self.windows_clip}
+        if self.args.modal:
+            servers["modal_clip"] = self.modal_clip
+        for name, server in servers.items():
+            runner, url = await start_site(server.app)
+            self.runners.append(runner)
+            self.urls[name] = url
+            if name != "supabase":
+                server.storage_url = self.urls["supabase"]
+
+    async def stop(self):
+        for runner in self.runners:
+            await runner.cleanup()
+
+    def script_env(self, workdir: str, clip_url: str, worker: str = "local") -> Dict[str, str]:
+        """Environment that points a script at the stand-ins (and nothing in .env.local)"""
+        env = os.environ.copy()
+        env.update({
+            "SUPABASE_URL": self.urls["supabase"],
+            "SUPABASE_SERVICE_ROLE_KEY": FAKE_SERVICE_ROLE_KEY,
+            "LOCAL_CLIP_URL": clip_url,
+            "CLIP_API_KEY": "",
+            "MODAL_FUNCTION_URL": self.urls.get("modal_clip", ""),
+            "WINDOWS_GPU_API_KEY": "",
+            "PIPELINE_RUN_ID": "",
+            # Separate files per worker, like separate machines in production
+            "EMBEDDING_CACHE_PATH": os.path.join(workdir, f"embedding-cache-{worker}.sqlite3"),
+            "EMBEDDING_JOURNAL_PATH": os.path.join(workdir, f"embedding-journal-{worker}.bin"),
+            "BENCHMARK_WORKDIR": workdir,
+            "PYTHONUNBUFFERED": "1",
+        })
+        return env
+
+    async def run_one(self, script: str, parallel: int, batch_size: int) -> Dict:
+        """Run one script configuration against a fresh backlog"""
+        self.supabase.reset(self.args.images)
+        for clip in (self.local_clip, self.windows_clip, self.modal_clip):
+            clip.reset()
+
+        extra_args = shlex.split(self.args.extra_args or "")
+        with tempfile.TemporaryDirectory(prefix="embedding-benchmark-") as workdir:
+            env = self.script_env(workdir, self.urls["local_clip"])
+            log_path = os.path.join(workdir, "run.log")
+            listener_runner = None
+
+            if script == "dual":
+                # Both halves run with the orchestrator's own flags, like production
+                listener = StandInWindowsListener(
+                    self.script_env(workdir, self.urls["windows_clip"], worker="windows"), log_path
+                )
+                listener_runner, env["WINDOWS_GPU_URL"] = await start_site(listener.app)
+                cmd = [SCRIPTS["dual"], "--parallel", str(parallel), "--batch-size", str(batch_size)]
+            else:
+                cmd = [
+                    SCRIPTS["local"], "--parallel", str(parallel), "--batch-size", str(batch_size),
+                    "--max-batches", "1000000", *extra_args
+                ]
+
+            started_at = time.time()
+            with open(log_path, "a") as log:
+                process = await asyncio.create_subprocess_exec(
+                    sys.executable, *cmd, env=env, cwd=workdir,
+                    stdout=None if self.args.verbose else log, stderr=asyncio.subprocess.STDOUT
+                )
+                await process.wait()
+            wall_seconds = time.time() - started_at
+
+            if listener_runner:
+                await listener_runner.cleanup()
+
+            result = self.supabase.results(started_at)
+            result.update({
+                "script": script,
+                "parallel": parallel,
+                "batch_size": batch_size,
+                "exit_code": process.returncode,
+                "wall_seconds": wall_seconds,
+                "clip_p99": percentile(self.local_clip.request_times + self.windows_clip.request_times, 99),
+                "modal_images": self.modal_clip.images,
+                "mb_uploaded": sum(
+                    clip.bytes_received for clip in (self.local_clip, self.windows_clip, self.modal_clip)
+                ) / 1024 / 1024,
+            })
+            if process.returncode != 0 and not self.args.verbose:
+                with open(log_path) as log:
+                    result["log_tail"] = log.read()[-2000:]
+            return result
+
+
+def print_result(result: Dict):
+    """One row of the results table"""
+    def fmt(seconds: Optional[float]) -> str:
+        return f"{seconds:.2f}s" if seconds is not None else "-"
+
+    status = "✅" if result["exit_code"] == 0 and result["pending"] == 0 else "⚠️ "
+    print(f"{status} {result['script']:<6}{result['parallel']:>9}{result['batch_size']:>7}"
+          f"{result['written']:>8}{result['failed']:>7}{result['images_per_second']:>10.1f}"
+          f"{fmt(result['p50']):>9}{fmt(result['p99']):>9}{fmt(result['clip_p99']):>10}{result['modal_images']:>7}")
+    print(f"   Transfer: {result['mb_downloaded']:.1f} MB served by storage, "
+          f"{result['mb_uploaded']:.1f} MB uploaded to CLIP servers")
+    if result["onboarding_p99"] is not None:
+        print(f"   Onboarding lane: p99 {fmt(result['onboarding_p99'])} from insert to written")
+    if "log_tail" in result:
+        print(f"   Script exited with code {result['exit_code']}; last output:")
+        print("   " + result["log_tail"].strip().replace("\n", "\n   "))
+
+
+async def run_sweep(args: argparse.Namespace) -> List[Dict]:
+    benchmark = Benchmark(args)
+    await benchmark.start()
+    results = []
+
+    try:
+        if args.serve:
+            print("🧪 Stand-ins running (Ctrl+C to stop). Point a script at them with:")
+            env = benchmark.script_env(tempfile.gettempdir(), benchmark.urls["local_clip"])
+            for key in ("SUPABASE_URL", "SUPABASE_SERVICE_ROLE_KEY", "LOCAL_CLIP_URL", "MODAL_FUNCTION_URL"):
+                print(f"   export {key}={env[key]}")
+            benchmark.supabase.reset(args.images)
+            print(f"   Backlog: {args.images} pending images (reset on restart)")
+            while True:
+                await asyncio.sleep(3600)
+
+        print(f"🧪 Benchmarking {args.images} images per run "
+              f"(CLIP {args.clip_latency * 1000:.0f}ms + {args.clip_per_image * 1000:.0f}ms/image, "
+              f"{args.gpu_slots} GPU slot(s), failure rate {args.clip_failure_rate:.0%})")
+        print("   script  parallel  batch written failed  images/s      p50      p99  CLIP p99  modal")
+
+        for script in args.script:
+            for parallel in args.parallel:
+                for batch_size in args.batch_size:
+                    result = await benchmark.run_one(script, parallel, batch_size)
+                    print_result(result)
+                    results.append(result)
+    finally:
+        await benchmark.stop()
+
+    return results
+
+
+def int_list(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline throughput benchmark for the embedding scripts")
+    parser.add_argument("--script", type=lambda v: v.split(","), default=["local"],
+                        help="Scripts to benchmark: local, dual or local,dual (default: local)")
+    parser.add_argument("--parallel", type=int_list, default=[2, 4, 8], help="Comma-separated --parallel values (default: 2,4,8)")
+    parser.add_argument("--batch-size", type=int_list, default=[100], help="Comma-separated --batch-size values (default: 100)")
+    parser.add_argument("--images", type=int, default=1000, help="Synthetic pending images per run (default: 1000)")
+    parser.add_argument("--extra-args", type=str, help="Extra arguments for local_batch_embeddings.py, local script only (e.g. \"--streaming\")")
+    parser.add_argument("--clip-latency", type=float, default=0.03, help="Stand-in CLIP seconds per request (default: 0.03)")
+    parser.add_argument("--clip-per-image", type=float, default=0.015, help="Stand-in CLIP seconds per image (default: 0.015)")
+    parser.add_argument("--clip-jitter", type=float, default=0.25, help="Log-normal sigma of CLIP latency (default: 0.25)")
+    parser.add_argument("--clip-failure-rate", type=float, default=0.0, help="Fraction of CLIP requests that fail (default: 0)")
+    parser.add_argument("--gpu-slots", type=int, default=1, help="CLIP requests processed concurrently (default: 1)")
+    parser.add_argument("--modal", action="store_true", help="Also run a Modal stand-in for failover")
+    parser.add_argument("--modal-latency", type=float, default=0.5, help="Modal stand-in seconds per request (default: 0.5)")
+    parser.add_argument("--db-latency", type=float, default=0.02, help="Seconds per PostgREST request (default: 0.02)")
+    parser.add_argument("--storage-latency", type=float, default=0.02, help="Seconds per image download (default: 0.02)")
+    parser.add_argument("--onboarding-pct", type=float, default=0.0,
+                        help="Share of the backlog (%%) in the onboarding priority lane (default: 0)")
+    parser.add_argument("--image-kb", type=int, default=200, help="Synthetic image size in KB (default: 200)")
+    parser.add_argument("--output", type=str, help="Write results as JSON to this file")
+    parser.add_argument("--verbose", action="store_true", help="Show the scripts' output")
+    parser.add_argument("--serve", action="store_true", help="Only run the stand-in servers")
+    args = parser.parse_args()
+
+    unknown = [script for script in args.script if script not in SCRIPTS]
+    if unknown:
+        print(f"❌ Unknown script(s): {', '.join(unknown)} (choose from {', '.join(SCRIPTS)})")
+        return 1
+
+    try:
+        results = asyncio.run(run_sweep(args))
+    except KeyboardInterrupt:
+        return 0
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\n💾 Results written to {args.output}")
+
+    best = max(results, key=lambda r: r["images_per_second"], default=None)
+    if best:
+        print(f"\n🏆 Best: {best['script']} --parallel {best['parallel']} --batch-size {best['batch_size']} "
+              f"({best['images_per_second']:.1f} images/s, p99 {best['p99'] or 0:.2f}s)")
+
+    return 0 if all(r["exit_code"] == 0 for r in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""
+Client-Side CLIP Preprocessing
+
+Runs the geometric part of the OpenCLIP ViT-L-14 image transform (resize the
+shortest side to 224 with bicubic filtering, center-crop 224x224) on the client,
+so only a 150 KB uint8 tensor is uploaded instead of the full-resolution original.
+The GPU server converts the tensor to float and applies the CLIP mean/std
+normalization itself, which keeps the upload exact (no float rounding on the wire).
+
+Wire format (media type application/x-clip-tensor-u8): 224 x 224 x 3 bytes,
+row-major HWC, RGB.
+
+With CLIP_REDUCED_DECODE=1, JPEGs are decoded at reduced resolution (DCT scaling,
+see open_image), so a 1440px original costs a fraction of a full decode. It is off
+by default until --drift passes on assets/seeds with the production weights; set it
+on the GPU servers and the client alike so both sides decode the same way.
+The Modal server ships this module and imports open_image and format_embedding
+from it, so both sides decode and write embeddings the same way.
+
+Usage:
+    # Parity check against the OpenCLIP transform used by the server
+    python scripts/embeddings/clip_preprocess.py --parity assets/seeds
+    python scripts/embeddings/clip_preprocess.py --parity assets/seeds --limit 20
+
+    # Embedding drift of reduced-resolution decoding vs full decodes (model from clip_weights.py)
+    python scripts/embeddings/clip_preprocess.py --drift assets/seeds
+
+Environment Variables:
+    CLIP_REDUCED_DECODE: "1" to decode JPEGs at reduced resolution (default: full decode)
+
+Requirements:
+    pip install Pillow
+    pip install open-clip-torch torch  # parity / drift checks only (+ safetensors for drift)
+"""
+
+import argparse
+import io
+import os
+import sys
+from pathlib import Path
+from typing import List, Optional
+
+# Fix Windows console encoding for emojis
+if sys.platform == 'win32':
+    try:
+        sys.stdout.reconfigure(encoding='utf-8')
+        sys.stderr.reconfigure(encoding='utf-8')
+    except:
+        pass
+
+CLIP_IMAGE_SIZE = 224
+TENSOR_MEDIA_TYPE = "application/x-clip-tensor-u8"
+TENSOR_BYTES = CLIP_IMAGE_SIZE * CLIP_IMAGE_SIZE * 3
+
+# OpenCLIP normalization for ViT-L-14 / laion2b_s32b_b82k (OPENAI_DATASET_MEAN / _STD)
+CLIP_MEAN = (0.48145466, 0.4578275, 0.40821073)
+CLIP_STD = (0.26862954, 0.26130258, 0.27577711)
+
+# Largest image we are willing to decode (decompression bombs)
+MAX_PIXELS = 100_000_000
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".avif"}
+
+# Reduced-resolution JPEG decoding (opt-in until a --drift run on the real model passes)
+REDUCED_DECODE = os.getenv("CLIP_REDUCED_DECODE", "").lower() in ("1", "true", "yes")
+
+
+def resize_target(width: int, height: int) -> tuple:
+    """Size torchvision Resize(224) gives a width x height image (shortest side 224, long side truncated)"""
+    short, long = (width, height) if width <= height else (height, width)
+    new_short, new_long = CLIP_IMAGE_SIZE, int(CLIP_IMAGE_SIZE * long / short)
+    return (new_short, new_long) if width <= height else (new_long, new_short)
+
+
+def open_image(image_bytes: bytes, reduced: Optional[bool] = None):
+    """
+    Decode an image for CLIP as RGB, at reduced resolution when enabled and the format allows it
+
+    JPEGs use Pillow's draft mode (libjpeg DCT scaling): the decoder picks the
+    smallest 1/2, 1/4 or 1/8 scale whose width and height still cover
+    CLIP_IMAGE_SIZE, so the shortest side never drops below what the resize needs.
+    A scaled image is resized straight to the resize target of the original size
+    (the scaled size is rounded up, which would shift the center crop), so the
+    transform's own Resize becomes a no-op. Other formats are decoded in full.
+    The pixel limit is checked from the header, before any decoding.
+
+    Args:
+        image_bytes: Encoded image
+        reduced: Allow scaled decoding (default: REDUCED_DECODE; --drift compares both)
+
+    Raises:
+        ValueError: Image over MAX_PIXELS
+        OSError: Undecodable image
+    """
+    from PIL import Image
+
+    image = Image.open(io.BytesIO(image_bytes))
+    width, height = image.size
+    if width * height > MAX_PIXELS:
+        raise ValueError(f"Image too large: {width}x{height} pixels")
+
+    if reduced is None:
+        reduced = REDUCED_DECODE
+    if reduced and image.format == "JPEG":
+        image.draft(image.mode, (CLIP_IMAGE_SIZE, CLIP_IMAGE_SIZE))
+
+    image = image.convert("RGB")
+    if image.size != (width, height):
+        image = image.resize(resize_target(width, height), Image.BICUBIC)
+    return image
+
+
+def preprocess_to_uint8(image_bytes: bytes, reduced: Optional[bool] = None) -> Optional[bytes]:
+    """
+    Decode an image and resize/center-crop it exactly like the OpenCLIP transform
+
+    Mirrors torchvision Resize(224, BICUBIC) + CenterCrop(224) on a PIL image,
+    including its output-size and crop-offset rounding, so the server sees the
+    same pixels it would have produced from the original.
+
+    Args:
+        image_bytes: Encoded image (JPEG, PNG, WebP, ...)
+        reduced: Allow reduced-resolution JPEG decoding (default: REDUCED_DECODE, see open_image)
+
+    Returns:
+        224x224x3 uint8 RGB bytes, or None if the image can't be decoded
+    """
+    from PIL import Image
+
+    try:
+        image = open_image(image_bytes, reduced)
+        width, height = image.size
+
+        # Resize: shortest side to 224, longest side truncated like torchvision
+        new_size = resize_target(width, height)
+        if new_size != image.size:
+            image = image.resize(new_size, Image.BICUBIC)
+
+        # Center crop (torchvision rounds the offsets)
+        new_width, new_height = image.size
+        left = int(round((new_width - CLIP_IMAGE_SIZE) / 2.0))
+        top = int(round((new_height - CLIP_IMAGE_SIZE) / 2.0))
+        image = image.crop((left, top, left + CLIP_IMAGE_SIZE, top + CLIP_IMAGE_SIZE))
+
+        return image.tobytes()
+    except Exception:
+        return None
+
+
+def tensor_from_uint8(data: bytes):
+    """
+    Turn a preprocessed uint8 payload into the normalized CHW float tensor CLIP expects
+
+    Same math as the Modal server (ToTensor + Normalize).
+    """
+    import numpy as np
+    import torch
+
+    if len(data) != TENSOR_BYTES:
+        raise ValueError(f"Expected {TENSOR_BYTES} bytes, got {len(data)}")
+
+    pixels = np.frombuffer(data, dtype=np.uint8).reshape(CLIP_IMAGE_SIZE, CLIP_IMAGE_SIZE, 3)
+    tensor = torch.from_numpy(pixels.copy()).permute(2, 0, 1).float().div(255.0)
+    mean = torch.tensor(CLIP_MEAN).view(3, 1, 1)
+    std = torch.tensor(CLIP_STD).view(3, 1, 1)
+    return (tensor - mean) / std
+
+
+def format_embedding(embedding: List[float]) -> str:
+    """Format an embedding as a pgvector literal (9 significant digits round-trip float32)"""
+    return "[" + ",".join(format(x, ".9g") for x in embedding) + "]"
+
+
+def check_parity(directory: str, limit: Optional[int] = None, tolerance: float = 1e-5) -> bool:
+    """
+    Compare client-side preprocessing against the server's OpenCLIP `preprocess`
+
+    Args:
+        directory: Folder of sample images (searched recursively, e.g. assets/seeds)
+        limit: Max images to check
+        tolerance: Max allowed absolute difference per tensor element
+
+    Returns:
+        True if every decodable image is within tolerance. Images this Pillow
+        can't decode are skipped and listed - AVIF needs Pillow 11.2+ (the Modal
+        image pins 10.2.0, so the 3 AVIF seeds are skipped there).
+    """
+    import open_clip
+    import PIL
+
+    _, _, preprocess = open_clip.create_model_and_transforms("ViT-L-14", pretrained=None)
+
+    paths = sorted(p for p in Path(directory).rglob("*") if p.suffix.lower() in IMAGE_EXTENSIONS)
+    if limit:
+        paths = paths[:limit]
+
+    checked = 0
+    skipped = []
+    worst = 0.0
+    mismatches = []
+
+    for path in paths:
+        image_bytes = path.read_bytes()
+        try:
+            # Same decode as the server (CLIP_REDUCED_DECODE applies to both), so only the transform is compared
+            reference = preprocess(open_image(image_bytes))
+        except Exception:
+            skipped.append(path)  # Format PIL can't decode here (e.g. AVIF without a plugin)
+            continue
+
+        data = preprocess_to_uint8(image_bytes)
+        if data is None:
+            mismatches.append((path, float("inf")))
+            continue
+
+        diff = (tensor_from_uint8(data) - reference).abs().max().item()
+        worst = max(worst, diff)
+        checked += 1
+        if diff > tolerance:
+            mismatches.append((path, diff))
+
+    print(f"🔍 Checked {checked} of {len(paths)} images ({len(skipped)} skipped, undecodable with Pillow {PIL.__version__})")
+    for path in skipped[:10]:
+        print(f"   - skipped {path}")
+    print(f"   Max abs difference: {worst:.2e} (tolerance {tolerance:.0e})")
+    for path, diff in mismatches[:10]:
+        print(f"   ✗ {path}: {diff:.2e}")
+
+    if mismatches:
+        print(f"❌ {len(mismatches)} images differ from the server-side transform")
+        return False
+
+    print("✅ Client-side preprocessing matches the server-side transform")
+    return True
+
+
+def check_drift(
+    directory: str,
+    limit: Optional[int] = None,
+    min_cosine: float = 0.999,
+    weights_dir: Optional[str] = None
+) -> bool:
+    """
+    Measure how far reduced-resolution decoding moves the CLIP embeddings
+
+    Embeds every image twice with the production model (full decode vs open_image's
+    scaled decode) and compares them. Only JPEGs big enough to be scaled can differ.
+
+    Args:
+        directory: Folder of sample images (searched recursively, e.g. assets/seeds)
+        limit: Max images to check
+        min_cosine: Lowest acceptable cosine similarity per image
+        weights_dir: Weight snapshot folder (see clip_weights.py; default models/clip-weights)
+
+    Returns:
+        True if every image is at or above min_cosine
+    """
+    import torch
+    from clip_weights import DEFAULT_WEIGHTS_DIR, load_clip_model
+
+    model, preprocess, _, _ = load_clip_model("cpu", weights_dir or DEFAULT_WEIGHTS_DIR, warmup=False)
+
+    paths = sorted(p for p in Path(directory).rglob("*") if p.suffix.lower() in IMAGE_EXTENSIONS)
+    if limit:
+        paths = paths[:limit]
+
+    scores = []
+    skipped = 0
+    for path in paths:
+        image_bytes = path.read_bytes()
+        try:
+            full = open_image(image_bytes, reduced=False)
+            reduced = open_image(image_bytes, reduced=True)
+        except Exception:
+            skipped += 1  # Format PIL can't decode here (e.g. AVIF without a plugin)
+            continue
+        if reduced.size == full.size:
+            continue  # Not scaled (not a JPEG, or too small) - identical by construction
+
+        with torch.no_grad():
+            embeddings = model.encode_image(torch.stack([preprocess(full), preprocess(reduced)]))
+            embeddings = embeddings / embeddings.norm(dim=-1, keepdim=True)
+        scores.append((path, full.size, reduced.size, (embeddings[0] @ embeddings[1]).item()))
+
+    print(f"🔍 Compared {len(scores)} scaled decodes ({skipped} skipped, undecodable)")
+    if scores:
+        cosines = [score for *_, score in scores]
+        print(f"   Cosine similarity: mean {sum(cosines) / len(cosines):.5f}, min {min(cosines):.5f} (minimum {min_cosine})")
+
+    failures = [score for score in scores if score[3] < min_cosine]
+    for path, full_size, reduced_size, cosine in sorted(failures, key=lambda score: score[3])[:10]:
+        print(f"   ✗ {path} ({full_size[0]}x{full_size[1]} -> {reduced_size[0]}x{reduced_size[1]}): {cosine:.5f}")
+
+    if failures:
+        print(f"❌ {len(failures)} images drift past the minimum")
+        return False
+
+    print("✅ Reduced-resolution decoding stays within the drift budget")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Client-side CLIP preprocessing (parity and drift checks)")
+    mode = parser.add_mutually_exclusive_group(required=True)
+    mode.add_argument("--parity", type=str, metavar="DIR",
+                      help="Compare against OpenCLIP preprocess on the images in DIR (e.g. assets/seeds)")
+    mode.add_argument("--drift", type=str, metavar="DIR",
+                      help="Compare embeddings of reduced vs full decodes of the images in DIR")
+    parser.add_argument("--limit", type=int, help="Max images to check")
+    parser.add_argument("--tolerance", type=float, default=1e-5, help="Max abs difference per element (default: 1e-5)")
+    parser.add_argument("--min-cosine", type=float, default=0.999,
+                        help="Lowest acceptable cosine similarity for --drift (default: 0.999)")
+    parser.add_argument("--weights-dir", help="Weight snapshot folder for --drift (default: models/clip-weights)")
+    args = parser.parse_args()
+
+    if args.drift:
+        return 0 if check_drift(args.drift, args.limit, args.min_cosine, args.weights_dir) else 1
+
+    return 0 if check_parity(args.parity, args.limit, args.tolerance) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+CLIP Weight Snapshots
+
+Loads OpenCLIP ViT-L-14 (laion2b_s32b_b82k) from a safetensors snapshot instead of
+fetching and unpickling the pretrained checkpoint on every cold start. The first
+load (or `python clip_weights.py snapshot`) converts the weights once; after that
+they are memory-mapped straight into a model built on the meta device, so no
+random initialization or download happens.
+
+Every load reports per-phase timing: import, weights (build + mmap), device
+transfer and the first (warm-up) forward pass.
+
+Used by modal_clip_embeddings.py (snapshot on the "clip-weights" Modal volume) and,
+offline on CPU boxes, by onnx_clip_server.py and clip_preprocess.py --drift.
+
+Usage:
+    # Create a snapshot on this machine (downloads the checkpoint once)
+    python scripts/embeddings/clip_weights.py snapshot --weights-dir models/clip-weights
+
+    # Time a cold load from the snapshot (works offline)
+    python scripts/embeddings/clip_weights.py load --weights-dir models/clip-weights --device cpu
+
+Requirements:
+    pip install open-clip-torch torch safetensors
+"""
+
+import argparse
+import os
+import sys
+import time
+from typing import Dict, Optional
+
+# Fix Windows console encoding for emojis
+if sys.platform == 'win32':
+    try:
+        sys.stdout.reconfigure(encoding='utf-8')
+        sys.stderr.reconfigure(encoding='utf-8')
+    except:
+        pass
+
+MODEL_NAME = "ViT-L-14"
+PRETRAINED = "laion2b_s32b_b82k"
+DEFAULT_WEIGHTS_DIR = "models/clip-weights"
+
+
+def snapshot_path(weights_dir: str) -> str:
+    """Snapshot file for the production model inside weights_dir"""
+    return os.path.join(weights_dir, f"{MODEL_NAME}-{PRETRAINED}.safetensors")
+
+
+def save_snapshot(model, path: str):
+    """
+    Write every parameter and buffer (including non-persistent ones) to a safetensors file
+
+    Written to a temp file and renamed, so a concurrent reader never sees a partial snapshot.
+    """
+    from safetensors.torch import save_file
+
+    tensors = {name: tensor.detach().cpu().contiguous() for name, tensor in model.state_dict().items()}
+    for name, buffer in model.named_buffers():
+        tensors.setdefault(name, buffer.detach().cpu().contiguous())
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    save_file(tensors, tmp_path, metadata={"model": MODEL_NAME, "pretrained": PRETRAINED})
+    os.replace(tmp_path, path)
+
+
+def _build_from_snapshot(path: str):
+    """
+    Build the model on the meta device and assign the memory-mapped snapshot tensors
+
+    Falls back to a regular (randomly initialized) build + load_state_dict if the
+    snapshot doesn't cover every parameter and buffer.
+    """
+    import open_clip
+    import torch
+    from safetensors.torch import load_file
+
+    tensors = load_file(path, device="cpu")  # Memory-mapped, no copy until used
+
+    try:
+        with torch.device("meta"):
+            model = open_clip.create_model(MODEL_NAME, pretrained=None, device="meta")
+
+        for name, _ in list(model.named_parameters()):
+            module_name, _, leaf = name.rpartition(".")
+            module = model.get_submodule(module_name)
+            setattr(module, leaf, torch.nn.Parameter(tensors[name], requires_grad=False))
+        for name, _ in list(model.named_buffers()):
+            module_name, _, leaf = name.rpartition(".")
+            model.get_submodule(module_name)._buffers[leaf] = tensors[name]
+
+        if any(t.is_meta for t in list(model.parameters()) + list(model.buffers())):
+            raise ValueError("snapshot does not cover the whole model")
+    except Exception as e:
+        print(f"⚠️  Meta-device load failed ({type(e).__name__}: {e}), building the model on CPU")
+        model = open_clip.create_model(MODEL_NAME, pretrained=None, device="cpu")
+        model.load_state_dict({name: tensor for name, tensor in tensors.items() if name in model.state_dict()})
+
+    return model
+
+
+def load_clip_model(
+    device: str = "cpu",
+    weights_dir: Optional[str] = DEFAULT_WEIGHTS_DIR,
+    warmup: bool = True
+):
+    """
+    Load ViT-L-14 with its preprocess transform and tokenizer, from a snapshot when possible
+
+    Args:
+        device: "cuda" or "cpu"
+        weights_dir: Folder holding the safetensors snapshot. Created from the
+                     pretrained checkpoint on first use; None skips snapshots.
+        warmup: Run one image and one text forward pass (CUDA kernels, allocator)
+
+    Returns:
+        (model, preprocess, tokenizer, timings) - timings has seconds per phase
+        (import, weights, device, first_forward), the weight source and whether a
+        snapshot was written
+    """
+    timings: Dict = {"snapshot_created": False}
+    started = time.perf_counter()
+
+    import open_clip
+    import torch
+
+    timings["import"] = time.perf_counter() - started
+
+    phase = time.perf_counter()
+    path = snapshot_path(weights_dir) if weights_dir else None
+    if path and os.path.exists(path):
+        model = _build_from_snapshot(path)
+        timings["source"] = "snapshot"
+    else:
+        model = open_clip.create_model(MODEL_NAME, pretrained=PRETRAINED, device="cpu")
+        timings["source"] = "pretrained"
+        if path:
+            try:
+                save_snapshot(model, path)
+                timings["snapshot_created"] = True
+            except OSError as e:
+                print(f"⚠️  Could not write weight snapshot to {path}: {e}")
+    model.eval()
+    timings["weights"] = time.perf_counter() - phase
+
+    phase = time.perf_counter()
+    model = model.to(device)
+    if device == "cuda":
+        torch.cuda.synchronize()
+    timings["device"] = time.perf_counter() - phase
+
+    visual = model.visual
+    preprocess = open_clip.image_transform(
+        visual.image_size,
+        is_train=False,
+        mean=getattr(visual, "image_mean", None),
+        std=getattr(visual, "image_std", None),
+    )
+    tokenizer = open_clip.get_tokenizer(MODEL_NAME)
+
+    timings["first_forward"] = 0.0
+    if warmup:
+        phase = time.perf_counter()
+        with torch.no_grad():
+            size = visual.image_size if isinstance(visual.image_size, int) else visual.image_size[0]
+            model.encode_image(torch.zeros(1, 3, size, size, device=device))
+            model.encode_text(tokenizer(["tattoo"]).to(device))
+        if device == "cuda":
+            torch.cuda.synchronize()
+        timings["first_forward"] = time.perf_counter() - phase
+
+    timings["total"] = time.perf_counter() - started
+    return model, preprocess, tokenizer, timings
+
+
+def format_timings(timings: Dict) -> str:
+    """One-line summary of load_clip_model's timings"""
+    return (
+        f"import {timings['import']:.1f}s, weights {timings['weights']:.1f}s ({timings['source']}), "
+        f"device {timings['device']:.1f}s, first forward {timings['first_forward']:.1f}s "
+        f"= {timings['total']:.1f}s"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CLIP weight snapshots (safetensors)")
+    parser.add_argument("command", choices=["snapshot", "load"],
+                        help="snapshot: convert the pretrained checkpoint; load: time a cold load")
+    parser.add_argument("--weights-dir", default=DEFAULT_WEIGHTS_DIR,
+                        help=f"Snapshot folder (default: {DEFAULT_WEIGHTS_DIR})")
+    parser.add_argument("--device", default="cpu", choices=["cpu", "cuda"], help="Device to load onto (default: cpu)")
+    args = parser.parse_args()
+
+    path = snapshot_path(args.weights_dir)
+    if args.command == "snapshot" and os.path.exists(path):
+        print(f"✅ Snapshot already exists: {path}")
+        return 0
+
+    _, _, _, timings = load_clip_model(args.device, args.weights_dir, warmup=args.command == "load")
+    if timings["snapshot_created"]:
+        print(f"✅ Wrote {path} ({os.path.getsize(path) / 1024 / 1024:.0f} MB)")
+    print(f"⏱️  Load: {format_timings(timings)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -7,10 +7,14 @@ Coordinates embedding generation across two GPUs:
 - A2000 (Linux/Mac, local) - 40% of work
 
 Automatically splits work based on GPU performance and triggers both in parallel.
+Both workers claim pending images with leases (see local_batch_embeddings.py), so
+the split only sets how many batches each GPU processes - they never overlap.
 
 Usage:
     python scripts/embeddings/dual_gpu_embeddings.py
     python scripts/embeddings/dual_gpu_embeddings.py --city "Austin, TX"
+    python scripts/embeddings/dual_gpu_embeddings.py --country GB  # One shard of a region-sharded backfill
+    python scripts/embeddings/dual_gpu_embeddings.py --parallel 4 --batch-size 50  # Tune the A2000 run
 
 Requirements:
     - Windows listener running: python windows-listener.py
@@ -21,7 +25,7 @@ import os
 import sys
 import argparse
 import requests
-from typing import Optional
+from typing import Dict, List, Optional
 from dotenv import load_dotenv
 from supabase import create_client, Client
 
@@ -52,28 +56,33 @@ GPU_A2000_RATIO = 0.40  # A2000 processes 40% of work
 class DualGPUOrchestrator:
     """Coordinate embedding generation across two GPUs"""
 
-    def __init__(self):
+    def __init__(self, city: Optional[str] = None, region: Optional[str] = None, country: Optional[str] = None):
+        """
+        Args:
+            city: Only process artists in this city (e.g. "Austin, TX")
+            region: Only process artists in this state/province/region
+            country: Only process artists in this country (two-letter code)
+        """
         self.supabase: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
-
-    def count_pending_images(self, city: Optional[str] = None) -> int:
-        """Count images that need embeddings"""
-
-        query = self.supabase.table("portfolio_images") \
-            .select("id", count="exact") \
-            .is_("embedding", "null") \
-            .eq("status", "pending")
-
-        if city:
-            artists = self.supabase.table("artists") \
-                .select("id") \
-                .eq("city", city) \
-                .execute()
-            artist_ids = [a["id"] for a in artists.data]
-            if artist_ids:
-                query = query.in_("artist_id", artist_ids)
-
-        result = query.execute()
-        return result.count or 0
+        self.location: Dict[str, str] = {
+            key: value for key, value in (("city", city), ("region", region), ("country", country)) if value
+        }
+
+    def location_args(self) -> List[str]:
+        """Location filter as local_batch_embeddings.py arguments"""
+        return [arg for key, value in self.location.items() for arg in (f"--{key}", value)]
+
+    def count_pending_images(self) -> int:
+        """Count images that need embeddings and can be claimed now (location filter applied server-side)"""
+        params = {
+            "p_city": self.location.get("city"),
+            "p_region": self.location.get("region"),
+            "p_country_code": self.location.get("country"),
+        }
+        result = self.supabase.rpc(
+            "count_pending_embedding_images", {key: value for key, value in params.items() if value}
+        ).execute()
+        return result.data or 0
 
     def check_windows_gpu(self) -> bool:
         """Check if Windows GPU listener is available"""
@@ -95,15 +104,16 @@ class DualGPUOrchestrator:
             return False
         return False
 
-    def trigger_windows_gpu(self, offset: int, max_batches: int, parallel: int = 6) -> bool:
+    def trigger_windows_gpu(self, max_batches: int, parallel: int = 6, batch_size: int = 100) -> bool:
         """Trigger embedding job on Windows GPU via HTTP"""
         try:
             payload = {
-                "offset": offset,
+                "offset": 0,  # Ignored by local_batch_embeddings.py (lease-based claiming)
                 "max_batches": max_batches,
                 "parallel": parallel,
-                "batch_size": 100,
-                "pipeline_run_id": PIPELINE_RUN_ID
+                "batch_size": batch_size,
+                "pipeline_run_id": PIPELINE_RUN_ID,
+                **self.location  # city / region / country, passed through as --city etc.
             }
 
             headers = {'Content-Type': 'application/json'}
@@ -111,7 +121,7 @@ class DualGPUOrchestrator:
                 headers['Authorization'] = f'Bearer {WINDOWS_GPU_API_KEY}'
 
             print(f"🚀 Triggering Windows GPU (4080)...")
-            print(f"   Offset: {offset}, Batches: {max_batches}")
+            print(f"   Batches: {max_batches}")
 
             response = requests.post(
                 f"{WINDOWS_GPU_URL}/trigger",
@@ -142,7 +152,7 @@ class DualGPUOrchestrator:
             print(f"❌ Failed to trigger Windows GPU: {e}")
             return False
 
-    def run_local_gpu(self, offset: int, max_batches: int, parallel: int = 4):
+    def run_local_gpu(self, max_batches: int, parallel: int = 4, batch_size: int = 100):
         """Run embedding generation on local A2000 GPU"""
         import subprocess
 
@@ -157,9 +167,9 @@ class DualGPUOrchestrator:
             python_cmd,
             script_path,
             '--parallel', str(parallel),
-            '--offset', str(offset),
             '--max-batches', str(max_batches),
-            '--batch-size', '100'
+            '--batch-size', str(batch_size),
+            *self.location_args()
         ]
 
         env = os.environ.copy()
@@ -167,7 +177,7 @@ class DualGPUOrchestrator:
             env['PIPELINE_RUN_ID'] = PIPELINE_RUN_ID
 
         print(f"\n🚀 Starting Local GPU (A2000)...")
-        print(f"   Offset: {offset}, Batches: {max_batches}")
+        print(f"   Batches: {max_batches}")
 
         try:
             result = subprocess.run(
@@ -248,7 +258,12 @@ class DualGPUOrchestrator:
 def main():
     parser = argparse.ArgumentParser(description="Dual-GPU embedding orchestrator")
     parser.add_argument('--city', type=str, help='Filter by city')
+    parser.add_argument('--region', type=str, help='Filter by state/province/region (e.g., TX)')
+    parser.add_argument('--country', type=str, help='Filter by two-letter country code (e.g., GB)')
     parser.add_argument('--force-single', action='store_true', help='Use only A2000 (skip Windows GPU)')
+    parser.add_argument('--parallel', type=int, default=2, help='Concurrent requests on the A2000 (default: 2)')
+    parser.add_argument('--windows-parallel', type=int, default=6, help='Concurrent requests on the 4080 (default: 6)')
+    parser.add_argument('--batch-size', type=int, default=100, help='Images per batch on both GPUs (default: 100)')
     args = parser.parse_args()
 
     # Validate configuration
@@ -258,14 +273,14 @@ def main():
         print(f"   SERVICE_ROLE_KEY: {'set' if SUPABASE_SERVICE_ROLE_KEY else 'missing'}")
         return 1
 
-    orchestrator = DualGPUOrchestrator()
+    orchestrator = DualGPUOrchestrator(city=args.city, region=args.region, country=args.country)
 
     print("="*60)
     print("🎯 DUAL-GPU EMBEDDING ORCHESTRATOR")
     print("="*60)
 
     # Count pending images
-    total_pending = orchestrator.count_pending_images(args.city)
+    total_pending = orchestrator.count_pending_images()
     print(f"📊 Total pending images: {total_pending:,}")
 
     # Initialize pipeline progress with REAL total at start
@@ -293,30 +308,30 @@ def main():
         print(f"   RTX 4080: {int(total_pending * GPU_4080_RATIO):,} images ({int(GPU_4080_RATIO * 100)}%)")
         print(f"   A2000:    {int(total_pending * GPU_A2000_RATIO):,} images ({int(GPU_A2000_RATIO * 100)}%)")
 
-        # Calculate offsets and batches
+        # Calculate batches per GPU
         images_4080 = int(total_pending * GPU_4080_RATIO)
-        batches_4080 = (images_4080 + 99) // 100  # Round up
+        batches_4080 = (images_4080 + args.batch_size - 1) // args.batch_size  # Round up
 
         images_a2000 = total_pending - images_4080
-        batches_a2000 = (images_a2000 + 99) // 100  # Round up
+        batches_a2000 = (images_a2000 + args.batch_size - 1) // args.batch_size  # Round up
 
-        # Trigger Windows GPU (4080 processes images 0 to images_4080)
+        # Trigger Windows GPU (4080)
         windows_started = orchestrator.trigger_windows_gpu(
-            offset=0,
             max_batches=batches_4080,
-            parallel=6
+            parallel=args.windows_parallel,
+            batch_size=args.batch_size
         )
 
         if not windows_started:
             print("\n⚠️  Windows GPU failed to start, falling back to A2000 only")
             windows_available = False
         else:
-            # Run local GPU (A2000 processes images images_4080 to end)
+            # Run local GPU (A2000) - claims its own images alongside the 4080
             print(f"\n" + "="*60)
             orchestrator.run_local_gpu(
-                offset=images_4080,
                 max_batches=batches_a2000,
-                parallel=2  # Reduced from 4 to lower laptop CPU/network load
+                parallel=args.parallel,  # Default 2 (not 4) to lower laptop CPU/network load
+                batch_size=args.batch_size
             )
 
             # Wait for Windows GPU to complete before exiting
@@ -333,11 +348,11 @@ def main():
         print(f"\n📋 Work Distribution:")
         print(f"   A2000: {total_pending:,} images (100%)")
 
-        batches_all = (total_pending + 99) // 100
+        batches_all = (total_pending + args.batch_size - 1) // args.batch_size
         orchestrator.run_local_gpu(
-            offset=0,
             max_batches=batches_all,
-            parallel=2  # Reduced from 4 to lower laptop CPU/network load
+            parallel=args.parallel,  # Default 2 (not 4) to lower laptop CPU/network load
+            batch_size=args.batch_size
         )
 
     print("\n" + "="*60)
@@ -0,0 +1,132 @@
+"""
+Content-Addressed Embedding Cache
+
+Persists CLIP embeddings keyed by the SHA-256 of the downloaded image bytes, so
+reposted photos and re-scraped images never reach the GPU (local or Modal) twice.
+
+Storage is a single SQLite file (WAL mode) holding packed float32 vectors, with
+least-recently-used eviction once the cache grows past its size budget.
+
+Used by local_batch_embeddings.py (see --cache-path / --cache-max-mb / --no-cache).
+"""
+
+import hashlib
+import os
+import sqlite3
+import struct
+import threading
+import time
+from typing import List, Optional
+
+EMBEDDING_DIM = 768
+
+# Approximate on-disk cost of one entry (vector + key + SQLite row/index overhead)
+ENTRY_BYTES = EMBEDDING_DIM * 4 + 128
+
+# Check the size budget every N inserts (counting rows on every put is wasteful)
+EVICTION_CHECK_INTERVAL = 256
+
+# Evict down to this fraction of the budget so we don't evict on every check
+EVICTION_TARGET = 0.9
+
+
+class EmbeddingCache:
+    """SQLite-backed embedding cache with size-based LRU eviction"""
+
+    def __init__(self, path: str, max_bytes: int):
+        """
+        Args:
+            path: SQLite file to store embeddings in (created if missing)
+            max_bytes: Approximate size budget before least-recently-used entries are evicted
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+        self.max_entries = max(1, max_bytes // ENTRY_BYTES)
+        self._lock = threading.Lock()
+        self._puts_since_check = 0
+
+        # Autocommit - every statement is its own small transaction
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                digest BLOB PRIMARY KEY,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings (last_used)")
+
+        # Statistics
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(image_bytes: bytes) -> bytes:
+        """Content address for a downloaded image"""
+        return hashlib.sha256(image_bytes).digest()
+
+    def get(self, digest: bytes) -> Optional[List[float]]:
+        """Look up an embedding by content address (None on miss)"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT vector FROM embeddings WHERE digest = ?", (digest,)
+            ).fetchone()
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            self._conn.execute(
+                "UPDATE embeddings SET last_used = ? WHERE digest = ?", (time.time(), digest)
+            )
+            self.hits += 1
+
+        return list(struct.unpack(f"<{EMBEDDING_DIM}f", row[0]))
+
+    def put(self, digest: bytes, embedding: List[float]):
+        """Store an embedding under its content address"""
+        if len(embedding) != EMBEDDING_DIM:
+            return
+
+        vector = struct.pack(f"<{EMBEDDING_DIM}f", *embedding)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO embeddings (digest, vector, last_used) VALUES (?, ?, ?)",
+                (digest, vector, time.time())
+            )
+
+            self._puts_since_check += 1
+            if self._puts_since_check >= EVICTION_CHECK_INTERVAL:
+                self._puts_since_check = 0
+                self._evict_if_needed()
+
+    def _evict_if_needed(self):
+        """Drop least-recently-used entries once the cache exceeds its budget (caller holds lock)"""
+        count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        if count <= self.max_entries:
+            return
+
+        excess = count - int(self.max_entries * EVICTION_TARGET)
+        self._conn.execute("""
+            DELETE FROM embeddings WHERE digest IN (
+                SELECT digest FROM embeddings ORDER BY last_used LIMIT ?
+            )
+        """, (excess,))
+        self.evictions += excess
+
+    def entry_count(self) -> int:
+        """Number of embeddings currently cached"""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def close(self):
+        """Close the underlying database"""
+        with self._lock:
+            self._conn.close()
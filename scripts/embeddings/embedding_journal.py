@@ -0,0 +1,188 @@
+"""
+Crash-Safe Embedding Journal
+
+Append-only local log of embeddings that have been computed but not yet confirmed
+written to Supabase. If local_batch_embeddings.py dies mid-run (crash, Ctrl+C,
+network outage during the final writes), the next run replays the journal into
+the bulk-write path instead of paying for the GPU work again.
+
+Record layout (little-endian):
+    u32 payload length | u32 CRC-32 of payload | payload
+    payload = kind (u8) | image id (16-byte UUID) | [768 x float32 for results]
+
+kind 1 = embedding computed, kind 2 = written to the DB (confirmed). A torn record
+at the end of the file (crash mid-append) fails its CRC and is dropped on replay.
+Once everything outstanding is confirmed the file is truncated; it is also
+rewritten with only the unconfirmed records whenever it grows past COMPACT_BYTES.
+
+Used by local_batch_embeddings.py (see --journal-path / --no-journal).
+"""
+
+import os
+import struct
+import threading
+import uuid
+import zlib
+from typing import Dict, List, Tuple
+
+EMBEDDING_DIM = 768
+
+RECORD_RESULT = 1
+RECORD_CONFIRMED = 2
+
+_HEADER = struct.Struct("<II")
+_VECTOR = struct.Struct(f"<{EMBEDDING_DIM}f")
+
+# Rewrite the journal once it grows past this size (confirmed records are dead weight)
+COMPACT_BYTES = 64 * 1024 * 1024
+
+
+class JournalLocked(Exception):
+    """Another process is using the same journal file"""
+
+
+class EmbeddingJournal:
+    """Append-only journal of computed-but-unwritten embeddings"""
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: Journal file (created if missing). Use one per concurrent worker.
+
+        Raises:
+            JournalLocked: If another running process holds the journal
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+        self._mutex = threading.Lock()  # Streaming mode confirms from writer threads
+        self._file = open(path, "ab")
+        self._lock()
+
+        # Unconfirmed embeddings (image id -> packed vector), rebuilt from disk
+        self._outstanding: Dict[str, bytes] = self._replay()
+        self.replayed = len(self._outstanding)
+        self.appended = 0
+        self.confirmed = 0
+
+    def _lock(self):
+        """Hold an exclusive lock for the life of the process (POSIX only)"""
+        try:
+            import fcntl
+        except ImportError:
+            return  # Windows: one worker per machine, as run by dual_gpu_embeddings.py
+        try:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self._file.close()
+            raise JournalLocked(f"{self.path} is in use by another process") from None
+
+    def _replay(self) -> Dict[str, bytes]:
+        """Read every intact record, returning embeddings that were never confirmed"""
+        outstanding: Dict[str, bytes] = {}
+        valid_bytes = 0
+
+        with open(self.path, "rb") as f:
+            data = f.read()
+
+        offset = 0
+        while offset + _HEADER.size <= len(data):
+            length, crc = _HEADER.unpack_from(data, offset)
+            payload = data[offset + _HEADER.size:offset + _HEADER.size + length]
+            if len(payload) != length or zlib.crc32(payload) != crc or length < 17:
+                break  # Torn or corrupt tail - everything before it is intact
+
+            kind = payload[0]
+            image_id = str(uuid.UUID(bytes=payload[1:17]))
+            if kind == RECORD_RESULT and length == 17 + _VECTOR.size:
+                outstanding[image_id] = payload[17:]
+            elif kind == RECORD_CONFIRMED:
+                outstanding.pop(image_id, None)
+
+            offset += _HEADER.size + length
+            valid_bytes = offset
+
+        if valid_bytes < len(data):
+            print(f"⚠️  Journal {self.path}: dropped {len(data) - valid_bytes} bytes of incomplete records")
+            self._file.truncate(valid_bytes)
+
+        return outstanding
+
+    @staticmethod
+    def _record(kind: int, image_id: str, vector: bytes = b"") -> bytes:
+        payload = bytes([kind]) + uuid.UUID(image_id).bytes + vector
+        return _HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+    def _write(self, records: List[bytes]):
+        self._file.write(b"".join(records))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def append(self, results: List[Tuple[str, List[float]]]):
+        """Durably record computed embeddings (image id, vector) before they are written"""
+        records = []
+        vectors = {}
+        for image_id, embedding in results:
+            if len(embedding) != EMBEDDING_DIM:
+                continue
+            vectors[image_id] = _VECTOR.pack(*embedding)
+            records.append(self._record(RECORD_RESULT, image_id, vectors[image_id]))
+
+        if records:
+            with self._mutex:
+                self._outstanding.update(vectors)
+                self._write(records)
+                self.appended += len(records)
+
+    def confirm(self, image_ids: List[str]):
+        """Mark embeddings as written to the DB (they won't be replayed)"""
+        with self._mutex:
+            records = [
+                self._record(RECORD_CONFIRMED, image_id)
+                for image_id in image_ids
+                if self._outstanding.pop(image_id, None) is not None
+            ]
+            if not records:
+                return
+            self.confirmed += len(records)
+
+            if not self._outstanding:
+                # Nothing left to protect - start over with an empty file
+                self._file.truncate(0)
+                os.fsync(self._file.fileno())
+            elif self._file.tell() >= COMPACT_BYTES:
+                self._compact()
+            else:
+                self._write(records)
+
+    def pending(self) -> List[Tuple[str, List[float]]]:
+        """Embeddings recorded but never confirmed (e.g. from a run that crashed)"""
+        with self._mutex:
+            return [(image_id, list(_VECTOR.unpack(vector))) for image_id, vector in self._outstanding.items()]
+
+    def compact(self):
+        """Rewrite the journal with only the unconfirmed embeddings"""
+        with self._mutex:
+            self._compact()
+
+    def _compact(self):
+        """compact() with the mutex already held"""
+        tmp_path = f"{self.path}.compact"
+        with open(tmp_path, "wb") as f:
+            f.write(b"".join(
+                self._record(RECORD_RESULT, image_id, vector) for image_id, vector in self._outstanding.items()
+            ))
+            f.flush()
+            os.fsync(f.fileno())
+
+        self._file.close()
+        os.replace(tmp_path, self.path)
+        self._file = open(self.path, "ab")
+        self._lock()
+
+    def close(self):
+        """Close the journal (unconfirmed embeddings stay on disk for the next run)"""
+        with self._mutex:
+            self._file.close()
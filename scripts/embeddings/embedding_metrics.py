@@ -0,0 +1,209 @@
+"""
+Embedding Pipeline Metrics
+
+Fixed-memory latency histograms per pipeline stage plus byte and error counters
+for local_batch_embeddings.py, so a slow run can be pinned on the network, the
+GPU or Supabase.
+
+Histograms use log-spaced buckets (1ms to ~2.5 days, ~12% wide, long enough for
+per-lane queue latencies), so memory stays constant however many images are
+processed and percentiles are accurate to within one bucket.
+
+Exposed two ways while a job runs (both optional):
+    - OpenMetrics/Prometheus text at http://<host>:<port>/metrics (--metrics-port)
+    - A JSON snapshot file rewritten every few seconds (--metrics-json)
+"""
+
+import json
+import math
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+# Histogram bucket layout: upper bounds MIN_BUCKET * BUCKET_GROWTH^i seconds
+MIN_BUCKET = 0.001
+BUCKET_GROWTH = 1.12
+BUCKET_COUNT = 170
+
+# Stages every run reports, even when empty (per-backend inference stages are added on use)
+DEFAULT_STAGES = ["download", "encode", "db_write"]
+
+METRIC_PREFIX = "inkdex_embedding"
+
+
+class LatencyHistogram:
+    """Log-bucketed latency histogram with constant memory"""
+
+    BOUNDS = [MIN_BUCKET * BUCKET_GROWTH ** i for i in range(BUCKET_COUNT)]
+
+    def __init__(self):
+        self.buckets = [0] * (BUCKET_COUNT + 1)  # Last bucket catches everything above the top bound
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float):
+        """Record one latency sample"""
+        seconds = max(seconds, 0.0)
+        if seconds <= MIN_BUCKET:
+            index = 0
+        else:
+            index = min(BUCKET_COUNT, math.ceil(math.log(seconds / MIN_BUCKET, BUCKET_GROWTH)))
+        self.buckets[index] += 1
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, percentile: float) -> Optional[float]:
+        """Latency at the given percentile (upper bound of its bucket), None if empty"""
+        if self.count == 0:
+            return None
+        rank = math.ceil(self.count * percentile / 100)
+        seen = 0
+        for index, bucket_count in enumerate(self.buckets):
+            seen += bucket_count
+            if seen >= max(rank, 1):
+                if index >= BUCKET_COUNT:
+                    return self.max
+                return min(self.BOUNDS[index], self.max)
+        return self.max
+
+    def mean(self) -> Optional[float]:
+        """Average latency, None if empty"""
+        return self.sum / self.count if self.count else None
+
+    def summary(self) -> Dict:
+        """Count, mean and p50/p95/p99 (seconds)"""
+        return {
+            "count": self.count,
+            "mean": self.mean(),
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+            "max": self.max if self.count else None,
+        }
+
+
+class PipelineMetrics:
+    """Per-stage latency histograms plus byte and error counters"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+        self.histograms: Dict[str, LatencyHistogram] = {stage: LatencyHistogram() for stage in DEFAULT_STAGES}
+        self.bytes: Dict[str, int] = {"downloaded": 0, "uploaded": 0, "received": 0}
+        self.errors: Dict[str, int] = {}
+
+    def observe(self, stage: str, seconds: float):
+        """Record a latency sample for a stage (e.g. "download", "inference_local")"""
+        with self._lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = LatencyHistogram()
+            histogram.observe(seconds)
+
+    def count_bytes(self, direction: str, count: int):
+        """Add to a byte counter ("downloaded", "uploaded", "received")"""
+        with self._lock:
+            self.bytes[direction] = self.bytes.get(direction, 0) + count
+
+    def count_error(self, kind: str, count: int = 1):
+        """Add to the error counter for one error type (e.g. "download_timeout")"""
+        with self._lock:
+            self.errors[kind] = self.errors.get(kind, 0) + count
+
+    def snapshot(self) -> Dict:
+        """JSON-serializable view of every metric"""
+        with self._lock:
+            return {
+                "timestamp": time.time(),
+                "uptime_seconds": time.time() - self.started_at,
+                "stages": {stage: histogram.summary() for stage, histogram in self.histograms.items()},
+                "bytes": dict(self.bytes),
+                "errors": dict(self.errors),
+            }
+
+    def render_openmetrics(self) -> str:
+        """OpenMetrics text exposition (also readable by Prometheus)"""
+        lines: List[str] = []
+        with self._lock:
+            lines.append(f"# TYPE {METRIC_PREFIX}_stage_seconds histogram")
+            lines.append(f"# UNIT {METRIC_PREFIX}_stage_seconds seconds")
+            lines.append(f"# HELP {METRIC_PREFIX}_stage_seconds Latency per pipeline stage.")
+            for stage, histogram in self.histograms.items():
+                cumulative = 0
+                for bound, bucket_count in zip(LatencyHistogram.BOUNDS, histogram.buckets):
+                    cumulative += bucket_count
+                    lines.append(f'{METRIC_PREFIX}_stage_seconds_bucket{{stage="{stage}",le="{bound:.6g}"}} {cumulative}')
+                lines.append(f'{METRIC_PREFIX}_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {histogram.count}')
+                lines.append(f'{METRIC_PREFIX}_stage_seconds_count{{stage="{stage}"}} {histogram.count}')
+                lines.append(f'{METRIC_PREFIX}_stage_seconds_sum{{stage="{stage}"}} {histogram.sum:.6f}')
+
+            lines.append(f"# TYPE {METRIC_PREFIX}_bytes counter")
+            lines.append(f"# UNIT {METRIC_PREFIX}_bytes bytes")
+            lines.append(f"# HELP {METRIC_PREFIX}_bytes Bytes moved, by direction.")
+            for direction, count in self.bytes.items():
+                lines.append(f'{METRIC_PREFIX}_bytes_total{{direction="{direction}"}} {count}')
+
+            lines.append(f"# TYPE {METRIC_PREFIX}_errors counter")
+            lines.append(f"# HELP {METRIC_PREFIX}_errors Errors, by type.")
+            for kind, count in self.errors.items():
+                lines.append(f'{METRIC_PREFIX}_errors_total{{type="{kind}"}} {count}')
+
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    def write_json(self, path: str):
+        """Write a snapshot atomically (readers never see a half-written file)"""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.snapshot(), f, indent=2)
+        os.replace(tmp_path, path)
+
+
+def start_metrics_server(metrics: PipelineMetrics, port: int) -> ThreadingHTTPServer:
+    """Serve /metrics in OpenMetrics text format from a daemon thread"""
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.render_openmetrics().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/openmetrics-text; version=1.0.0; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # Keep scrapes out of the job log
+
+    server = ThreadingHTTPServer(("0.0.0.0", port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def start_json_snapshots(metrics: PipelineMetrics, path: str, interval: float) -> threading.Event:
+    """
+    Rewrite a JSON snapshot every `interval` seconds from a daemon thread
+
+    Returns:
+        Event that stops the writer once set (write the final snapshot yourself)
+    """
+    stop = threading.Event()
+
+    def writer():
+        while not stop.wait(interval):
+            try:
+                metrics.write_json(path)
+            except OSError as e:
+                print(f"⚠️  Could not write metrics snapshot: {e}")
+
+    threading.Thread(target=writer, daemon=True).start()
+    return stop
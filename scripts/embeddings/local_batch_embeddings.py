@@ -9,16 +9,39 @@ Usage:
     python scripts/embeddings/local_batch_embeddings.py --parallel 4 --batch-size 100
     python scripts/embeddings/local_batch_embeddings.py --parallel 8  # Higher concurrency
     python scripts/embeddings/local_batch_embeddings.py --city "Austin, TX"  # Specific city only
+    python scripts/embeddings/local_batch_embeddings.py --country GB  # One shard of a region-sharded backfill
+    python scripts/embeddings/local_batch_embeddings.py --streaming --parallel 4  # Pipelined stages
+    python scripts/embeddings/local_batch_embeddings.py --client-preprocess  # Upload 224x224 tensors
+    python scripts/embeddings/local_batch_embeddings.py --metrics-port 9464  # Prometheus scrape target
+    python scripts/embeddings/local_batch_embeddings.py --server-fetch  # GPU servers download the originals
 
 Features:
     - Async parallelization (4-8 images concurrently recommended for A2000)
+    - One event loop and pooled keep-alive connections for the whole run (optional HTTP/2 to storage)
+    - Micro-batched inference (several images per request, one forward pass)
+    - Binary wire format (raw image bytes up, packed floats down; JSON fallback)
+    - Bulk DB writes (one bulk_update_image_embeddings RPC per chunk)
+    - Content-addressed embedding cache (duplicate images skip the GPU)
+    - Streaming mode (download → inference → DB write stages with bounded queues)
     - Automatic failover (local → Modal on timeout/error)
+    - Circuit breakers + latency-aware routing (EWMA per backend, background probes)
+    - Hedged requests (slow local requests duplicated to Modal, first answer wins)
+    - Client-side CLIP preprocessing (CPU process pool, 150 KB uint8 tensors uploaded)
+    - Server-side fetch (only storage paths sent, servers download originals themselves)
     - Resume capability (processes only images with status='pending')
+    - Retry backoff + dead-lettering (404s and undecodable images are never retried)
+    - Lease-based work claiming (any number of workers, no overlap or gaps)
+    - Priority lanes (onboarding > sync > backfill, weighted per claim, queue latency per lane)
+    - Prefetching (next batch claimed and its first images downloaded during inference)
+    - Crash-safe journal (computed embeddings survive a crash and are written on the next run)
     - Statistics tracking (local vs Modal usage)
-    - Progress reporting
+    - Metrics (p50/p95/p99 per stage, byte/error counters; OpenMetrics endpoint or JSON snapshots)
+    - Progress reporting (coalesced, flushed in the background every few seconds)
 
 Requirements:
     pip install aiohttp asyncio supabase python-dotenv
+    pip install Pillow  # --client-preprocess only
+    pip install 'httpx[http2]'  # --http2-storage only
 """
 
 import os
@@ -26,14 +49,33 @@ import sys
 import asyncio
 import aiohttp
 import base64
+import json
 import time
 import re
+import random
+import socket
+import struct
+import uuid
 import argparse
 import requests
-from typing import Optional, Dict, List
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Optional, Dict, List, Tuple
 from dotenv import load_dotenv
 from supabase import create_client, Client
 
+try:
+    import httpx  # HTTP/2 storage downloads (--http2-storage, also needs the h2 package)
+    DOWNLOAD_TIMEOUT_ERRORS = (asyncio.TimeoutError, httpx.TimeoutException)
+except ImportError:
+    httpx = None
+    DOWNLOAD_TIMEOUT_ERRORS = (asyncio.TimeoutError,)
+
+from clip_preprocess import TENSOR_MEDIA_TYPE, format_embedding, preprocess_to_uint8
+from embedding_cache import EmbeddingCache
+from embedding_journal import EmbeddingJournal, JournalLocked
+from embedding_metrics import PipelineMetrics, start_json_snapshots, start_metrics_server
+
 # Fix Windows console encoding for emojis
 if sys.platform == 'win32':
     try:
@@ -54,18 +96,449 @@ MODAL_FUNCTION_URL = os.getenv("MODAL_FUNCTION_URL")
 SUPABASE_URL = os.getenv("SUPABASE_URL") or os.getenv("NEXT_PUBLIC_SUPABASE_URL")
 SUPABASE_SERVICE_ROLE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
 LOCAL_TIMEOUT = int(os.getenv("LOCAL_CLIP_TIMEOUT", "10"))
+MODAL_TIMEOUT = 30
+MAX_MICRO_BATCH = 64  # Matches MAX_BATCH_IMAGES on the Modal server
+DEFAULT_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "tmp/embedding-cache.sqlite3")
+DEFAULT_JOURNAL_PATH = os.getenv("EMBEDDING_JOURNAL_PATH", "tmp/embedding-journal.bin")
+
+EMBEDDING_DIM = 768
+
+# Binary wire format: packed little-endian rows of EMBEDDING_DIM floats
+WIRE_MEDIA_TYPES = {
+    "f32": "application/x-embedding-f32",
+    "f16": "application/x-embedding-f16",
+}
+WIRE_STRUCT_FORMATS = {
+    "application/x-embedding-f32": "f",
+    "application/x-embedding-f16": "e",
+}
+
+BACKEND_LABELS = {"local": "Local GPU", "modal": "Modal"}
+
+# Starting per-image latency estimates (seconds) until real measurements arrive
+BACKEND_LATENCY_PRIORS = {"local": 0.25, "modal": 1.0}
+
+# Recent per-image latencies kept per backend for hedge percentiles
+LATENCY_WINDOW = 200
+
+# Samples needed before a backend's latency percentile is trusted for hedging
+MIN_HEDGE_SAMPLES = 20
+
+# Seconds between health probes of backends whose circuit is open
+PROBE_INTERVAL = 10.0
+
+# Embedding queue lanes in claim order (see embedding_priority_class in the migrations)
+PRIORITY_CLASSES = ["onboarding", "sync", "backfill"]
+DEFAULT_PRIORITY_WEIGHTS = "8,3,1"
+
+# Queue latency targets per lane (seconds from image insert to embedding written)
+QUEUE_LATENCY_TARGETS = {"onboarding": 300.0, "sync": 3600.0}
+
+# Storage responses that won't change on retry (Supabase storage answers 400 for missing objects)
+PERMANENT_HTTP_STATUSES = {400, 404, 410}
+
+# Connection pooling: idle keep-alive and DNS cache lifetimes (seconds)
+KEEPALIVE_SECONDS = 60
+DNS_CACHE_SECONDS = 300
+
+# Per-image storage download timeout (seconds)
+DOWNLOAD_TIMEOUT = 10
+
+# Connections to storage with --http2-storage (each carries many concurrent downloads)
+STORAGE_HTTP2_CONNECTIONS = 4
+
+# Streaming mode writes a partial chunk once its oldest result has waited this long (seconds)
+WRITE_FLUSH_INTERVAL = 2.0
+
+# Marks the end of input for a streaming pipeline stage
+_STAGE_DONE = object()
+
+
+class EmbeddingRequestError(Exception):
+    """An embedding backend answered with an error"""
+
+
+class HedgeFailed(EmbeddingRequestError):
+    """Both the primary request and its hedge failed"""
+
+
+class BatchEndpointUnsupported(EmbeddingRequestError):
+    """The backend has no /generate_batch_embeddings endpoint (older server)"""
+
+
+class StorageFetchUnsupported(EmbeddingRequestError):
+    """The backend has no /generate_embeddings_from_storage endpoint (older server)"""
+
+
+def location_filter(city: Optional[str] = None, region: Optional[str] = None, country: Optional[str] = None) -> Dict[str, str]:
+    """
+    RPC parameters for an optional location filter (resolved server-side via artist_locations)
+
+    Args:
+        city: City name, optionally with its region ("Austin" or "Austin, TX")
+        region: State/province/region (e.g. "TX", "Ontario")
+        country: Two-letter country code (e.g. "US", "GB")
+    """
+    params = {"p_city": city, "p_region": region, "p_country_code": country}
+    return {key: value for key, value in params.items() if value}
+
+
+def parse_priority_weights(value: str) -> Dict[str, int]:
+    """
+    Parse lane weights given as "ONBOARDING,SYNC,BACKFILL" (e.g. "8,3,1")
+
+    Raises:
+        ValueError: If the value isn't three non-negative integers
+    """
+    weights = [int(weight) for weight in value.split(",")]
+    if len(weights) != len(PRIORITY_CLASSES) or min(weights) < 0 or not any(weights):
+        raise ValueError(f"expected {len(PRIORITY_CLASSES)} non-negative weights, got {value!r}")
+    return dict(zip(PRIORITY_CLASSES, weights))
+
+
+def describe_location(location: Dict[str, str]) -> str:
+    """Human-readable location filter for log lines ("" when unfiltered)"""
+    if not location:
+        return ""
+    return " in " + ", ".join(location[key] for key in ("p_city", "p_region", "p_country_code") if key in location)
+
+
+def health_ok(data: Dict) -> bool:
+    """
+    Whether a /health payload reports a server that can embed
+
+    CPU backends (the ONNX server) report gpu_available: False and are still
+    healthy, so this checks for a loaded model rather than a GPU.
+    """
+    return data.get("status") == "ok" and data.get("model_loaded", True)
+
+
+def unpack_embeddings(body: bytes, media_type: str, count: int, failed: str = "") -> List[Optional[List[float]]]:
+    """
+    Decode a binary embedding response
+
+    Args:
+        body: `count` packed little-endian rows of EMBEDDING_DIM floats
+        media_type: One of WIRE_STRUCT_FORMATS (selects float32 or float16)
+        count: Number of rows expected
+        failed: Comma-separated row indices the server could not embed (X-Embedding-Failed)
+
+    Returns:
+        One embedding per row, None for failed rows
+    """
+    fmt = WIRE_STRUCT_FORMATS[media_type]
+    expected = count * EMBEDDING_DIM * struct.calcsize(fmt)
+    if len(body) != expected:
+        raise EmbeddingRequestError(f"Binary response is {len(body)} bytes, expected {expected}")
+
+    values = struct.unpack(f"<{count * EMBEDDING_DIM}{fmt}", body)
+    embeddings = [list(values[i * EMBEDDING_DIM:(i + 1) * EMBEDDING_DIM]) for i in range(count)]
+    for index in filter(None, failed.split(",")):
+        embeddings[int(index)] = None
+    return embeddings
+
+class BackendHealth:
+    """Latency, error rate and circuit state for one embedding backend"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.ewma_latency = BACKEND_LATENCY_PRIORS[name]  # Seconds per image
+        self.ewma_error_rate = 0.0
+        self.consecutive_failures = 0
+        self.circuit = "closed"  # closed | open | half_open
+        self.trial_in_flight = False
+        self.circuit_opens = 0
+        self.recent_latencies = deque(maxlen=LATENCY_WINDOW)
+
+    def capacity(self) -> float:
+        """Estimated throughput (images/s per concurrent request), discounted by error rate"""
+        return (1.0 - self.ewma_error_rate) / max(self.ewma_latency, 0.001)
+
+    def latency_percentile(self, percentile: float) -> Optional[float]:
+        """Per-image latency at the given percentile of recent requests (None until enough samples)"""
+        if len(self.recent_latencies) < MIN_HEDGE_SAMPLES:
+            return None
+        ordered = sorted(self.recent_latencies)
+        index = min(len(ordered) - 1, int(len(ordered) * percentile / 100))
+        return ordered[index]
+
+
+class BackendRouter:
+    """
+    Route embedding requests between the local GPU and Modal
+
+    Each backend tracks an EWMA of per-image latency and error rate. After
+    `failure_threshold` consecutive failures (or an error rate above
+    ERROR_RATE_THRESHOLD) its circuit opens and it gets no traffic until a
+    background health probe succeeds; the next request is then a trial that
+    closes the circuit on success or reopens it on failure.
+
+    In "capacity" mode healthy backends share traffic in proportion to measured
+    throughput; in "prefer-local" mode later backends only serve as fallback.
+    """
+
+    EWMA_ALPHA = 0.2
+    ERROR_RATE_THRESHOLD = 0.5
+
+    def __init__(self, backends: List[str], mode: str = "capacity", failure_threshold: int = 5):
+        self.backends = {name: BackendHealth(name) for name in backends}
+        self.preference = list(backends)
+        self.mode = mode
+        self.failure_threshold = max(1, failure_threshold)
+
+    def order(self) -> List[str]:
+        """Backends to try for the next request: chosen backend first, then fallbacks"""
+        available = [
+            name for name in self.preference
+            if self.backends[name].circuit == "closed"
+            or (self.backends[name].circuit == "half_open" and not self.backends[name].trial_in_flight)
+        ]
+        if not available:
+            # Every circuit is open - still try rather than fail the images outright
+            return list(self.preference)
+
+        if self.mode == "capacity" and len(available) > 1:
+            weights = [self.backends[name].capacity() for name in available]
+            primary = random.choices(available, weights=weights)[0]
+            fallbacks = sorted(
+                (name for name in available if name != primary),
+                key=lambda name: self.backends[name].capacity(),
+                reverse=True
+            )
+            available = [primary] + fallbacks
+
+        # A recovering backend gets the next request as its trial, ahead of the others
+        trials = [name for name in available if self.backends[name].circuit == "half_open"]
+        if trials:
+            self.backends[trials[0]].trial_in_flight = True
+            available = [trials[0]] + [name for name in available if self.backends[name].circuit == "closed"]
+        return available
+
+    def record_success(self, name: str, latency_per_image: float):
+        """Update latency/error EWMAs after a successful request (closes a half-open circuit)"""
+        health = self.backends[name]
+        health.ewma_latency += self.EWMA_ALPHA * (latency_per_image - health.ewma_latency)
+        health.recent_latencies.append(latency_per_image)
+        health.ewma_error_rate *= (1.0 - self.EWMA_ALPHA)
+        health.consecutive_failures = 0
+        health.trial_in_flight = False
+        if health.circuit != "closed":
+            print(f"  🟢 {BACKEND_LABELS[name]} circuit closed")
+            health.circuit = "closed"
+
+    def record_failure(self, name: str):
+        """Update error EWMA after a failed request, opening the circuit if needed"""
+        health = self.backends[name]
+        health.ewma_error_rate += self.EWMA_ALPHA * (1.0 - health.ewma_error_rate)
+        health.consecutive_failures += 1
+        health.trial_in_flight = False
+
+        if health.circuit == "half_open" or (health.circuit == "closed" and (
+            health.consecutive_failures >= self.failure_threshold
+            or health.ewma_error_rate > self.ERROR_RATE_THRESHOLD
+        )):
+            self.trip(name)
+
+    def release_trial(self, name: str):
+        """Give back a half-open trial slot that was never used (request went elsewhere)"""
+        self.backends[name].trial_in_flight = False
+
+    def trip(self, name: str):
+        """Open a backend's circuit (no traffic until a probe succeeds)"""
+        health = self.backends[name]
+        if health.circuit != "open":
+            print(f"  🔴 {BACKEND_LABELS[name]} circuit opened after {health.consecutive_failures} consecutive failures")
+            health.circuit = "open"
+            health.circuit_opens += 1
+
+    def half_open(self, name: str):
+        """Allow a single trial request to an open backend (after a successful probe)"""
+        health = self.backends[name]
+        if health.circuit == "open":
+            print(f"  🟡 {BACKEND_LABELS[name]} probe succeeded, sending a trial request")
+            health.circuit = "half_open"
+            health.trial_in_flight = False
+            health.consecutive_failures = 0
+            health.ewma_error_rate = 0.0
+
+    def open_backends(self) -> List[str]:
+        """Backends whose circuit is currently open"""
+        return [name for name, health in self.backends.items() if health.circuit == "open"]
+
+
+class ProgressReporter:
+    """
+    Coalesces pipeline progress deltas and flushes them from a background task
+
+    Workers call add() (cheap, in memory); the accumulated deltas go out as one
+    increment_pipeline_progress RPC every `interval` seconds, or sooner once
+    `threshold` images have piled up. close() sends whatever is left.
+    """
+
+    def __init__(self, send: Callable[[int, int], bool], interval: float = 5.0, threshold: int = 500):
+        """
+        Args:
+            send: Sync callable that records (processed_delta, failed_delta), returning False on failure
+            interval: Max seconds between flushes while there is progress to report
+            threshold: Pending images that trigger an early flush
+        """
+        self.send = send
+        self.interval = interval
+        self.threshold = max(1, threshold)
+        self.processed = 0
+        self.failed = 0
+        self.flushes = 0
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def add(self, processed: int = 0, failed: int = 0):
+        """Record progress (flushed later)"""
+        self.processed += processed
+        self.failed += failed
+        if self._wake and self.processed + self.failed >= self.threshold:
+            self._wake.set()
+
+    def start(self):
+        """Start the background flush task (call from the event loop)"""
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    async def flush(self):
+        """Send the accumulated deltas now (kept for the next flush if the RPC fails)"""
+        processed, failed = self.processed, self.failed
+        if not processed and not failed:
+            return
+
+        self.processed = self.failed = 0
+        if await asyncio.to_thread(self.send, processed, failed):
+            self.flushes += 1
+        else:
+            self.processed += processed
+            self.failed += failed
+
+    async def close(self):
+        """Stop the background task and send the final deltas"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
 
 class BatchEmbeddingGenerator:
     """Generate embeddings in parallel with automatic failover"""
 
-    def __init__(self, parallel: int = 4, prefer_local: bool = True):
+    def __init__(
+        self,
+        parallel: int = 4,
+        prefer_local: bool = True,
+        streaming: bool = False,
+        download_workers: Optional[int] = None,
+        write_workers: int = 2,
+        queue_size: Optional[int] = None,
+        micro_batch: int = 8,
+        wire_format: str = "f32",
+        write_batch_size: int = 200,
+        lease_seconds: int = 600,
+        cache: Optional[EmbeddingCache] = None,
+        route_mode: str = "capacity",
+        circuit_failures: int = 5,
+        hedge: bool = False,
+        hedge_percentile: float = 95.0,
+        hedge_max_pct: float = 10.0,
+        preprocess_workers: int = 0,
+        journal: Optional[EmbeddingJournal] = None,
+        http2_storage: bool = False,
+        progress_interval: float = 5.0,
+        progress_threshold: int = 500,
+        prefetch_batches: int = 1,
+        prefetch_images: Optional[int] = None,
+        priority_weights: Optional[Dict[str, int]] = None,
+        max_attempts: int = 5,
+        retry_delay: int = 300,
+        server_fetch: bool = False
+    ):
         """
         Args:
             parallel: Number of concurrent requests (4-8 recommended for A2000)
             prefer_local: Try local GPU first before Modal
+            streaming: Use the pipelined download → inference → write mode
+            download_workers: Concurrent downloads in streaming mode (default: 2x parallel)
+            write_workers: Concurrent DB writers in streaming mode
+            queue_size: Max items buffered between stages (default: 2x parallel x micro_batch)
+            micro_batch: Images sent per inference request (1 = one request per image)
+            wire_format: "f32"/"f16" for raw image uploads and packed float responses, "json" for base64 JSON
+            write_batch_size: Max embeddings per bulk DB write in streaming mode
+            lease_seconds: How long claimed images stay reserved for this worker
+            cache: Content-addressed embedding cache (None disables caching)
+            route_mode: "capacity" to split traffic by measured throughput, "prefer-local" for pure failover
+            circuit_failures: Consecutive failures before a backend's circuit opens
+            hedge: Duplicate slow local requests to Modal (first answer wins)
+            hedge_percentile: Recent local latency percentile after which a request is hedged
+            hedge_max_pct: Max share of local requests (%) that may be hedged
+            preprocess_workers: Processes for client-side CLIP preprocessing (0 = upload originals)
+            journal: Crash-safe log of computed embeddings not yet written (None disables it)
+            http2_storage: Download images from storage over HTTP/2 (requires httpx + h2)
+            progress_interval: Max seconds between pipeline progress updates
+            progress_threshold: Processed/failed images that trigger an early progress update
+            prefetch_batches: Batches claimed ahead of the one being processed (0 = claim on demand)
+            prefetch_images: Images downloaded ahead per prefetched batch (default: one chunk, parallel x micro_batch)
+            priority_weights: Share of each claim per lane, e.g. {"onboarding": 8, "sync": 3, "backfill": 1}
+            max_attempts: Failed attempts before an image is dead-lettered
+            retry_delay: Seconds before the first retry of a failed image (doubles per attempt)
+            server_fetch: Send storage paths to backends that can download originals themselves
         """
         self.parallel = parallel
         self.prefer_local = prefer_local
+        self.streaming = streaming
+        self.download_workers = download_workers or parallel * 2
+        self.write_workers = max(1, write_workers)
+        self.micro_batch = max(1, min(micro_batch, MAX_MICRO_BATCH))
+        self.queue_size = queue_size or parallel * self.micro_batch * 2
+
+        self.wire_format = wire_format
+        self.write_batch_size = max(1, write_batch_size)
+
+        self.cache = cache
+        self.journal = journal
+
+        backends = []
+        if prefer_local:
+            backends.append("local")
+        if MODAL_FUNCTION_URL:
+            backends.append("modal")
+        self.router = BackendRouter(backends, mode=route_mode, failure_threshold=circuit_failures)
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_max_pct = hedge_max_pct
+        # Content address -> future for embeddings currently being generated
+        self._inflight: Dict[bytes, asyncio.Future] = {}
+
+        # Backends that answered 404/405 on /generate_batch_embeddings (older servers)
+        self.batch_unsupported = set()
+        # Backends that rejected binary uploads (older servers)
+        self.json_only = set()
+        # Client-side preprocessing: only used for backends that advertise tensor input
+        self.preprocess_pool = ProcessPoolExecutor(max_workers=preprocess_workers) if preprocess_workers else None
+        self.tensor_backends = set()
+        # Server-side fetch: only used for backends that advertise storage_path input
+        self.server_fetch = server_fetch
+        self.storage_backends = set()
+        # Storage downloads over HTTP/2 (httpx client, opened by run_async)
+        self.http2_storage = http2_storage
+        self.storage_client = None
         self.supabase: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
 
         # Get pipeline run ID from environment for progress tracking
@@ -76,19 +549,46 @@ class BatchEmbeddingGenerator:
             print("⚠️  Invalid PIPELINE_RUN_ID format, progress tracking disabled")
             pipeline_run_id = None
         self.pipeline_run_id = pipeline_run_id
-
-        # Statistics
+        self.progress = ProgressReporter(
+            self.increment_pipeline_progress, progress_interval, progress_threshold
+        ) if pipeline_run_id else None
+
+        # Work claiming: each process leases its own images (see fetch_pending_images)
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.lease_seconds = lease_seconds
+        self.priority_weights = priority_weights or parse_priority_weights(DEFAULT_PRIORITY_WEIGHTS)
+        # Claimed image id -> (priority class, local time it was queued), for queue latency
+        self._queued: Dict[str, Tuple[str, float]] = {}
+        # Failed image id -> (error class, permanent), recorded after each batch
+        self._failures: Dict[str, Tuple[str, bool]] = {}
+        self.max_attempts = max(1, max_attempts)
+        self.retry_delay = max(0, retry_delay)
+
+        # Prefetching: claimed-ahead batches and their first downloads (image id -> task)
+        self.prefetch_batches = max(0, prefetch_batches)
+        self.prefetch_images = parallel * self.micro_batch if prefetch_images is None else max(0, prefetch_images)
+        self._prefetched: Dict[str, asyncio.Task] = {}
+
+        # Statistics (counts here, latencies/bytes/error types in self.metrics)
+        self.metrics = PipelineMetrics()
         self.stats = {
             "local_count": 0,
             "modal_count": 0,
             "errors": 0,
             "total_processed": 0,
-            "local_times": [],
-            "modal_times": []
+            "prefetched_images": 0,
+            "server_fetched": 0,
+            "retries_scheduled": 0,
+            "dead_lettered": 0,
+            "hedge_eligible": 0,
+            "hedges_sent": 0,
+            "hedges_won": 0,
+            "hedge_wasted_images": 0,
+            "hedge_modal_seconds": 0.0
         }
 
     def check_local_health(self) -> bool:
-        """Check if local GPU is available"""
+        """Check if the local embedding server is up with its model loaded"""
         try:
             headers = {}
             if CLIP_API_KEY:
@@ -97,15 +597,52 @@ class BatchEmbeddingGenerator:
             response = requests.get(f"{LOCAL_CLIP_URL}/health", headers=headers, timeout=2)
             if response.ok:
                 data = response.json()
-                return data.get("status") == "ok" and data.get("gpu_available", True)
+                return health_ok(data)
         except Exception:
             return False
         return False
 
-    def increment_pipeline_progress(self, processed_delta: int, failed_delta: int):
-        """Atomically increment pipeline progress (safe for parallel execution)"""
+    def detect_input_formats(self):
+        """
+        Find backends that accept client-preprocessed tensors and storage paths
+        (listed in /health input_formats), for --client-preprocess and --server-fetch
+        """
+        for backend in self.router.backends:
+            base_url, headers, _ = self._backend_request_config(backend)
+            try:
+                response = requests.get(f"{base_url}/health", headers=headers, timeout=5)
+                formats = response.json().get("input_formats", []) if response.ok else []
+            except Exception:
+                formats = []
+
+            if self.preprocess_pool:
+                if TENSOR_MEDIA_TYPE in formats:
+                    self.tensor_backends.add(backend)
+                    print(f"✅ {BACKEND_LABELS[backend]} accepts preprocessed tensors")
+                else:
+                    print(f"⚠️  {BACKEND_LABELS[backend]} doesn't accept preprocessed tensors, uploading originals")
+
+            if self.server_fetch:
+                if "storage_path" in formats:
+                    self.storage_backends.add(backend)
+                    print(f"✅ {BACKEND_LABELS[backend]} fetches images from storage itself")
+                else:
+                    print(f"⚠️  {BACKEND_LABELS[backend]} can't fetch from storage, downloading its images here")
+
+        if self.server_fetch and not self.storage_backends:
+            self.server_fetch = False
+
+    def increment_pipeline_progress(self, processed_delta: int, failed_delta: int) -> bool:
+        """
+        Atomically increment pipeline progress (safe for parallel execution)
+
+        Called by ProgressReporter with coalesced deltas, not once per chunk.
+
+        Returns:
+            False if the update failed (the reporter retries the deltas on its next flush)
+        """
         if not self.pipeline_run_id:
-            return
+            return True
 
         try:
             # Use RPC function for atomic increment
@@ -114,9 +651,108 @@ class BatchEmbeddingGenerator:
                 'processed_delta': processed_delta,
                 'failed_delta': failed_delta
             }).execute()
+            return True
         except Exception as e:
             # Don't fail the job if progress update fails
             print(f"Warning: Failed to update pipeline progress: {e}")
+            return False
+
+    def fail_image(self, image_id: str, kind: str, permanent: bool = False):
+        """
+        Count a failed image and remember why (sent to record_embedding_failures after its batch)
+
+        Args:
+            image_id: Image that failed
+            kind: Error class, also used as the metrics error type (e.g. "download_timeout")
+            permanent: Retrying can't help (missing object, undecodable image) - dead-letter it now
+        """
+        self.stats["errors"] += 1
+        self.metrics.count_error(kind)
+        self._failures[image_id] = (kind, permanent)
+
+    def record_failures(self, image_ids: List[str]):
+        """Record this run's failures for the given images: back off transient ones, dead-letter permanent ones"""
+        failures = []
+        for image_id in image_ids:
+            failure = self._failures.pop(image_id, None)
+            if failure:
+                kind, permanent = failure
+                failures.append({"id": image_id, "error": kind, "permanent": permanent})
+        if not failures:
+            return
+
+        try:
+            response = self.supabase.rpc('record_embedding_failures', {
+                'failures': failures,
+                'p_max_attempts': self.max_attempts,
+                'p_base_delay_seconds': self.retry_delay,
+            }).execute()
+        except Exception as e:
+            # The leases still expire, so the images are retried either way
+            print(f"Warning: Failed to record {len(failures)} embedding failures: {e}")
+            return
+
+        dead_lettered = response.data if isinstance(response.data, int) else 0
+        self.stats["dead_lettered"] += dead_lettered
+        self.stats["retries_scheduled"] += len(failures) - dead_lettered
+        print(f"  ⏳ {len(failures) - dead_lettered} failed images will be retried later, {dead_lettered} dead-lettered")
+
+    def public_url(self, storage_path: str) -> str:
+        """Construct the public storage URL for an original image"""
+        return f"{SUPABASE_URL}/storage/v1/object/public/portfolio-images/{storage_path}"
+
+    async def download_image_async(
+        self,
+        session: aiohttp.ClientSession,
+        image_id: str,
+        image_url: str
+    ) -> Optional[bytes]:
+        """
+        Download a single image (or pick up its prefetched download)
+
+        Returns:
+            Image bytes, or None on error
+        """
+        prefetched = self._prefetched.pop(image_id, None)
+        if prefetched is not None:
+            self.stats["prefetched_images"] += 1
+            return await prefetched
+
+        return await self._fetch_image_async(session, image_id, image_url)
+
+    async def _fetch_image_async(
+        self,
+        session: aiohttp.ClientSession,
+        image_id: str,
+        image_url: str
+    ) -> Optional[bytes]:
+        """download_image_async() without the prefetch lookup"""
+        start = time.time()
+        try:
+            if self.storage_client is not None:
+                response = await self.storage_client.get(image_url)
+                status, image_bytes = response.status_code, response.content
+            else:
+                async with session.get(image_url, timeout=aiohttp.ClientTimeout(total=DOWNLOAD_TIMEOUT)) as response:
+                    status = response.status
+                    image_bytes = await response.read() if status == 200 else b""
+
+            if status != 200:
+                print(f"  ✗ Download failed for {image_id}: HTTP {status}")
+                self.fail_image(image_id, f"download_http_{status}", permanent=status in PERMANENT_HTTP_STATUSES)
+                return None
+        except DOWNLOAD_TIMEOUT_ERRORS:
+            print(f"  ✗ Download timed out for {image_id}")
+            self.fail_image(image_id, "download_timeout")
+            return None
+        except Exception as e:
+            print(f"  ✗ Download failed for {image_id}: {e}")
+            self.fail_image(image_id, f"download_{type(e).__name__}")
+            return None
+
+        self.metrics.observe("download", time.time() - start)
+        self.metrics.count_bytes("downloaded", len(image_bytes))
+        return image_bytes
 
     async def generate_embedding_async(
         self,
@@ -125,204 +761,1104 @@ class BatchEmbeddingGenerator:
         image_url: str
     ) -> Optional[Dict]:
         """
-        Generate embedding for a single image with failover
+        Download a single image and generate its embedding with failover
 
         Returns:
             Dict with image_id, embedding, and source, or None on error
         """
+        image_bytes = await self.download_image_async(session, image_id, image_url)
+        if image_bytes is None:
+            return None
+
+        return await self.embed_image_async(session, image_id, image_bytes)
+
+    async def embed_image_async(
+        self,
+        session: aiohttp.ClientSession,
+        image_id: str,
+        image_bytes: bytes
+    ) -> Optional[Dict]:
+        """
+        Generate embedding for downloaded image bytes (local GPU first, then Modal)
+
+        Returns:
+            Dict with image_id, embedding, and source, or None on error
+        """
+        results = await self.embed_images_async(session, [(image_id, image_bytes)])
+        return results[0]
+
+    async def embed_images_async(
+        self,
+        session: aiohttp.ClientSession,
+        items: List[Tuple[str, bytes]]
+    ) -> List[Optional[Dict]]:
+        """
+        Generate embeddings for downloaded images, using the content-addressed cache
+
+        Cache hits skip inference entirely. Images identical to one already being
+        embedded wait for that result instead of sending a duplicate request.
+
+        Returns:
+            One result dict (or None on error) per input item, in order
+        """
+        if self.cache is None:
+            return await self._embed_on_backends_async(session, items)
+
+        loop = asyncio.get_running_loop()
+        results: List[Optional[Dict]] = [None] * len(items)
+        to_embed = []  # (index, image_id, image_bytes, digest, future)
+        waiting = []   # (index, image_id, future)
+
+        # Hashing and SQLite lookups stay off the event loop
+        digests, cached = await asyncio.to_thread(self._cache_lookup, [image_bytes for _, image_bytes in items])
+
+        for i, ((image_id, image_bytes), digest, embedding) in enumerate(zip(items, digests, cached)):
+            if embedding is not None:
+                results[i] = {"image_id": image_id, "embedding": embedding, "source": "cache"}
+            elif digest in self._inflight:
+                self.cache.coalesced += 1
+                waiting.append((i, image_id, self._inflight[digest]))
+            else:
+                future = loop.create_future()
+                self._inflight[digest] = future
+                to_embed.append((i, image_id, image_bytes, digest, future))
 
-        # Download image
         try:
-            async with session.get(image_url, timeout=aiohttp.ClientTimeout(total=10)) as response:
-                if response.status != 200:
-                    print(f"  ✗ Download failed for {image_id}: HTTP {response.status}")
-                    self.stats["errors"] += 1
-                    return None
+            if to_embed:
+                embedded = await self._embed_on_backends_async(
+                    session, [(image_id, image_bytes) for _, image_id, image_bytes, _, _ in to_embed]
+                )
+                for (i, _, _, digest, future), result in zip(to_embed, embedded):
+                    results[i] = result
+                    future.set_result(result["embedding"] if result else None)
+                await asyncio.to_thread(self._cache_store, [
+                    (digest, result["embedding"])
+                    for (_, _, _, digest, _), result in zip(to_embed, embedded) if result
+                ])
+        finally:
+            # Never leave duplicates waiting on a request that was cancelled or raised
+            for _, _, _, digest, future in to_embed:
+                self._inflight.pop(digest, None)
+                if not future.done():
+                    future.set_result(None)
+
+        for i, image_id, future in waiting:
+            embedding = await future
+            if embedding is None:
+                self.fail_image(image_id, "duplicate_of_failed")
+            else:
+                results[i] = {"image_id": image_id, "embedding": embedding, "source": "cache"}
+
+        return results
+
+    async def embed_from_storage_async(
+        self,
+        session: aiohttp.ClientSession,
+        images: List[Dict]
+    ) -> List[Optional[Dict]]:
+        """
+        Generate embeddings for claimed images by storage path (--server-fetch)
 
-                image_bytes = await response.read()
-        except Exception as e:
-            print(f"  ✗ Download failed for {image_id}: {e}")
-            self.stats["errors"] += 1
-            return None
+        The backend downloads the originals from storage itself, so image bytes
+        cross the network once instead of coming here and being uploaded again.
+        If the preferred backend can't fetch from storage, the images are
+        downloaded here and embedded the usual way.
 
-        # Convert to base64
-        base64_image = base64.b64encode(image_bytes).decode('utf-8')
+        Returns:
+            One result dict (or None on error) per input image, in order
+        """
+        label = images[0]["id"] if len(images) == 1 else f"batch of {len(images)}"
+        backends = self.router.order()
+
+        for i, backend in enumerate(backends):
+            if backend not in self.storage_backends:
+                for unused in backends[i:]:
+                    self.router.release_trial(unused)
+                return await self._download_and_embed_async(session, images)
 
-        # Try local GPU first
-        if self.prefer_local:
+            fallback_note = f", trying {BACKEND_LABELS[backends[i + 1]]}..." if i + 1 < len(backends) else ""
             start = time.time()
             try:
-                headers = {}
-                if CLIP_API_KEY:
-                    headers['Authorization'] = f'Bearer {CLIP_API_KEY}'
-
-                async with session.post(
-                    f"{LOCAL_CLIP_URL}/generate_single_embedding",
-                    json={"image_data": base64_image},
-                    headers=headers,
-                    timeout=aiohttp.ClientTimeout(total=LOCAL_TIMEOUT)
-                ) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        embedding = data["embedding"]
-
-                        if len(embedding) == 768:
-                            latency = time.time() - start
-                            self.stats["local_count"] += 1
-                            self.stats["local_times"].append(latency)
-                            return {
-                                "image_id": image_id,
-                                "embedding": embedding,
-                                "source": "local"
-                            }
+                embeddings, errors = await self._request_storage_embeddings_async(session, backend, images)
+            except StorageFetchUnsupported:
+                print(f"  ⚠️  {BACKEND_LABELS[backend]} has no storage endpoint, downloading its images here")
+                self.storage_backends.discard(backend)
+                for unused in backends[i:]:
+                    self.router.release_trial(unused)
+                return await self._download_and_embed_async(session, images)
             except asyncio.TimeoutError:
-                print(f"  ⚠️  Local GPU timeout for {image_id}, trying Modal...")
+                print(f"  ⚠️  {BACKEND_LABELS[backend]} timeout for {label}{fallback_note}")
+                self.router.record_failure(backend)
+                self.metrics.count_error(f"{backend}_timeout")
+                continue
             except Exception as e:
-                print(f"  ⚠️  Local GPU failed for {image_id}: {e}, trying Modal...")
+                print(f"  ⚠️  {BACKEND_LABELS[backend]} failed for {label}: {e}{fallback_note}")
+                self.router.record_failure(backend)
+                self.metrics.count_error(f"{backend}_{type(e).__name__}")
+                continue
+
+            elapsed = time.time() - start
+            self.metrics.observe(f"inference_{backend}", elapsed)
+            self.router.record_success(backend, elapsed / len(images))
+            for unused in backends[i + 1:]:
+                self.router.release_trial(unused)
+
+            results = []
+            for img, embedding, error in zip(images, embeddings, errors):
+                if embedding is None or len(embedding) != EMBEDDING_DIM:
+                    kind, permanent = error or ("undecodable", True)
+                    print(f"  ✗ {BACKEND_LABELS[backend]} could not embed {img['id']}: {kind}")
+                    # Download errors keep the class they'd have if fetched here
+                    self.fail_image(img["id"], kind if kind.startswith("download_") else f"{backend}_{kind}", permanent)
+                    results.append(None)
+                    continue
+
+                self.stats[f"{backend}_count"] += 1
+                self.stats["server_fetched"] += 1
+                results.append({"image_id": img["id"], "embedding": embedding, "source": backend})
+
+            if self.journal:
+                await asyncio.to_thread(self.journal.append, [(r["image_id"], r["embedding"]) for r in results if r])
+            return results
+
+        if "modal" not in backends:
+            print(f"  ✗ Modal fallback not configured, skipping {label}")
+        for img in images:
+            self.fail_image(img["id"], "all_backends_failed")
+        return [None] * len(images)
+
+    async def _download_and_embed_async(
+        self,
+        session: aiohttp.ClientSession,
+        images: List[Dict]
+    ) -> List[Optional[Dict]]:
+        """Download claimed images here and embed their bytes (backends that can't fetch from storage)"""
+        downloads = await asyncio.gather(*(
+            self.download_image_async(session, img["id"], self.public_url(img["storage_original_path"]))
+            for img in images
+        ))
+        items = [(img["id"], data) for img, data in zip(images, downloads) if data is not None]
+        embedded = iter(await self.embed_images_async(session, items) if items else [])
+        return [next(embedded) if data is not None else None for data in downloads]
+
+    def _cache_lookup(self, images: List[bytes]) -> Tuple[List[bytes], List[Optional[List[float]]]]:
+        """Content addresses and cached embeddings (None on miss) for downloaded images"""
+        digests = [self.cache.key(image_bytes) for image_bytes in images]
+        return digests, [self.cache.get(digest) for digest in digests]
+
+    def _cache_store(self, entries: List[Tuple[bytes, List[float]]]):
+        """Store freshly generated embeddings under their content addresses"""
+        for digest, embedding in entries:
+            self.cache.put(digest, embedding)
+
+    async def _embed_on_backends_async(
+        self,
+        session: aiohttp.ClientSession,
+        items: List[Tuple[str, bytes]]
+    ) -> List[Optional[Dict]]:
+        """
+        Generate embeddings for downloaded images, trying each backend in turn
 
-        # Fallback to Modal
-        if not MODAL_FUNCTION_URL:
-            print(f"  ✗ Modal fallback not configured, skipping {image_id}")
-            self.stats["errors"] += 1
+        Several images go out as one micro-batch request. If the preferred backend has
+        no batch endpoint, the images are sent one per request instead, so an older
+        local server still takes priority over Modal.
+
+        Returns:
+            One result dict (or None on error) per input item, in order
+        """
+        images = [image_bytes for _, image_bytes in items]
+        label = items[0][0] if len(items) == 1 else f"batch of {len(items)}"
+        backends = self.router.order()
+        hedge_backend = self._hedge_backend(backends)
+        tensors = None
+
+        for i, backend in enumerate(backends):
+            if len(items) > 1 and backend in self.batch_unsupported:
+                for unused in backends[i:]:
+                    self.router.release_trial(unused)
+                return await self._embed_individually_async(session, items)
+
+            if tensors is None and self.preprocess_pool and {backend, hedge_backend} & self.tensor_backends:
+                tensors = await self._preprocess_images_async(images)
+
+            fallback_note = f", trying {BACKEND_LABELS[backends[i + 1]]}..." if i + 1 < len(backends) else ""
+            start = time.time()
+            try:
+                if i == 0 and hedge_backend:
+                    backend, embeddings, start = await self._hedged_request_async(
+                        session, backend, hedge_backend, images, tensors
+                    )
+                else:
+                    embeddings = await self._request_embeddings_async(session, backend, images, tensors)
+            except HedgeFailed as e:
+                # Both backends already had their attempt
+                print(f"  ⚠️  {label} failed on {BACKEND_LABELS[backend]} and its hedge: {e}")
+                for unused in backends[i + 1:]:
+                    self.router.release_trial(unused)
+                break
+            except BatchEndpointUnsupported:
+                print(f"  ⚠️  {BACKEND_LABELS[backend]} has no batch endpoint, sending images individually")
+                self.batch_unsupported.add(backend)
+                for unused in backends[i:]:
+                    self.router.release_trial(unused)
+                return await self._embed_individually_async(session, items)
+            except asyncio.TimeoutError:
+                print(f"  ⚠️  {BACKEND_LABELS[backend]} timeout for {label}{fallback_note}")
+                self.router.record_failure(backend)
+                self.metrics.count_error(f"{backend}_timeout")
+                continue
+            except Exception as e:
+                print(f"  ⚠️  {BACKEND_LABELS[backend]} failed for {label}: {e}{fallback_note}")
+                self.router.record_failure(backend)
+                self.metrics.count_error(f"{backend}_{type(e).__name__}")
+                continue
+
+            elapsed = time.time() - start
+            self.metrics.observe(f"inference_{backend}", elapsed)
+            if any(embedding is not None for embedding in embeddings):
+                # Route on per-image latency so averages stay comparable across batch sizes
+                self.router.record_success(backend, elapsed / len(items))
+            else:
+                # Only undecodable images - says nothing about the backend's latency or health
+                self.router.release_trial(backend)
+            for unused in backends[i + 1:]:
+                self.router.release_trial(unused)
+            results = []
+            for (image_id, _), embedding in zip(items, embeddings):
+                if embedding is None or len(embedding) != EMBEDDING_DIM:
+                    print(f"  ✗ {BACKEND_LABELS[backend]} could not embed {image_id}")
+                    self.fail_image(image_id, f"{backend}_undecodable", permanent=True)
+                    results.append(None)
+                    continue
+
+                self.stats[f"{backend}_count"] += 1
+                results.append({
+                    "image_id": image_id,
+                    "embedding": embedding,
+                    "source": backend
+                })
+
+            # GPU work is the expensive part - keep it safe until the DB write is confirmed
+            if self.journal:
+                await asyncio.to_thread(self.journal.append, [(r["image_id"], r["embedding"]) for r in results if r])
+            return results
+
+        if "modal" not in backends:
+            print(f"  ✗ Modal fallback not configured, skipping {label}")
+        for image_id, _ in items:
+            self.fail_image(image_id, "all_backends_failed")
+        return [None] * len(items)
+
+    async def _embed_individually_async(
+        self,
+        session: aiohttp.ClientSession,
+        items: List[Tuple[str, bytes]]
+    ) -> List[Optional[Dict]]:
+        """Embed each image with its own request (for backends without a batch endpoint)"""
+        results = await asyncio.gather(
+            *(self._embed_on_backends_async(session, [item]) for item in items)
+        )
+        return [single[0] for single in results]
+
+    async def _preprocess_images_async(self, images: List[bytes]) -> List[Optional[bytes]]:
+        """Resize/center-crop images to CLIP input tensors in the process pool (None = couldn't decode)"""
+        loop = asyncio.get_running_loop()
+        start = time.time()
+        tensors = await asyncio.gather(
+            *(loop.run_in_executor(self.preprocess_pool, preprocess_to_uint8, image_bytes) for image_bytes in images)
+        )
+        self.metrics.observe("preprocess", time.time() - start)
+        return tensors
+
+    def _hedge_backend(self, backends: List[str]) -> Optional[str]:
+        """Backend to hedge the next request to, if the request goes to the local GPU first"""
+        if not self.hedge or len(backends) < 2 or backends[0] != "local" or "modal" not in backends:
+            return None
+        if self.router.backends["local"].circuit != "closed" or self.router.backends["modal"].circuit != "closed":
             return None
+        return "modal"
 
+    def _hedge_budget_available(self) -> bool:
+        """Whether one more hedge stays within hedge_max_pct of eligible requests"""
+        return self.stats["hedges_sent"] + 1 <= self.stats["hedge_eligible"] * self.hedge_max_pct / 100
+
+    async def _hedged_request_async(
+        self,
+        session: aiohttp.ClientSession,
+        primary: str,
+        hedge: str,
+        images: List[bytes],
+        tensors: Optional[List[Optional[bytes]]] = None
+    ) -> Tuple[str, List[Optional[List[float]]], float]:
+        """
+        Send a request to the primary backend and duplicate it to the hedge backend
+        if it hasn't answered by the primary's recent latency percentile
+
+        Whichever backend answers first wins and the other request is cancelled.
+        Hedges are capped at hedge_max_pct of eligible requests.
+
+        Returns:
+            (backend that answered, embeddings, time its request started)
+
+        Raises:
+            HedgeFailed: If the hedge was sent and both requests failed
+            Exception: The primary's error if it failed before a hedge was sent
+        """
         start = time.time()
+        primary_task = asyncio.ensure_future(self._request_embeddings_async(session, primary, images, tensors))
+        self.stats["hedge_eligible"] += 1
+
+        percentile = self.router.backends[primary].latency_percentile(self.hedge_percentile)
+        if percentile is None or not self._hedge_budget_available():
+            return primary, await primary_task, start
+
+        try:
+            done, _ = await asyncio.wait({primary_task}, timeout=percentile * len(images))
+        except asyncio.CancelledError:
+            primary_task.cancel()
+            raise
+        # Other requests may have used up the budget while this one waited
+        if done or not self._hedge_budget_available():
+            return primary, await primary_task, start
+
+        self.stats["hedges_sent"] += 1
+        hedge_start = time.time()
+        hedge_task = asyncio.ensure_future(self._request_embeddings_async(session, hedge, images, tensors))
+        starts = {primary_task: (primary, start), hedge_task: (hedge, hedge_start)}
+        pending = {primary_task, hedge_task}
+        errors = []
+
         try:
-            async with session.post(
-                f"{MODAL_FUNCTION_URL}/generate_single_embedding",
-                json={"image_data": base64_image},
-                timeout=aiohttp.ClientTimeout(total=30)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    backend, task_start = starts[task]
+                    try:
+                        embeddings = task.result()
+                    except BatchEndpointUnsupported:
+                        print(f"  ⚠️  {BACKEND_LABELS[backend]} has no batch endpoint, sending images individually")
+                        self.batch_unsupported.add(backend)
+                        errors.append(f"{BACKEND_LABELS[backend]}: no batch endpoint")
+                        continue
+                    except Exception as e:
+                        self.router.record_failure(backend)
+                        self.metrics.count_error(
+                            f"{backend}_timeout" if isinstance(e, asyncio.TimeoutError) else f"{backend}_{type(e).__name__}"
+                        )
+                        errors.append(f"{BACKEND_LABELS[backend]}: {e or type(e).__name__}")
+                        continue
+
+                    if backend == hedge:
+                        self.stats["hedges_won"] += 1
+                    if pending:
+                        # The loser's work is the price of the hedge
+                        self.stats["hedge_wasted_images"] += len(images)
+                    return backend, embeddings, task_start
+        finally:
+            for task in pending:
+                task.cancel()
+            self.stats["hedge_modal_seconds"] += time.time() - hedge_start
+
+        raise HedgeFailed("; ".join(errors))
+
+    async def _probe_backend_async(self, session: aiohttp.ClientSession, backend: str) -> bool:
+        """Health-check a backend (servers without a /health route count as reachable)"""
+        base_url, headers, _ = self._backend_request_config(backend)
+        try:
+            async with session.get(
+                f"{base_url}/health",
+                headers=headers,
+                timeout=aiohttp.ClientTimeout(total=5)
             ) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    embedding = data["embedding"]
-
-                    latency = time.time() - start
-                    self.stats["modal_count"] += 1
-                    self.stats["modal_times"].append(latency)
-                    return {
-                        "image_id": image_id,
-                        "embedding": embedding,
-                        "source": "modal"
-                    }
+                if response.status == 404:
+                    return True
+                if response.status != 200:
+                    return False
+                data = await response.json()
+                return health_ok(data)
+        except Exception:
+            return False
+
+    async def run_backend_probes(self, session: aiohttp.ClientSession):
+        """Background task: probe backends with open circuits so they can recover"""
+        while True:
+            await asyncio.sleep(PROBE_INTERVAL)
+            for backend in self.router.open_backends():
+                if await self._probe_backend_async(session, backend):
+                    self.router.half_open(backend)
+
+    def _backend_request_config(self, backend: str) -> Tuple[str, Dict, int]:
+        """Base URL, auth headers and timeout for an embedding backend"""
+        if backend == "local":
+            headers = {}
+            if CLIP_API_KEY:
+                headers['Authorization'] = f'Bearer {CLIP_API_KEY}'
+            return LOCAL_CLIP_URL, headers, LOCAL_TIMEOUT
+        return MODAL_FUNCTION_URL, {}, MODAL_TIMEOUT
+
+    async def _request_embeddings_async(
+        self,
+        session: aiohttp.ClientSession,
+        backend: str,
+        images: List[bytes],
+        tensors: Optional[List[Optional[bytes]]] = None
+    ) -> List[Optional[List[float]]]:
+        """
+        Send one embedding request to a backend
+
+        A single image goes to /generate_single_embedding and several go to
+        /generate_batch_embeddings. Images are sent as raw bytes (multipart for
+        batches) and packed floats are requested via the Accept header, unless
+        the backend has rejected the binary format before - then base64 JSON is used.
+
+        If client-side preprocessing produced tensors and the backend accepts them,
+        each image is uploaded as its 224x224 uint8 tensor instead (originals are
+        still sent for images the client couldn't decode).
+
+        Returns:
+            One embedding per image (None for images the server could not decode,
+            including a single image answered with 422 + X-Embedding-Failed: 0)
+
+        Raises:
+            BatchEndpointUnsupported: If the backend has no batch endpoint
+            EmbeddingRequestError: If the backend answered with an error
+        """
+        base_url, headers, timeout = self._backend_request_config(backend)
+        headers = dict(headers)
+        batch = len(images) > 1
+        endpoint = "generate_batch_embeddings" if batch else "generate_single_embedding"
+        if batch:
+            timeout *= 2
+        binary = self.wire_format != "json" and backend not in self.json_only
+
+        encode_start = time.time()
+        if binary:
+            headers["Accept"] = f"{WIRE_MEDIA_TYPES[self.wire_format]}, application/json"
+            payloads = []
+            for i, image_bytes in enumerate(images):
+                if tensors is not None and tensors[i] is not None and backend in self.tensor_backends:
+                    payloads.append((tensors[i], TENSOR_MEDIA_TYPE))
                 else:
-                    error_text = await response.text()
-                    print(f"  ✗ Modal failed for {image_id}: HTTP {response.status} - {error_text}")
-        except Exception as e:
-            print(f"  ✗ Modal failed for {image_id}: {e}")
+                    payloads.append((image_bytes, "application/octet-stream"))
+
+            if batch:
+                form = aiohttp.FormData()
+                for i, (payload, media_type) in enumerate(payloads):
+                    form.add_field("images", payload, filename=f"image-{i}", content_type=media_type)
+                request_kwargs = {"data": form}
+            else:
+                headers["Content-Type"] = payloads[0][1]
+                request_kwargs = {"data": payloads[0][0]}
+            upload_bytes = sum(len(payload) for payload, _ in payloads)
+        else:
+            encoded = [base64.b64encode(image_bytes).decode('utf-8') for image_bytes in images]
+            request_kwargs = {"json": {"images": encoded} if batch else {"image_data": encoded[0]}}
+            upload_bytes = sum(len(data) for data in encoded)
+        self.metrics.observe("encode", time.time() - encode_start)
+        self.metrics.count_bytes("uploaded", upload_bytes)
+
+        async with session.post(
+            f"{base_url}/{endpoint}",
+            headers=headers,
+            timeout=aiohttp.ClientTimeout(total=timeout),
+            **request_kwargs
+        ) as response:
+            if batch and response.status in (404, 405):
+                raise BatchEndpointUnsupported(f"HTTP {response.status}")
+
+            if not batch and response.status == 422 and response.headers.get("X-Embedding-Failed") == "0":
+                # The server couldn't decode the image - an answer about the image, not a backend failure
+                return [None]
+
+            if binary and response.status in (415, 422):
+                # Older servers only accept base64 JSON bodies
+                print(f"  ⚠️  {BACKEND_LABELS[backend]} rejected binary upload, falling back to JSON")
+                self.json_only.add(backend)
+                return await self._request_embeddings_async(session, backend, images)
+
+            if response.status != 200:
+                error_text = await response.text()
+                raise EmbeddingRequestError(f"HTTP {response.status} - {error_text[:200]}")
+
+            content_type = response.headers.get("Content-Type", "").split(";")[0].strip().lower()
+            body = await response.read()
+            self.metrics.count_bytes("received", len(body))
+            if content_type in WIRE_STRUCT_FORMATS:
+                embeddings = unpack_embeddings(
+                    body, content_type, len(images), response.headers.get("X-Embedding-Failed", "")
+                )
+            else:
+                data = json.loads(body)
+                embeddings = data["embeddings"] if batch else [data["embedding"]]
+
+        if len(embeddings) != len(images):
+            raise EmbeddingRequestError(f"Got {len(embeddings)} embeddings for {len(images)} images")
+        return embeddings
+
+    async def _request_storage_embeddings_async(
+        self,
+        session: aiohttp.ClientSession,
+        backend: str,
+        images: List[Dict]
+    ) -> Tuple[List[Optional[List[float]]], List[Optional[Tuple[str, bool]]]]:
+        """
+        Ask a backend to download images from storage and embed them (/generate_embeddings_from_storage)
 
-        self.stats["errors"] += 1
-        return None
+        Only ids and storage paths go up. Packed floats are requested via the Accept
+        header unless the wire format is JSON (or the backend rejected binary before).
 
-    async def process_batch_async(self, images: List[Dict]):
-        """Process a batch of images in parallel"""
+        Returns:
+            (embeddings, errors) in request order - errors are (error class, permanent)
+            for images the server couldn't fetch or decode
 
-        async with aiohttp.ClientSession() as session:
-            # Process in chunks to avoid overwhelming GPU
-            chunk_size = self.parallel
+        Raises:
+            StorageFetchUnsupported: If the backend has no storage endpoint
+            EmbeddingRequestError: If the backend answered with an error
+        """
+        base_url, headers, timeout = self._backend_request_config(backend)
+        headers = dict(headers)
+        headers["Content-Type"] = "application/json"
+        if self.wire_format != "json" and backend not in self.json_only:
+            headers["Accept"] = f"{WIRE_MEDIA_TYPES[self.wire_format]}, application/json"
+
+        payload = json.dumps({
+            "images": [{"id": img["id"], "storage_path": img["storage_original_path"]} for img in images]
+        }).encode()
+        self.metrics.count_bytes("uploaded", len(payload))
+
+        async with session.post(
+            f"{base_url}/generate_embeddings_from_storage",
+            headers=headers,
+            # The server downloads the images before its forward pass
+            timeout=aiohttp.ClientTimeout(total=timeout * 2 + DOWNLOAD_TIMEOUT),
+            data=payload
+        ) as response:
+            if response.status in (404, 405):
+                raise StorageFetchUnsupported(f"HTTP {response.status}")
+            if response.status != 200:
+                error_text = await response.text()
+                raise EmbeddingRequestError(f"HTTP {response.status} - {error_text[:200]}")
+
+            content_type = response.headers.get("Content-Type", "").split(";")[0].strip().lower()
+            body = await response.read()
+            self.metrics.count_bytes("received", len(body))
+            if content_type in WIRE_STRUCT_FORMATS:
+                embeddings = unpack_embeddings(
+                    body, content_type, len(images), response.headers.get("X-Embedding-Failed", "")
+                )
+                failed = json.loads(response.headers.get("X-Embedding-Errors") or "{}")
+                errors = [tuple(failed[str(i)]) if str(i) in failed else None for i in range(len(images))]
+            else:
+                data = json.loads(body)
+                embeddings = [data["embeddings"].get(img["id"]) for img in images]
+                errors = [
+                    (data["errors"][img["id"]]["error"], data["errors"][img["id"]]["permanent"])
+                    if img["id"] in data["errors"] else None
+                    for img in images
+                ]
+
+        return embeddings, errors
+
+    def store_embeddings(self, results: List[Dict]) -> int:
+        """
+        Write a chunk of embeddings with one RPC and mark the images active
 
-            for i in range(0, len(images), chunk_size):
-                chunk = images[i:i+chunk_size]
-                chunk_start = time.time()
+        Falls back to one update per image if the bulk RPC isn't available.
 
-                print(f"\n  Processing chunk {i//chunk_size + 1}/{(len(images)-1)//chunk_size + 1} ({len(chunk)} images)...")
+        Returns:
+            Number of rows written (images no longer pending are left unchanged)
+        """
+        if not results:
+            return 0
 
-                # Generate embeddings in parallel
-                tasks = []
-                for img in chunk:
-                    storage_path = img["storage_original_path"]
-                    # Construct public URL
-                    public_url = f"{SUPABASE_URL}/storage/v1/object/public/portfolio-images/{storage_path}"
+        updates = [
+            {"id": r["image_id"], "status": "active", "embedding": format_embedding(r["embedding"])}
+            for r in results
+        ]
 
-                    task = self.generate_embedding_async(session, img["id"], public_url)
-                    tasks.append(task)
+        start = time.time()
+        try:
+            response = self.supabase.rpc('bulk_update_image_embeddings', {'updates': updates}).execute()
+        except Exception as e:
+            print(f"  ⚠️  Bulk write failed ({e}), falling back to per-image updates")
+            self.metrics.count_error(f"db_bulk_write_{type(e).__name__}")
+            stored = sum(1 for r in results if self.store_embedding(r))
+            self.metrics.observe("db_write", time.time() - start)
+            return stored
+        self.metrics.observe("db_write", time.time() - start)
+
+        updated = response.data if isinstance(response.data, int) else len(results)
+        image_ids = [r["image_id"] for r in results]
+        if updated < len(results):
+            print(f"  ⚠️  {len(results) - updated} images were no longer pending and were left unchanged")
+            # The RPC only returns a count, so the skipped rows can't be told apart -
+            # drop this chunk's queue timings rather than record rows we didn't write
+            for image_id in image_ids:
+                self._queued.pop(image_id, None)
+        else:
+            self.record_queue_latency(image_ids)
+        self.stats["total_processed"] += updated
+        if self.journal:
+            self.journal.confirm(image_ids)  # Written or not, nothing left to replay
+
+        sources = {
+            source: sum(1 for r in results if r["source"] == source)
+            for source in ("local", "modal", "cache", "journal")
+        }
+        journal_note = f", {sources['journal']} from journal" if sources['journal'] else ""
+        submitted_note = f" of {len(results)}" if updated < len(results) else ""
+        print(f"    ✅ Stored {updated}{submitted_note} embeddings "
+              f"({sources['local']} local, {sources['modal']} modal, {sources['cache']} cached{journal_note})")
+        return updated
+
+    def record_queue_latency(self, image_ids: List[str]):
+        """Record insert-to-written latency per lane for images claimed by this run"""
+        now = time.time()
+        for image_id in image_ids:
+            queued = self._queued.pop(image_id, None)
+            if queued:
+                lane, queued_at = queued
+                self.metrics.observe(f"queue_{lane}", now - queued_at)
+
+    def store_embedding(self, result: Dict) -> bool:
+        """Write a single embedding to the database and mark the image active (False if not written)"""
+        embedding = result["embedding"]
+        image_id = result["image_id"]
+        source = result["source"]
 
-                # Wait for all tasks in chunk
-                results = await asyncio.gather(*tasks)
+        try:
+            response = self.supabase.table("portfolio_images").update({
+                "embedding": format_embedding(embedding),
+                "status": "active"
+            }).eq("id", image_id).eq("status", "pending").execute()
+
+            if self.journal:
+                self.journal.confirm([image_id])
+            if not response.data:
+                # No longer pending (written by another worker, or deleted)
+                self._queued.pop(image_id, None)
+                print(f"    ⏭️  {image_id[:8]}... no longer pending, left unchanged")
+                return False
+
+            self.stats["total_processed"] += 1
+            self.record_queue_latency([image_id])
+
+            # Log source
+            emoji = {"local": "✅", "cache": "💾", "journal": "📒"}.get(source, "🔄")
+            print(f"    {emoji} {image_id[:8]}... ({source})")
+            return True
 
-                # Update database for successful embeddings
-                for result in results:
-                    if result:
-                        embedding = result["embedding"]
-                        image_id = result["image_id"]
-                        source = result["source"]
+        except Exception as e:
+            print(f"  ✗ DB update failed for {image_id}: {e}")
+            self.stats["errors"] += 1
+            self.metrics.count_error(f"db_write_{type(e).__name__}")
+            return False
 
-                        try:
-                            # Format embedding as PostgreSQL array string
-                            embedding_str = f"[{','.join(map(str, embedding))}]"
+    def create_session(self) -> aiohttp.ClientSession:
+        """
+        One pooled HTTP session for the whole run (storage downloads, inference, probes)
 
-                            self.supabase.table("portfolio_images").update({
-                                "embedding": embedding_str,
-                                "status": "active"
-                            }).eq("id", image_id).execute()
+        Connections are kept alive between batches and DNS answers are cached, so
+        only the first batch pays for TCP/TLS handshakes and lookups.
+        """
+        # Storage downloads and inference requests each get a full pool per host
+        per_host = self.download_workers + self.parallel * 2
+        connector = aiohttp.TCPConnector(
+            limit=per_host * 3,  # Storage, local GPU, Modal
+            limit_per_host=per_host,
+            ttl_dns_cache=DNS_CACHE_SECONDS,
+            keepalive_timeout=KEEPALIVE_SECONDS,
+        )
+        return aiohttp.ClientSession(connector=connector)
+
+    def create_storage_client(self):
+        """HTTP/2 client for storage downloads (all downloads multiplexed over a few connections)"""
+        return httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(
+                max_connections=STORAGE_HTTP2_CONNECTIONS,
+                max_keepalive_connections=STORAGE_HTTP2_CONNECTIONS,
+                keepalive_expiry=KEEPALIVE_SECONDS,
+            ),
+            timeout=DOWNLOAD_TIMEOUT,
+        )
 
-                            self.stats["total_processed"] += 1
+    async def run_async(
+        self,
+        batch_size: int = 100,
+        location: Optional[Dict[str, str]] = None,
+        max_batches: int = 100
+    ) -> int:
+        """
+        Claim and process batches until nothing is pending or max_batches is reached
 
-                            # Log source
-                            emoji = "✅" if source == "local" else "🔄"
-                            print(f"    {emoji} {image_id[:8]}... ({source})")
+        The whole run shares one event loop, one HTTP session and one set of backend
+        probes. Supabase calls (sync client) run in worker threads so they never
+        block downloads or inference. The next prefetch_batches batches are claimed
+        (and the first images of each downloaded) while the current one is processed,
+        so the GPU doesn't sit idle at batch boundaries.
 
-                        except Exception as e:
-                            print(f"  ✗ DB update failed for {image_id}: {e}")
-                            self.stats["errors"] += 1
+        Args:
+            batch_size: Images claimed per batch
+            location: Optional city/region/country filter (see location_filter)
+            max_batches: Maximum batches to process
 
-                chunk_time = time.time() - chunk_start
-                print(f"  ✓ Chunk completed in {chunk_time:.1f}s")
+        Returns:
+            Number of images claimed
+        """
+        total_claimed = 0
+
+        async with self.create_session() as session:
+            if self.http2_storage:
+                self.storage_client = self.create_storage_client()
+            probe_task = asyncio.create_task(self.run_backend_probes(session))
+            if self.progress:
+                self.progress.start()
+
+            # Claimed batches waiting to be processed. A slot is taken before each claim
+            # and freed when the batch is picked up, so at most prefetch_batches are
+            # leased ahead of the one being processed.
+            batches: asyncio.Queue = asyncio.Queue()
+            slots = asyncio.Semaphore(self.prefetch_batches)
+            claim_task = None
+            if self.prefetch_batches:
+                claim_task = asyncio.create_task(
+                    self._claim_batches_async(session, batches, slots, batch_size, location, max_batches)
+                )
 
-                # Update progress after each chunk - increment by successful count
-                if self.pipeline_run_id:
-                    # Count successful and failed in this chunk
-                    successful_in_chunk = sum(1 for r in results if r is not None)
-                    failed_in_chunk = len(results) - successful_in_chunk
-                    self.increment_pipeline_progress(successful_in_chunk, failed_in_chunk)
+            try:
+                for _ in range(max_batches):
+                    # Time spent waiting for the next batch (near zero once prefetching keeps up)
+                    wait_start = time.time()
+                    if claim_task:
+                        images = await batches.get()
+                        slots.release()
+                        if isinstance(images, Exception):
+                            raise images
+                    else:
+                        images = await asyncio.to_thread(self.fetch_pending_images, batch_size, location)
+                    self.metrics.observe("claim_wait", time.time() - wait_start)
+
+                    if not images:
+                        print("\n✅ No more pending images to process")
+                        break
+
+                    await self.process_batch_async(session, images, location)
+                    total_claimed += len(images)
+            finally:
+                if claim_task:
+                    claim_task.cancel()
+                for task in self._prefetched.values():
+                    task.cancel()
+                self._prefetched.clear()
+                probe_task.cancel()
+                if self.progress:
+                    await self.progress.close()
+                if self.storage_client is not None:
+                    await self.storage_client.aclose()
+                    self.storage_client = None
+
+        return total_claimed
+
+    async def _claim_batches_async(
+        self,
+        session: aiohttp.ClientSession,
+        batches: asyncio.Queue,
+        slots: asyncio.Semaphore,
+        batch_size: int,
+        location: Optional[Dict[str, str]],
+        max_batches: int
+    ):
+        """
+        Claim batches ahead of processing and start downloading their first images
 
-    def fetch_pending_images(self, batch_size: int, offset: int, city: Optional[str] = None) -> List[Dict]:
-        """Fetch images that need embeddings"""
+        Waits for a free slot in `slots` before each claim (the consumer frees one
+        per batch it takes), so images aren't leased before there is room for
+        them. Puts each claimed batch on `batches`, then an empty list once
+        nothing is left to claim. A failed claim is put on the queue as the
+        exception, so the run stops the same way it would without prefetching.
+        """
+        try:
+            for _ in range(max_batches):
+                await slots.acquire()
+                images = await asyncio.to_thread(self.fetch_pending_images, batch_size, location)
+                if not images:
+                    break
+                self._prefetch_downloads(session, images)
+                await batches.put(images)
+        except Exception as e:
+            await batches.put(e)
+            return
+        await batches.put([])
 
-        query = self.supabase.table("portfolio_images") \
-            .select("id, storage_original_path, artist_id") \
-            .is_("embedding", "null") \
-            .eq("status", "pending")
+    def _prefetch_downloads(self, session: aiohttp.ClientSession, images: List[Dict]):
+        """Start downloading the first prefetch_images images of a claimed batch"""
+        if self.server_fetch:
+            return  # The backends download them
+        for img in images[:self.prefetch_images]:
+            url = self.public_url(img["storage_original_path"])
+            self._prefetched[img["id"]] = asyncio.create_task(self._fetch_image_async(session, img["id"], url))
 
-        # Optional city filter
-        if city:
-            # Get artist IDs in this city
-            artists = self.supabase.table("artists") \
-                .select("id") \
-                .eq("city", city) \
-                .execute()
+    async def process_batch_async(
+        self,
+        session: aiohttp.ClientSession,
+        images: List[Dict],
+        location: Optional[Dict[str, str]] = None
+    ):
+        """Process one claimed batch with the chunked or streaming pipeline"""
+        city_str = describe_location(location or {})
+        lanes = [img.get("priority_class") or "backfill" for img in images]
+        lane_str = ", ".join(f"{lanes.count(lane)} {lane}" for lane in PRIORITY_CLASSES if lane in lanes)
+        try:
+            if self.streaming:
+                print(f"\n📸 Streaming {len(images)} images{city_str} ({lane_str}) "
+                      f"({self.download_workers} download / {self.parallel} inference / {self.write_workers} write workers)")
+                await self.process_batch_streaming_async(session, images)
+            else:
+                print(f"\n📸 Processing {len(images)} images{city_str} ({lane_str}) with {self.parallel} parallel workers")
+                await self._process_chunks_async(session, images)
+
+            await asyncio.to_thread(self.record_failures, [img["id"] for img in images])
+        finally:
+            # Failed images go back to the queue (and are measured by whoever writes them)
+            for img in images:
+                self._queued.pop(img["id"], None)
+                self._failures.pop(img["id"], None)
+
+    async def _process_chunks_async(self, session: aiohttp.ClientSession, images: List[Dict]):
+        """Chunked mode: embed `parallel` micro-batches at a time, then write them"""
+        # Process in chunks to avoid overwhelming GPU
+        # (`parallel` concurrent requests of `micro_batch` images each)
+        chunk_size = self.parallel * self.micro_batch
+
+        for i in range(0, len(images), chunk_size):
+            chunk = images[i:i+chunk_size]
+            chunk_start = time.time()
+
+            print(f"\n  Processing chunk {i//chunk_size + 1}/{(len(images)-1)//chunk_size + 1} ({len(chunk)} images)...")
+
+            if self.server_fetch:
+                # Backends download the images themselves - only ids and paths go out
+                micro_batches = [chunk[j:j + self.micro_batch] for j in range(0, len(chunk), self.micro_batch)]
+                embedded = await asyncio.gather(*(self.embed_from_storage_async(session, mb) for mb in micro_batches))
+                results = [r for batch_results in embedded for r in batch_results]
+            elif self.micro_batch == 1:
+                # Generate embeddings in parallel
+                tasks = []
+                for img in chunk:
+                    public_url = self.public_url(img["storage_original_path"])
+                    task = self.generate_embedding_async(session, img["id"], public_url)
+                    tasks.append(task)
 
-            artist_ids = [a["id"] for a in artists.data]
-            if not artist_ids:
-                return []
+                # Wait for all tasks in chunk
+                results = await asyncio.gather(*tasks)
+            else:
+                # Download the whole chunk, then embed it in micro-batches
+                downloads = await asyncio.gather(*(
+                    self.download_image_async(session, img["id"], self.public_url(img["storage_original_path"]))
+                    for img in chunk
+                ))
+                items = [(img["id"], data) for img, data in zip(chunk, downloads) if data is not None]
+                micro_batches = [items[j:j + self.micro_batch] for j in range(0, len(items), self.micro_batch)]
+                embedded = await asyncio.gather(*(self.embed_images_async(session, mb) for mb in micro_batches))
+                results = [r for batch_results in embedded for r in batch_results]
+                results.extend([None] * (len(chunk) - len(items)))
+
+            # Update database for successful embeddings (one RPC per chunk)
+            successful_in_chunk = await asyncio.to_thread(self.store_embeddings, [r for r in results if r])
+
+            chunk_time = time.time() - chunk_start
+            print(f"  ✓ Chunk completed in {chunk_time:.1f}s")
+
+            # Report progress (coalesced and flushed in the background)
+            if self.progress:
+                self.progress.add(successful_in_chunk, len(results) - successful_in_chunk)
+
+    async def process_batch_streaming_async(self, session: aiohttp.ClientSession, images: List[Dict]):
+        """
+        Process a batch through a download → inference → DB write pipeline
 
-            # Filter images by artist IDs
-            query = query.in_("artist_id", artist_ids)
+        Each stage has its own worker pool and the stages are connected by bounded
+        queues, so one slow download or local GPU timeout only holds up a single
+        worker instead of a whole chunk, and inference always has images queued.
+        """
+        batch_start = time.time()
+        download_queue: asyncio.Queue = asyncio.Queue()
+        inference_queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        write_queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+
+        for img in images:
+            download_queue.put_nowait(img)
+
+        async def download_worker():
+            while True:
+                try:
+                    img = download_queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+
+                if self.server_fetch:
+                    # The backend downloads it - pass the claimed row straight to inference
+                    await inference_queue.put(img)
+                    continue
+
+                public_url = self.public_url(img["storage_original_path"])
+                image_bytes = await self.download_image_async(session, img["id"], public_url)
+                if image_bytes is None:
+                    # Skip inference but still count the failure in the write stage
+                    await write_queue.put(None)
+                else:
+                    await inference_queue.put((img["id"], image_bytes))
+
+        async def inference_worker():
+            while True:
+                item = await inference_queue.get()
+                if item is _STAGE_DONE:
+                    return
+
+                # Top up the micro-batch with whatever is already downloaded (no waiting)
+                items = [item]
+                done = False
+                while len(items) < self.micro_batch:
+                    try:
+                        item = inference_queue.get_nowait()
+                    except asyncio.QueueEmpty:
+                        break
+                    if item is _STAGE_DONE:
+                        done = True
+                        break
+                    items.append(item)
+
+                embed = self.embed_from_storage_async if self.server_fetch else self.embed_images_async
+                for result in await embed(session, items):
+                    await write_queue.put(result)
+
+                if done:
+                    return
+
+        async def write_worker():
+            # Buffer results and write them with one RPC once the buffer is full
+            # or its oldest result has waited WRITE_FLUSH_INTERVAL seconds
+            buffered: List[Dict] = []
+            flush_at = 0.0
+            done = False
+
+            while not done:
+                timeout = max(0.0, flush_at - time.monotonic()) if buffered else None
+                timed_out = False
+                try:
+                    result = await asyncio.wait_for(write_queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    timed_out = True
+
+                if not timed_out:
+                    if result is _STAGE_DONE:
+                        done = True
+                    elif result is None:
+                        if self.progress:
+                            self.progress.add(failed=1)
+                    else:
+                        if not buffered:
+                            flush_at = time.monotonic() + WRITE_FLUSH_INTERVAL
+                        buffered.append(result)
+
+                if buffered and (done or timed_out or len(buffered) >= self.write_batch_size):
+                    stored = await asyncio.to_thread(self.store_embeddings, buffered)
+                    if self.progress:
+                        self.progress.add(stored, len(buffered) - stored)
+                    buffered = []
+
+        writers = [asyncio.create_task(write_worker()) for _ in range(self.write_workers)]
+        inferrers = [asyncio.create_task(inference_worker()) for _ in range(self.parallel)]
+        downloaders = [asyncio.create_task(download_worker()) for _ in range(self.download_workers)]
+
+        # Shut stages down in order once the stage before them has drained
+        await asyncio.gather(*downloaders)
+        for _ in inferrers:
+            await inference_queue.put(_STAGE_DONE)
+        await asyncio.gather(*inferrers)
+
+        for _ in writers:
+            await write_queue.put(_STAGE_DONE)
+        await asyncio.gather(*writers)
+
+        batch_time = time.time() - batch_start
+        print(f"  ✓ Batch completed in {batch_time:.1f}s ({len(images) / max(batch_time, 0.001):.1f} images/s)")
+
+    def fetch_pending_images(self, batch_size: int, location: Optional[Dict[str, str]] = None) -> List[Dict]:
+        """
+        Claim the next batch of images that need embeddings
 
-        query = query.limit(batch_size).offset(offset)
-        response = query.execute()
+        Images are leased to this worker via the claim_pending_images RPC, so any
+        number of workers can drain the backlog without overlap or gaps. Leases
+        that expire (e.g. the worker crashed) return the images to the pool.
+        Each claim is split across the onboarding / sync / backfill lanes by
+        priority_weights. The optional location filter is applied in the database.
+        """
+        params = {
+            'p_worker_id': self.worker_id,
+            'p_limit': batch_size,
+            'p_lease_seconds': self.lease_seconds,
+            **{f'p_{lane}_weight': weight for lane, weight in self.priority_weights.items()},
+            **(location or {}),
+        }
 
-        return response.data
+        response = self.supabase.rpc('claim_pending_images', params).execute()
+        images = response.data or []
 
-    def process_batch(self, batch_size: int = 100, offset: int = 0, city: Optional[str] = None):
-        """Fetch and process a batch of images"""
+        # Interactive lanes go first within the batch too
+        now = time.time()
+        for img in images:
+            lane = img.get("priority_class") or "backfill"
+            self._queued[img["id"]] = (lane, now - (img.get("queued_seconds") or 0.0))
+        images.sort(key=lambda img: PRIORITY_CLASSES.index(img.get("priority_class") or "backfill"))
+        return images
 
-        # Fetch images
-        images = self.fetch_pending_images(batch_size, offset, city)
+    def count_pending_images(self, location: Optional[Dict[str, str]] = None) -> int:
+        """Count images that can be claimed now (pending, not in retry backoff; optionally within a location)"""
+        response = self.supabase.rpc('count_pending_embedding_images', location or {}).execute()
+        return response.data or 0
 
-        if not images:
-            return 0
+    def replay_journal(self) -> int:
+        """
+        Write embeddings left in the journal by an earlier run that never confirmed them
 
-        city_str = f" in {city}" if city else ""
-        print(f"\n📸 Processing {len(images)} images{city_str} with {self.parallel} parallel workers")
+        The bulk write only touches images that are still pending, so replaying
+        something another worker has since written is harmless.
 
-        # Run async processing
-        asyncio.run(self.process_batch_async(images))
+        Returns:
+            Number of journaled embeddings written
+        """
+        pending = self.journal.pending() if self.journal else []
+        if not pending:
+            return 0
 
-        return len(images)
+        print(f"📒 Replaying {len(pending)} embeddings from {self.journal.path} (computed by an earlier run)")
+        written = 0
+        for start in range(0, len(pending), self.write_batch_size):
+            chunk = pending[start:start + self.write_batch_size]
+            written += self.store_embeddings([
+                {"image_id": image_id, "embedding": embedding, "source": "journal"}
+                for image_id, embedding in chunk
+            ])
+
+        # Anything confirmed above no longer needs to be on disk
+        self.journal.compact()
+        return written
+
+    def release_claims(self):
+        """Return any images still leased to this worker to the pending pool"""
+        try:
+            result = self.supabase.rpc('release_image_claims', {'p_worker_id': self.worker_id}).execute()
+            if result.data:
+                print(f"↩️  Released {result.data} unfinished image claims")
+        except Exception as e:
+            # Leases expire on their own, so this is only an optimization
+            print(f"Warning: Failed to release image claims: {e}")
 
     def print_stats(self):
         """Print processing statistics"""
+        snapshot = self.metrics.snapshot()
         print("\n" + "="*60)
         print("📊 BATCH PROCESSING STATISTICS")
         print("="*60)
@@ -330,14 +1866,66 @@ class BatchEmbeddingGenerator:
         print(f"Local GPU:         {self.stats['local_count']} ({self._percentage('local_count')}%)")
         print(f"Modal.com:         {self.stats['modal_count']} ({self._percentage('modal_count')}%)")
         print(f"Errors:            {self.stats['errors']}")
-
-        if self.stats['local_times']:
-            avg = sum(self.stats['local_times']) / len(self.stats['local_times'])
-            print(f"Avg Local Time:    {avg:.2f}s per image")
-
-        if self.stats['modal_times']:
-            avg = sum(self.stats['modal_times']) / len(self.stats['modal_times'])
-            print(f"Avg Modal Time:    {avg:.2f}s per image")
+        if self.stats['retries_scheduled'] or self.stats['dead_lettered']:
+            print(f"Failed images:     {self.stats['retries_scheduled']} scheduled for retry, "
+                  f"{self.stats['dead_lettered']} dead-lettered")
+
+        for name, health in self.router.backends.items():
+            print(f"{BACKEND_LABELS[name] + ':':<19}EWMA {health.ewma_latency:.2f}s/image, "
+                  f"error rate {health.ewma_error_rate:.0%}, circuit {health.circuit} "
+                  f"(opened {health.circuit_opens}x)")
+
+        if self.cache is not None:
+            lookups = self.cache.hits + self.cache.misses
+            hit_rate = int(self.cache.hits / lookups * 100) if lookups else 0
+            print(f"Cache hits:        {self.cache.hits} ({hit_rate}%)")
+            print(f"Cache misses:      {self.cache.misses}")
+            print(f"Coalesced:         {self.cache.coalesced} duplicate in-flight images")
+            if self.cache.evictions:
+                print(f"Cache evictions:   {self.cache.evictions}")
+
+        lane_summaries = {lane: snapshot["stages"].get(f"queue_{lane}") for lane in PRIORITY_CLASSES}
+        if any(summary and summary["count"] for summary in lane_summaries.values()):
+            print("Queue latency:     p50 / p95 (images), insert to embedding written")
+            for lane, summary in lane_summaries.items():
+                if not summary or not summary["count"]:
+                    continue
+                target = QUEUE_LATENCY_TARGETS.get(lane)
+                target_str = ""
+                if target:
+                    target_str = f", target {target:.0f}s {'✅' if summary['p95'] <= target else '⚠️  missed'}"
+                print(f"  {lane:<17}{summary['p50']:.0f}s / {summary['p95']:.0f}s ({summary['count']}{target_str})")
+
+        if self.stats['server_fetched']:
+            print(f"Server-fetched:    {self.stats['server_fetched']} images downloaded by the embedding servers")
+
+        if self.stats['prefetched_images']:
+            print(f"Prefetched:        {self.stats['prefetched_images']} images downloaded ahead of their batch")
+
+        if self.hedge:
+            eligible = self.stats['hedge_eligible']
+            hedge_pct = int(self.stats['hedges_sent'] / eligible * 100) if eligible else 0
+            print(f"Hedged requests:   {self.stats['hedges_sent']} of {eligible} local requests ({hedge_pct}%), "
+                  f"{self.stats['hedges_won']} won by Modal")
+            print(f"Hedge cost:        {self.stats['hedge_wasted_images']} duplicate images, "
+                  f"{self.stats['hedge_modal_seconds']:.1f}s of Modal requests")
+
+        print("Stage latency:     p50 / p95 / p99 (requests)")
+        for stage, summary in snapshot["stages"].items():
+            if summary["count"] and not stage.startswith("queue_"):
+                print(f"  {stage:<17}{summary['p50']:.2f}s / {summary['p95']:.2f}s / {summary['p99']:.2f}s ({summary['count']})")
+
+        downloaded, uploaded = snapshot["bytes"]["downloaded"], snapshot["bytes"]["uploaded"]
+        if downloaded:
+            print(f"Downloaded:        {downloaded / 1024 / 1024:.1f} MB")
+            print(f"Uploaded:          {uploaded / 1024 / 1024:.1f} MB ({uploaded / downloaded * 100:.0f}% of downloaded)")
+        elif uploaded:
+            print(f"Uploaded:          {uploaded / 1024 / 1024:.2f} MB (storage paths only)")
+
+        if snapshot["errors"]:
+            print("Errors by type:    " + ", ".join(
+                f"{kind} {count}" for kind, count in sorted(snapshot["errors"].items(), key=lambda e: -e[1])
+            ))
 
         print("="*60)
 
@@ -371,10 +1959,59 @@ def main():
     parser = argparse.ArgumentParser(description="Batch embedding generation with local GPU + Modal fallback")
     parser.add_argument("--batch-size", type=int, default=100, help="Images per batch (default: 100)")
     parser.add_argument("--parallel", type=int, default=4, help="Concurrent requests (4-8 recommended for A2000)")
-    parser.add_argument("--offset", type=int, default=0, help="Starting offset")
+    parser.add_argument("--offset", type=int, default=0, help="Deprecated - ignored, images are claimed with leases")
+    parser.add_argument("--cache-path", type=str, default=DEFAULT_CACHE_PATH, help=f"Embedding cache file (default: {DEFAULT_CACHE_PATH})")
+    parser.add_argument("--cache-max-mb", type=int, default=2048, help="Embedding cache size budget before LRU eviction (default: 2048)")
+    parser.add_argument("--no-cache", action="store_true", help="Disable the content-addressed embedding cache")
+    parser.add_argument("--journal-path", type=str, default=DEFAULT_JOURNAL_PATH,
+                        help=f"Crash-safe journal of unwritten embeddings, one per concurrent worker (default: {DEFAULT_JOURNAL_PATH})")
+    parser.add_argument("--no-journal", action="store_true", help="Don't journal computed embeddings before the DB write")
+    parser.add_argument("--route", choices=["capacity", "prefer-local"], default="capacity",
+                        help="Split traffic by measured backend throughput, or only use Modal as fallback (default: capacity)")
+    parser.add_argument("--circuit-failures", type=int, default=5, help="Consecutive failures before a backend's circuit opens (default: 5)")
+    parser.add_argument("--hedge", action="store_true", help="Duplicate slow local GPU requests to Modal, first answer wins")
+    parser.add_argument("--hedge-percentile", type=float, default=95.0,
+                        help="Hedge once a local request is slower than this percentile of recent latencies (default: 95)")
+    parser.add_argument("--hedge-max-pct", type=float, default=10.0, help="Max %% of local requests that may be hedged (default: 10)")
+    parser.add_argument("--client-preprocess", action="store_true",
+                        help="Resize/crop images to 224x224 tensors locally and upload those instead of originals")
+    parser.add_argument("--preprocess-workers", type=int, help="Processes for --client-preprocess (default: CPU count)")
+    parser.add_argument("--server-fetch", action="store_true",
+                        help="Send storage paths and let the embedding servers download the originals "
+                             "(no download + re-upload here; skips the embedding cache)")
+    parser.add_argument("--metrics-port", type=int, help="Serve OpenMetrics/Prometheus text at :PORT/metrics while running")
+    parser.add_argument("--metrics-json", type=str, help="Periodically write a JSON metrics snapshot to this file")
+    parser.add_argument("--metrics-interval", type=float, default=15.0, help="Seconds between JSON metrics snapshots (default: 15)")
+    parser.add_argument("--lease-seconds", type=int, default=600, help="How long claimed images stay reserved for this worker (default: 600)")
     parser.add_argument("--max-batches", type=int, default=100, help="Maximum batches to process")
     parser.add_argument("--city", type=str, help="Filter by city (e.g., 'Austin, TX')")
+    parser.add_argument("--region", type=str, help="Filter by state/province/region (e.g., 'TX')")
+    parser.add_argument("--country", type=str, help="Filter by two-letter country code (e.g., 'GB')")
     parser.add_argument("--modal-only", action="store_true", help="Skip local GPU, use Modal only")
+    parser.add_argument("--streaming", action="store_true", help="Pipeline downloads, inference and DB writes instead of fixed chunks")
+    parser.add_argument("--download-workers", type=int, help="Concurrent downloads in streaming mode (default: 2x --parallel)")
+    parser.add_argument("--write-workers", type=int, default=2, help="Concurrent DB writers in streaming mode (default: 2)")
+    parser.add_argument("--write-batch-size", type=int, default=200, help="Max embeddings per bulk DB write in streaming mode (default: 200)")
+    parser.add_argument("--queue-size", type=int, help="Max images buffered between streaming stages (default: 2x --parallel x --micro-batch)")
+    parser.add_argument("--wire-format", choices=["f32", "f16", "json"], default="f32",
+                        help="Embedding request format: raw bytes in, packed float32/float16 out, or base64 JSON (default: f32)")
+    parser.add_argument("--micro-batch", type=int, default=8, help=f"Images per inference request (default: 8, max {MAX_MICRO_BATCH}; 1 disables batching)")
+    parser.add_argument("--progress-interval", type=float, default=5.0,
+                        help="Max seconds between pipeline progress updates (default: 5)")
+    parser.add_argument("--progress-every", type=int, default=500,
+                        help="Processed images that trigger an early pipeline progress update (default: 500)")
+    parser.add_argument("--prefetch-batches", type=int, default=1,
+                        help="Batches claimed ahead of the one being processed, 0 disables prefetching (default: 1)")
+    parser.add_argument("--prefetch-images", type=int,
+                        help="Images downloaded ahead per prefetched batch (default: --parallel x --micro-batch)")
+    parser.add_argument("--priority-weights", type=str, default=DEFAULT_PRIORITY_WEIGHTS,
+                        help=f"Share of each claim for the onboarding,sync,backfill lanes (default: {DEFAULT_PRIORITY_WEIGHTS})")
+    parser.add_argument("--max-attempts", type=int, default=5,
+                        help="Failed attempts before an image is dead-lettered (status 'failed') (default: 5)")
+    parser.add_argument("--retry-delay", type=int, default=300,
+                        help="Seconds before a failed image is retried, doubling per attempt (default: 300)")
+    parser.add_argument("--http2-storage", action="store_true",
+                        help="Download images from Supabase storage over HTTP/2 (requires httpx[http2])")
     args = parser.parse_args()
 
     # Validate configuration
@@ -383,9 +2020,79 @@ def main():
         print("   Set SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY in .env.local")
         return 1
 
+    if args.client_preprocess:
+        try:
+            import PIL  # noqa: F401
+        except ImportError:
+            print("❌ Error: --client-preprocess requires Pillow (pip install Pillow)")
+            return 1
+
+    if args.http2_storage:
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            h2 = None
+        if httpx is None or h2 is None:
+            print("❌ Error: --http2-storage requires httpx with HTTP/2 support (pip install 'httpx[http2]')")
+            return 1
+
+    try:
+        priority_weights = parse_priority_weights(args.priority_weights)
+    except ValueError as e:
+        print(f"❌ Error: --priority-weights {e}")
+        return 1
+
     # Initialize generator
     prefer_local = not args.modal_only
-    generator = BatchEmbeddingGenerator(parallel=args.parallel, prefer_local=prefer_local)
+    cache = None if args.no_cache else EmbeddingCache(args.cache_path, args.cache_max_mb * 1024 * 1024)
+    journal = None
+    if not args.no_journal:
+        try:
+            journal = EmbeddingJournal(args.journal_path)
+        except JournalLocked as e:
+            print(f"❌ Error: {e}")
+            print("   Give each concurrent worker its own --journal-path")
+            return 1
+    generator = BatchEmbeddingGenerator(
+        parallel=args.parallel,
+        prefer_local=prefer_local,
+        streaming=args.streaming,
+        download_workers=args.download_workers,
+        write_workers=args.write_workers,
+        queue_size=args.queue_size,
+        micro_batch=args.micro_batch,
+        wire_format=args.wire_format,
+        write_batch_size=args.write_batch_size,
+        lease_seconds=args.lease_seconds,
+        cache=cache,
+        route_mode=args.route,
+        circuit_failures=args.circuit_failures,
+        hedge=args.hedge,
+        hedge_percentile=args.hedge_percentile,
+        hedge_max_pct=args.hedge_max_pct,
+        preprocess_workers=(args.preprocess_workers or os.cpu_count() or 1) if args.client_preprocess else 0,
+        journal=journal,
+        http2_storage=args.http2_storage,
+        progress_interval=args.progress_interval,
+        progress_threshold=args.progress_every,
+        prefetch_batches=args.prefetch_batches,
+        prefetch_images=args.prefetch_images,
+        priority_weights=priority_weights,
+        max_attempts=args.max_attempts,
+        retry_delay=args.retry_delay,
+        server_fetch=args.server_fetch
+    )
+
+    if args.metrics_port:
+        start_metrics_server(generator.metrics, args.metrics_port)
+        print(f"📈 Metrics at http://0.0.0.0:{args.metrics_port}/metrics")
+    snapshot_stop = None
+    if args.metrics_json:
+        snapshot_stop = start_json_snapshots(generator.metrics, args.metrics_json, args.metrics_interval)
+        print(f"📈 Writing metrics snapshots to {args.metrics_json} every {args.metrics_interval:.0f}s")
+
+    if args.offset:
+        print("⚠️  --offset is ignored: pending images are claimed with leases, so workers never overlap")
 
     # Check health
     print("🔍 Checking services...")
@@ -396,7 +2103,9 @@ def main():
     else:
         print(f"⚠️  Local GPU not available at {LOCAL_CLIP_URL}")
         if prefer_local:
-            print("   Will use Modal fallback for all requests")
+            # Start with the circuit open - background probes close it if the GPU comes back
+            generator.router.trip("local")
+            print("   Will use Modal fallback until the local GPU recovers")
 
     if MODAL_FUNCTION_URL:
         print(f"✅ Modal configured at {MODAL_FUNCTION_URL}")
@@ -405,23 +2114,15 @@ def main():
             print("❌ Error: Neither local GPU nor Modal is available")
             return 1
 
-    # Get total count of pending images for progress tracking
-    total_query = generator.supabase.table("portfolio_images") \
-        .select("id", count="exact") \
-        .is_("embedding", "null") \
-        .eq("status", "pending")
+    if generator.preprocess_pool or generator.server_fetch:
+        generator.detect_input_formats()
 
-    if args.city:
-        artists = generator.supabase.table("artists") \
-            .select("id") \
-            .eq("city", args.city) \
-            .execute()
-        artist_ids = [a["id"] for a in artists.data]
-        if artist_ids:
-            total_query = total_query.in_("artist_id", artist_ids)
+    # Finish what a crashed run already paid GPU time for, before claiming new work
+    generator.replay_journal()
 
-    total_count_result = total_query.execute()
-    total_pending = total_count_result.count if total_count_result.count else 0
+    # Get total count of pending images for progress tracking (location filter applied server-side)
+    location = location_filter(args.city, args.region, args.country)
+    total_pending = generator.count_pending_images(location)
 
     # Initialize pipeline progress - set total_items ONCE
     if generator.pipeline_run_id:
@@ -434,26 +2135,26 @@ def main():
         except Exception as e:
             print(f"Warning: Failed to initialize pipeline progress: {e}")
 
-    # Process batches
+    # Process batches (one event loop and connection pool for the whole run)
     total_processed = 0
-    batch_num = 0
     overall_start = time.time()
 
-    while batch_num < args.max_batches:
-        batch_offset = args.offset + (batch_num * args.batch_size)
-
-        count = generator.process_batch(
+    try:
+        total_processed = asyncio.run(generator.run_async(
             batch_size=args.batch_size,
-            offset=batch_offset,
-            city=args.city
-        )
-
-        if count == 0:
-            print("\n✅ No more pending images to process")
-            break
-
-        total_processed += count
-        batch_num += 1
+            location=location,
+            max_batches=args.max_batches
+        ))
+    finally:
+        # Hand back anything claimed but not finished (e.g. on Ctrl+C)
+        generator.release_claims()
+        if generator.preprocess_pool:
+            generator.preprocess_pool.shutdown()
+        if journal:
+            journal.close()
+        if snapshot_stop:
+            snapshot_stop.set()
+            generator.metrics.write_json(args.metrics_json)
 
     overall_time = time.time() - overall_start
 
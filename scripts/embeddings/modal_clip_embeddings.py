@@ -10,16 +10,62 @@ Architecture:
 - Batch Size: 100 images per batch (configurable)
 - Output: 768-dimensional embeddings stored in Supabase
 
+Search endpoints (Model.fastapi_app) coalesce concurrent single-image and text
+requests into one batched forward pass per CLIP_COALESCE_MAX_WAIT_MS window (up to
+CLIP_COALESCE_MAX_BATCH items); both are read from the deploying shell's environment.
+Text embeddings are kept in an LRU cache (CLIP_TEXT_CACHE_SIZE queries), prewarmed
+at container start with the style queries and CLIP_PREWARM_QUERIES ("|"-separated).
+Queue depth, batch sizes and cache hit rate are exported on /health and /metrics.
+Reduced-resolution JPEG decoding (clip_preprocess.py) follows CLIP_REDUCED_DECODE in
+the deploying shell too, and is off unless set.
+
+Weights are loaded from a safetensors snapshot on the "clip-weights" volume
+(clip_weights.py - written by the first container, memory-mapped after that), and
+every cold start logs per-phase timing (also on /health as cold_start).
+
+Bulk jobs can post storage paths to /generate_embeddings_from_storage instead of
+image bytes: the container downloads the originals itself (pooled connections, same
+SSRF checks as CLIPEmbedder) and returns embeddings keyed by image id.
+
 Usage:
     modal run scripts/embeddings/modal_clip_embeddings.py::generate_embeddings_batch --batch-size 100
     modal run scripts/embeddings/modal_clip_embeddings.py::generate_single_embedding --image-url "https://..."
 """
 
+import asyncio
 import io
 import os
-from typing import List, Optional
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
 import modal
 
+# Shipped into the image with add_local_python_source (same decode and pgvector
+# formatting as the batch client)
+from clip_preprocess import CLIP_IMAGE_SIZE, REDUCED_DECODE, TENSOR_MEDIA_TYPE, format_embedding, open_image
+
+# Request coalescing for the search endpoints: a request waits at most this long for
+# others to share its forward pass, and a pass takes at most this many items
+CLIP_COALESCE_MAX_WAIT_MS = float(os.getenv("CLIP_COALESCE_MAX_WAIT_MS", "5"))
+CLIP_COALESCE_MAX_BATCH = int(os.getenv("CLIP_COALESCE_MAX_BATCH", "32"))
+
+# Requests one Model container serves at once (what there is to coalesce)
+CLIP_MAX_CONCURRENT_INPUTS = int(os.getenv("CLIP_MAX_CONCURRENT_INPUTS", "64"))
+
+# Text embeddings cached per container (~3 KB each) and popular searches embedded at startup
+CLIP_TEXT_CACHE_SIZE = int(os.getenv("CLIP_TEXT_CACHE_SIZE", "4096"))
+CLIP_PREWARM_QUERIES = os.getenv("CLIP_PREWARM_QUERIES", "")
+
+# Style taxonomy (same 19 styles as scripts/styles/train-classifier.py)
+STYLES = [
+    "traditional", "neo-traditional", "realism", "black-and-gray", "blackwork",
+    "new-school", "watercolor", "ornamental", "fine-line", "tribal",
+    "biomechanical", "trash-polka", "sketch", "geometric", "dotwork",
+    "surrealism", "lettering", "anime", "japanese"
+]
+
 # Modal app configuration
 app = modal.App("tattoo-clip-embeddings")
 
@@ -35,9 +81,396 @@ image = (
         "requests==2.31.0",
         "supabase==2.15.0",  # Newer version compatible with httpx
         "fastapi[standard]==0.115.0",  # Required for web endpoints
+        "safetensors==0.4.2",  # Weight snapshots (clip_weights.py)
     )
+    # Coalescing and decode settings are read at deploy time and baked into the container
+    .env({
+        "CLIP_COALESCE_MAX_WAIT_MS": str(CLIP_COALESCE_MAX_WAIT_MS),
+        "CLIP_COALESCE_MAX_BATCH": str(CLIP_COALESCE_MAX_BATCH),
+        "CLIP_MAX_CONCURRENT_INPUTS": str(CLIP_MAX_CONCURRENT_INPUTS),
+        "CLIP_TEXT_CACHE_SIZE": str(CLIP_TEXT_CACHE_SIZE),
+        "CLIP_PREWARM_QUERIES": CLIP_PREWARM_QUERIES,
+        "CLIP_REDUCED_DECODE": "1" if REDUCED_DECODE else "0",
+    })
+    .add_local_python_source("clip_weights", "clip_preprocess")
 )
 
+# Converted weights shared by every container (see clip_weights.py)
+weights_volume = modal.Volume.from_name("clip-weights", create_if_missing=True)
+WEIGHTS_DIR = "/weights"
+
+
+def _load_model(device: str):
+    """Load CLIP from the weight snapshot (creating it on first use) and log cold-start timing"""
+    from clip_weights import format_timings, load_clip_model
+
+    model, preprocess, tokenizer, timings = load_clip_model(device, WEIGHTS_DIR)
+    if timings["snapshot_created"]:
+        weights_volume.commit()  # Make the snapshot visible to the next containers
+        print("💾 Saved weight snapshot to the clip-weights volume")
+    print(f"⏱️  Cold start: {format_timings(timings)}")
+    return model, preprocess, tokenizer, timings
+
+
+def _encode_image_batch(model, device: str, tensors: List) -> List[List[float]]:
+    """
+    One forward pass over preprocessed image tensors, returning normalized embeddings
+
+    Shared by CLIPEmbedder and Model so every image path gets the same sanity check.
+
+    Raises:
+        ValueError: An embedding isn't unit length (or is NaN)
+    """
+    import torch
+
+    image_tensor = torch.stack(tensors).to(device)
+
+    with torch.no_grad():
+        embeddings = model.encode_image(image_tensor)
+        # Normalize embedding (important for cosine similarity)
+        embeddings = embeddings / embeddings.norm(dim=-1, keepdim=True)
+        embeddings = embeddings.cpu().numpy().tolist()
+
+    # Verify normalization (L2 norm should be ~1.0; NaN fails the comparison)
+    for embedding in embeddings:
+        norm = sum(x**2 for x in embedding) ** 0.5
+        if not abs(norm - 1.0) <= 0.01:
+            raise ValueError(f"Embedding not properly normalized: L2 norm = {norm}")
+
+    return embeddings
+
+# Upper bound on images per /generate_batch_embeddings request (keeps A10G memory in check)
+MAX_BATCH_IMAGES = 64
+
+EMBEDDING_DIM = 768
+
+# Client-preprocessed input (clip_preprocess.py): 224x224x3 uint8 RGB, row-major HWC,
+# already resized and center-cropped - the server only normalizes it
+
+# Binary wire format (negotiated via the Accept header): packed little-endian
+# rows of EMBEDDING_DIM floats. Anything else gets the JSON response.
+EMBEDDING_MEDIA_TYPES = {
+    "application/x-embedding-f32": "<f4",
+    "application/x-embedding-f16": "<f2",
+}
+
+# Download/decode limits for images fetched by URL
+MAX_IMAGE_SIZE_MB = 20  # Pixel limit: clip_preprocess.MAX_PIXELS
+
+# Storage responses that won't change on retry (Supabase storage answers 400 for missing objects)
+PERMANENT_HTTP_STATUSES = {400, 404, 410}
+
+# Server-side fetches by storage path (/generate_embeddings_from_storage): the public
+# originals bucket, what a valid object key looks like, and downloads per container
+STORAGE_BUCKET = "portfolio-images"
+STORAGE_PATH_PATTERN = re.compile(r"^[A-Za-z0-9_-][A-Za-z0-9._/-]*$")
+STORAGE_FETCH_WORKERS = 64
+
+
+class PermanentImageError(ValueError):
+    """The image can never be embedded (missing, too large, undecodable) - don't retry it"""
+
+
+def _download_image(http, image_url: str) -> bytes:
+    """
+    Validate an image URL (SSRF checks) and download it with a size limit
+
+    `http` is a requests.Session with pooled keep-alive connections. HTTP and
+    connection errors are chained as __cause__ (see _fetch_error_class).
+
+    Raises:
+        PermanentImageError: Missing object (400/404/410) or image over the size limit
+        ValueError: Invalid URL or a transient download failure
+    """
+    import requests
+    import urllib.parse
+    import socket
+
+    # Security: Validate URL to prevent SSRF attacks
+    ALLOWED_SCHEMES = {"https"}  # Only HTTPS
+    BLOCKED_IPS = {
+        "127.0.0.1", "localhost", "0.0.0.0",
+        "169.254.169.254",  # AWS metadata
+        "::1",  # IPv6 localhost
+    }
+
+    # 1. Validate URL format
+    try:
+        parsed = urllib.parse.urlparse(image_url)
+    except Exception:
+        raise ValueError("Invalid URL format")
+
+    # 2. Check scheme is HTTPS only
+    if parsed.scheme not in ALLOWED_SCHEMES:
+        raise ValueError(f"Invalid URL scheme: {parsed.scheme}. Only HTTPS allowed.")
+
+    # 3. Resolve hostname and block private IPs
+    try:
+        hostname = parsed.hostname
+        if not hostname:
+            raise ValueError("Missing hostname in URL")
+
+        # Resolve DNS
+        ip_addr = socket.gethostbyname(hostname)
+
+        # Block localhost and private IPs (RFC 1918)
+        if (ip_addr in BLOCKED_IPS or
+            ip_addr.startswith("10.") or
+            ip_addr.startswith("172.16.") or
+            ip_addr.startswith("192.168.")):
+            raise ValueError("Private IP address not allowed")
+    except socket.gaierror:
+        raise ValueError("Cannot resolve hostname")
+    except ValueError:
+        raise
+
+    # 4. Download with size limit (streaming to prevent memory exhaustion)
+    try:
+        response = http.get(
+            image_url,
+            timeout=10,
+            stream=True,
+            headers={"User-Agent": "TattooDiscoveryBot/1.0"}
+        )
+        response.raise_for_status()
+
+        # Check content length header
+        content_length = response.headers.get('content-length')
+        if content_length and int(content_length) > MAX_IMAGE_SIZE_MB * 1024 * 1024:
+            raise PermanentImageError(f"Image too large: {content_length} bytes (max {MAX_IMAGE_SIZE_MB}MB)")
+
+        # Download with size limit enforcement
+        image_data = io.BytesIO()
+        downloaded = 0
+        for chunk in response.iter_content(chunk_size=8192):
+            downloaded += len(chunk)
+            if downloaded > MAX_IMAGE_SIZE_MB * 1024 * 1024:
+                raise PermanentImageError(f"Image exceeds size limit ({MAX_IMAGE_SIZE_MB}MB)")
+            image_data.write(chunk)
+
+        return image_data.getvalue()
+
+    except requests.HTTPError as e:
+        status = e.response.status_code if e.response is not None else None
+        if status in PERMANENT_HTTP_STATUSES:
+            raise PermanentImageError(f"Failed to download image: HTTP {status}") from e
+        raise ValueError(f"Failed to download image: {str(e)}") from e
+    except requests.RequestException as e:
+        raise ValueError(f"Failed to download image: {str(e)}") from e
+
+
+def _storage_url(supabase_url: str, storage_path: str) -> str:
+    """
+    Public URL of an original in the portfolio-images bucket
+
+    Raises:
+        PermanentImageError: Path that isn't a plain object key (absolute, "..", query strings)
+    """
+    if (
+        not isinstance(storage_path, str)
+        or not STORAGE_PATH_PATTERN.match(storage_path)
+        or any(part in ("", ".", "..") for part in storage_path.split("/"))
+    ):
+        raise PermanentImageError(f"Invalid storage path: {storage_path!r}")
+    return f"{supabase_url}/storage/v1/object/public/{STORAGE_BUCKET}/{storage_path}"
+
+
+def _fetch_error_class(e: Exception) -> str:
+    """Error class for a failed _download_image, named like the bulk client's (download_http_404, download_timeout, ...)"""
+    import requests
+
+    cause = e.__cause__
+    if isinstance(cause, requests.HTTPError) and cause.response is not None:
+        return f"download_http_{cause.response.status_code}"
+    if isinstance(cause, requests.Timeout):
+        return "download_timeout"
+    if isinstance(e, PermanentImageError) and cause is None:
+        return "download_too_large"  # The only permanent download error without an HTTP cause
+    return f"download_{type(cause or e).__name__}"
+
+
+def _negotiate_embedding_media_type(accept: str) -> Optional[str]:
+    """Return the first binary embedding format listed in an Accept header (None = JSON)"""
+    for part in accept.split(","):
+        media_type = part.split(";")[0].strip().lower()
+        if media_type in EMBEDDING_MEDIA_TYPES:
+            return media_type
+    return None
+
+
+class RequestCoalescer:
+    """
+    Runs concurrent single-item requests as one batched call
+
+    The first queued item opens a window of max_wait seconds; everything that arrives
+    before it closes (up to max_batch items) goes through run_batch together, off the
+    event loop. Batches run one at a time, so while the GPU is busy the next batch
+    keeps filling - batch size follows the load.
+    """
+
+    def __init__(self, run_batch: Callable[[List[Any]], List[Any]], max_wait: float, max_batch: int):
+        """
+        Args:
+            run_batch: Sync function mapping a list of items to one result per item
+                       (an Exception instance fails just that item's request)
+            max_wait: Seconds the first item of a batch waits for company
+            max_batch: Most items per run_batch call
+        """
+        self.run_batch = run_batch
+        self.max_wait = max_wait
+        self.max_batch = max(1, max_batch)
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self.in_flight = 0
+        self.batches = 0
+        self.items = 0
+        self.largest_batch = 0
+
+    @property
+    def depth(self) -> int:
+        """Items waiting for a batch (not counting the one running)"""
+        return self._queue.qsize() if self._queue else 0
+
+    def stats(self) -> Dict:
+        return {
+            "queue_depth": self.depth,
+            "in_flight": self.in_flight,
+            "batches": self.batches,
+            "items": self.items,
+            "mean_batch_size": round(self.items / self.batches, 2) if self.batches else None,
+            "largest_batch": self.largest_batch,
+            "max_wait_ms": self.max_wait * 1000,
+            "max_batch": self.max_batch,
+        }
+
+    async def submit(self, item: Any) -> Any:
+        """Queue one item and wait for its result"""
+        if self._task is None:
+            # Started lazily so the queue and worker live on the serving event loop
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                if not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                    continue
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            # Callers that went away (client disconnect) don't need a slot
+            batch = [(item, future) for item, future in batch if not future.done()]
+            if not batch:
+                continue
+
+            self.in_flight = len(batch)
+            try:
+                results = await asyncio.to_thread(self.run_batch, [item for item, _ in batch])
+            except Exception as e:
+                results = [e] * len(batch)
+            finally:
+                self.in_flight = 0
+
+            self.batches += 1
+            self.items += len(batch)
+            self.largest_batch = max(self.largest_batch, len(batch))
+
+            for (_, future), result in zip(batch, results):
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+
+def normalize_query(text: str) -> str:
+    """Cache key for a text query (the CLIP tokenizer lowercases and collapses whitespace too)"""
+    return " ".join(text.lower().split())
+
+
+def prewarm_queries() -> List[str]:
+    """
+    Queries to embed when a container starts
+
+    Each style as the search handler sends it ("fine-line" -> "fine-line tattoo") and as
+    users type it ("fine line tattoo"), then CLIP_PREWARM_QUERIES.
+    """
+    queries = []
+    for style in STYLES:
+        queries += [f"{style} tattoo", f"{style.replace('-', ' ')} tattoo"]
+    queries += [query for query in CLIP_PREWARM_QUERIES.split("|") if query.strip()]
+    return list(dict.fromkeys(normalize_query(query) for query in queries))
+
+
+class TextEmbeddingCache:
+    """Thread-safe LRU cache of text embeddings keyed by normalized query"""
+
+    def __init__(self, capacity: int):
+        self.capacity = max(0, capacity)
+        self._entries: "OrderedDict[str, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.prewarmed = 0
+
+    def get(self, text: str) -> Optional[List[float]]:
+        key = normalize_query(text)
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return vector.tolist()
+
+    def put(self, text: str, embedding: List[float]):
+        import numpy as np
+
+        if self.capacity == 0:
+            return
+        key = normalize_query(text)
+        vector = np.asarray(embedding, dtype=np.float32)  # Model output is float32 - lossless
+        with self._lock:
+            self._entries[key] = vector
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+
+    def prewarm(self, queries: List[str], encode: Callable[[List[str]], List[List[float]]], batch_size: int = 64):
+        """Embed queries up front (in batches) so the first search for them is a lookup"""
+        queries = queries[:self.capacity]
+        for start in range(0, len(queries), batch_size):
+            chunk = queries[start:start + batch_size]
+            for query, embedding in zip(chunk, encode(chunk)):
+                self.put(query, embedding)
+        self.prewarmed = len(queries)
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "capacity": self.capacity,
+            "prewarmed": self.prewarmed,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+        }
+
 # Secrets for Supabase (set via `modal secret create supabase`)
 # You'll need to run: modal secret create supabase SUPABASE_URL=... SUPABASE_SERVICE_ROLE_KEY=...
 
@@ -46,6 +479,7 @@ image = (
     gpu="A10G",  # Single A10G GPU (~$0.60/hour, billed per second)
     image=image,
     secrets=[modal.Secret.from_name("supabase")],
+    volumes={WEIGHTS_DIR: weights_volume},
     timeout=7200,  # 2 hour max for full batch processing
 )
 class CLIPEmbedder:
@@ -55,19 +489,20 @@ class CLIPEmbedder:
     def enter(self):
         """Initialize model on GPU (runs once per container)"""
         import torch
-        import open_clip
         from supabase import create_client
 
         # Initialize CLIP model on GPU
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
         print(f"🔥 Using device: {self.device}")
 
-        self.model, _, self.preprocess = open_clip.create_model_and_transforms(
-            "ViT-L-14",
-            pretrained="laion2b_s32b_b82k",
-            device=self.device
-        )
-        self.model.eval()  # Set to evaluation mode
+        self.model, self.preprocess, self.tokenizer, self.cold_start = _load_model(self.device)
+        self.text_cache = TextEmbeddingCache(CLIP_TEXT_CACHE_SIZE)
+
+        # Pooled keep-alive connections for image downloads (shared by the download threads)
+        import requests
+        from requests.adapters import HTTPAdapter
+        self.http = requests.Session()
+        self.http.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=64))
 
         # Initialize Supabase client with validation
         try:
@@ -100,107 +535,25 @@ class CLIPEmbedder:
         Returns:
             768-dimensional embedding as list of floats
         """
-        import torch
-        import requests
-        from PIL import Image
-        import urllib.parse
-        import socket
-
-        # Security: Validate URL to prevent SSRF attacks
-        MAX_IMAGE_SIZE_MB = 20  # 20MB max
-        ALLOWED_SCHEMES = {"https"}  # Only HTTPS
-        BLOCKED_IPS = {
-            "127.0.0.1", "localhost", "0.0.0.0",
-            "169.254.169.254",  # AWS metadata
-            "::1",  # IPv6 localhost
-        }
-
-        # 1. Validate URL format
-        try:
-            parsed = urllib.parse.urlparse(image_url)
-        except Exception:
-            raise ValueError("Invalid URL format")
+        image_data = _download_image(self.http, image_url)
+        return self._encode_images([self._preprocess_image(image_data)])[0]
 
-        # 2. Check scheme is HTTPS only
-        if parsed.scheme not in ALLOWED_SCHEMES:
-            raise ValueError(f"Invalid URL scheme: {parsed.scheme}. Only HTTPS allowed.")
+    def _preprocess_image(self, image_data: bytes):
+        """
+        Safely decode an image and run the OpenCLIP preprocess (CPU, thread-safe)
 
-        # 3. Resolve hostname and block private IPs
-        try:
-            hostname = parsed.hostname
-            if not hostname:
-                raise ValueError("Missing hostname in URL")
-
-            # Resolve DNS
-            ip_addr = socket.gethostbyname(hostname)
-
-            # Block localhost and private IPs (RFC 1918)
-            if (ip_addr in BLOCKED_IPS or
-                ip_addr.startswith("10.") or
-                ip_addr.startswith("172.16.") or
-                ip_addr.startswith("192.168.")):
-                raise ValueError("Private IP address not allowed")
-        except socket.gaierror:
-            raise ValueError("Cannot resolve hostname")
-        except ValueError:
-            raise
-
-        # 4. Download with size limit (streaming to prevent memory exhaustion)
+        Raises:
+            PermanentImageError: Undecodable image or decompression bomb
+        """
         try:
-            response = requests.get(
-                image_url,
-                timeout=10,
-                stream=True,
-                headers={"User-Agent": "TattooDiscoveryBot/1.0"}
-            )
-            response.raise_for_status()
-
-            # Check content length header
-            content_length = response.headers.get('content-length')
-            if content_length and int(content_length) > MAX_IMAGE_SIZE_MB * 1024 * 1024:
-                raise ValueError(f"Image too large: {content_length} bytes (max {MAX_IMAGE_SIZE_MB}MB)")
-
-            # Download with size limit enforcement
-            image_data = io.BytesIO()
-            downloaded = 0
-            for chunk in response.iter_content(chunk_size=8192):
-                downloaded += len(chunk)
-                if downloaded > MAX_IMAGE_SIZE_MB * 1024 * 1024:
-                    raise ValueError(f"Image exceeds size limit ({MAX_IMAGE_SIZE_MB}MB)")
-                image_data.write(chunk)
-
-            image_data.seek(0)
-
-            # 5. Safely parse image
-            image = Image.open(image_data)
-
-            # Validate image dimensions (prevent decompression bombs)
-            width, height = image.size
-            if width * height > 100_000_000:  # 100 megapixels max
-                raise ValueError(f"Image too large: {width}x{height} pixels")
-
-            image = image.convert("RGB")
-
-        except requests.RequestException as e:
-            raise ValueError(f"Failed to download image: {str(e)}")
+            return self.preprocess(open_image(image_data))
         except Exception as e:
-            raise ValueError(f"Failed to process image: {str(e)}")
+            # Size limits and decode errors - the same bytes will fail the same way
+            raise PermanentImageError(f"Failed to process image: {str(e)}")
 
-        # Preprocess and generate embedding
-        image_tensor = self.preprocess(image).unsqueeze(0).to(self.device)
-
-        with torch.no_grad():
-            embedding = self.model.encode_image(image_tensor)
-            # Normalize embedding (important for cosine similarity)
-            embedding = embedding / embedding.norm(dim=-1, keepdim=True)
-            embedding = embedding.cpu().numpy()[0].tolist()
-
-        # Verify normalization (L2 norm should be ~1.0)
-        norm = sum(x**2 for x in embedding) ** 0.5
-        if abs(norm - 1.0) > 0.01:
-            raise ValueError(f"Embedding not properly normalized: L2 norm = {norm}")
-
-        return embedding
+    def _encode_images(self, tensors: List) -> List[List[float]]:
+        """One forward pass over preprocessed image tensors, returning normalized embeddings"""
+        return _encode_image_batch(self.model, self.device, tensors)
 
     @modal.method()
     def generate_text_embedding(self, text: str) -> List[float]:
@@ -214,11 +567,13 @@ class CLIPEmbedder:
             768-dimensional embedding as list of floats
         """
         import torch
-        import open_clip
+
+        cached = self.text_cache.get(text)
+        if cached is not None:
+            return cached
 
         # Tokenize text
-        tokenizer = open_clip.get_tokenizer("ViT-L-14")
-        text_tokens = tokenizer([text]).to(self.device)
+        text_tokens = self.tokenizer([text]).to(self.device)
 
         # Generate embedding
         with torch.no_grad():
@@ -227,122 +582,224 @@ class CLIPEmbedder:
             embedding = embedding / embedding.norm(dim=-1, keepdim=True)
             embedding = embedding.cpu().numpy()[0].tolist()
 
+        self.text_cache.put(text, embedding)
         return embedding
 
     @modal.method()
     def process_batch_from_db(
         self,
         batch_size: int = 100,
-        offset: int = 0,
-        city: Optional[str] = None
+        city: Optional[str] = None,
+        lease_seconds: int = 1800,
+        region: Optional[str] = None,
+        country: Optional[str] = None,
+        max_attempts: int = 5,
+        download_workers: int = 32,
+        decode_workers: int = 4,
+        encode_batch_size: int = 32
     ) -> dict:
         """
-        Fetch images from Supabase and generate embeddings in batch
+        Claim images from Supabase and generate embeddings in batch
+
+        Downloads (with their SSRF checks) run on a thread pool and hand each image to
+        a decode/preprocess pool; the GPU encodes whatever is ready, up to
+        encode_batch_size per forward pass, while the rest are still in flight.
 
         Args:
             batch_size: Number of images to process
-            offset: Offset for pagination
             city: Optional city filter (e.g., "Austin, TX")
+            lease_seconds: How long the claimed images stay reserved for this container
+            region: Optional state/province/region filter (e.g., "TX")
+            country: Optional two-letter country code filter (e.g., "GB")
+            max_attempts: Failed attempts before an image is dead-lettered (status 'failed')
+            download_workers: Concurrent image downloads
+            decode_workers: Threads decoding/preprocessing downloaded images
+            encode_batch_size: Most images per GPU forward pass
 
         Returns:
             Dict with processed count, errors, etc.
         """
-        import torch
-        from PIL import Image
-        import requests
+        import queue
         import traceback
+        import uuid
+        from concurrent.futures import ThreadPoolExecutor
+
+        # Lease the next pending images (status='pending', no embedding) to this
+        # call, so concurrent workers never process the same images
+        params = {
+            "p_worker_id": f"modal:{uuid.uuid4().hex[:12]}",
+            "p_limit": batch_size,
+            "p_lease_seconds": lease_seconds,
+        }
 
-        # Fetch images from Supabase that don't have embeddings yet
-        # Only fetch images with status='pending' to avoid race conditions
-        query = self.supabase.table("portfolio_images").select(
-            "id, storage_original_path, artist_id"
-        ).is_("embedding", "null").eq("status", "pending").limit(batch_size).offset(offset)
-
-        # Optional city filter (join with artists table)
-        if city:
-            query = query.eq("artists.city", city)
+        # Optional location filter (resolved in the database via artist_locations)
+        for key, value in (("p_city", city), ("p_region", region), ("p_country_code", country)):
+            if value:
+                params[key] = value
 
-        response = query.execute()
-        images = response.data
+        response = self.supabase.rpc("claim_pending_images", params).execute()
+        images = response.data or []
 
         if not images:
             return {
                 "processed": 0,
                 "errors": 0,
+                "total": 0,
                 "message": "No images to process (all done or in progress)"
             }
 
-        print(f"📸 Processing {len(images)} images (offset: {offset})")
+        print(f"📸 Processing {len(images)} claimed images")
 
         # Process all embeddings first (collect results before DB updates)
         results = []
+        failures = []
         errors = []
 
-        for img_data in images:
+        def record_error(img_data: dict, e: Exception):
+            errors.append({
+                "image_id": img_data["id"],
+                "storage_path": img_data["storage_original_path"],
+                "error_type": type(e).__name__,
+                "error_message": str(e),
+                "traceback": "".join(traceback.format_exception(e))[-500:]  # Last 500 chars
+            })
+
+            print(f"  ✗ Error processing image {img_data['id']} [{type(e).__name__}]: {e}")
+
+            # Permanent errors are dead-lettered now, others retried after a backoff
+            failures.append({
+                "id": img_data["id"],
+                "error": f"modal_{type(e).__name__}",
+                "permanent": isinstance(e, PermanentImageError)
+            })
+
+        # Every image ends up on `ready` exactly once: (image, tensor, None) or (image, None, error)
+        ready: "queue.Queue[tuple]" = queue.Queue()
+        supabase_url = os.environ["SUPABASE_URL"]
+        started = time.time()
+
+        def decode(img_data: dict, image_data: bytes):
             try:
-                # Construct public URL from storage path
-                storage_path = img_data["storage_original_path"]
-                supabase_url = os.environ["SUPABASE_URL"]
-                public_url = f"{supabase_url}/storage/v1/object/public/portfolio-images/{storage_path}"
-
-                # Generate embedding
-                embedding = self.generate_embedding.local(public_url)
-
-                results.append({
-                    "id": img_data["id"],
-                    "embedding": embedding,
-                    "status": "active"  # Mark as active once embedding is generated
-                })
-
+                ready.put((img_data, self._preprocess_image(image_data), None))
             except Exception as e:
-                error_info = {
-                    "image_id": img_data["id"],
-                    "storage_path": img_data["storage_original_path"],
-                    "error_type": type(e).__name__,
-                    "error_message": str(e),
-                    "traceback": traceback.format_exc()[-500:]  # Last 500 chars
-                }
-                errors.append(error_info)
+                ready.put((img_data, None, e))
 
-                print(f"  ✗ Error processing image {img_data['id']} [{type(e).__name__}]: {e}")
-
-                # Mark as failed
-                results.append({
-                    "id": img_data["id"],
-                    "status": "failed"
-                })
-
-        # Batch update database (atomic per record)
+        def fetch(img_data: dict):
+            try:
+                # Construct public URL from storage path
+                public_url = _storage_url(supabase_url, img_data["storage_original_path"])
+                image_data = _download_image(self.http, public_url)
+                decode_pool.submit(decode, img_data, image_data)
+            except Exception as e:
+                ready.put((img_data, None, e))
+
+        forward_passes = 0
+        with ThreadPoolExecutor(max_workers=download_workers) as download_pool, \
+                ThreadPoolExecutor(max_workers=decode_workers) as decode_pool:
+            for img_data in images:
+                download_pool.submit(fetch, img_data)
+
+            # Encode whatever is ready whenever the GPU is free - batches grow while it is busy
+            outstanding = len(images)
+            while outstanding:
+                items = [ready.get()]
+                while len(items) < encode_batch_size:
+                    try:
+                        items.append(ready.get_nowait())
+                    except queue.Empty:
+                        break
+                outstanding -= len(items)
+
+                batch = []
+                for img_data, tensor, error in items:
+                    if error is not None:
+                        record_error(img_data, error)
+                    else:
+                        batch.append((img_data, tensor))
+                if not batch:
+                    continue
+
+                try:
+                    embeddings = self._encode_images([tensor for _, tensor in batch])
+                    forward_passes += 1
+                except Exception as e:
+                    for img_data, _ in batch:
+                        record_error(img_data, e)
+                    continue
+
+                for (img_data, _), embedding in zip(batch, embeddings):
+                    results.append({
+                        "id": img_data["id"],
+                        "embedding": format_embedding(embedding),
+                        "status": "active"  # Mark as active once embedding is generated
+                    })
+
+        elapsed = time.time() - started
+        print(f"  ⚡ Embedded {len(results)}/{len(images)} images in {elapsed:.1f}s "
+              f"({forward_passes} forward passes, {len(images) / max(elapsed, 1e-9):.1f} images/s)")
+
+        # Write all embeddings and status flips with a single RPC (only rows still pending
+        # are written - images hidden or deleted while being embedded are left alone)
         successful_updates = 0
+        skipped_updates = 0
         failed_updates = 0
 
-        for result in results:
+        try:
+            response = self.supabase.rpc("bulk_update_image_embeddings", {"updates": results}).execute()
+            successful_updates = response.data if isinstance(response.data, int) else len(results)
+            skipped_updates = len(results) - successful_updates
+            print(f"  ✓ Stored {successful_updates} results in one bulk write")
+            if skipped_updates:
+                print(f"  ⚠️  {skipped_updates} images were no longer pending and were left unchanged")
+        except Exception as e:
+            # Bulk RPC unavailable - fall back to per-record updates
+            print(f"  ⚠️  Bulk write failed ({type(e).__name__}), falling back to per-record updates")
+
+            for result in results:
+                try:
+                    response = self.supabase.table("portfolio_images").update(result).eq(
+                        "id", result["id"]
+                    ).eq("status", "pending").execute()
+                    if not response.data:
+                        skipped_updates += 1  # No longer pending
+                        continue
+                    successful_updates += 1
+
+                    if successful_updates % 10 == 0:
+                        print(f"  ✓ Stored {successful_updates}/{len(results)} embeddings")
+
+                except Exception as e:
+                    failed_updates += 1
+                    print(f"  ✗ DB update failed for {result['id']}: {type(e).__name__}")
+                    errors.append({
+                        "image_id": result["id"],
+                        "error_type": "DatabaseUpdateError",
+                        "error_message": f"Failed to store embedding: {str(e)}"
+                    })
+
+        dead_lettered = 0
+        if failures:
             try:
-                self.supabase.table("portfolio_images").update(result).eq("id", result["id"]).execute()
-                successful_updates += 1
-
-                if successful_updates % 10 == 0:
-                    print(f"  ✓ Stored {successful_updates}/{len(results)} embeddings")
-
+                response = self.supabase.rpc("record_embedding_failures", {
+                    "failures": failures,
+                    "p_max_attempts": max_attempts
+                }).execute()
+                dead_lettered = response.data or 0
+                print(f"  ⏳ {len(failures) - dead_lettered} failed images will be retried later, {dead_lettered} dead-lettered")
             except Exception as e:
-                failed_updates += 1
-                print(f"  ✗ DB update failed for {result['id']}: {type(e).__name__}")
-                errors.append({
-                    "image_id": result["id"],
-                    "error_type": "DatabaseUpdateError",
-                    "error_message": f"Failed to store embedding: {str(e)}"
-                })
-
-        processed_count = len([r for r in results if r.get("status") == "active"])
+                # Leases expire on their own, so the images are retried either way
+                print(f"  ⚠️  Could not record {len(failures)} failures ({type(e).__name__})")
 
         return {
-            "processed": processed_count,
+            "processed": successful_updates,
             "errors": len(errors),
             "total": len(images),
             "successful_updates": successful_updates,
+            "skipped_updates": skipped_updates,
             "failed_updates": failed_updates,
+            "dead_lettered": dead_lettered,
+            "forward_passes": forward_passes,
             "error_details": errors[:10],  # First 10 errors
-            "offset": offset,
             "batch_size": batch_size
         }
 
@@ -355,15 +812,23 @@ class CLIPEmbedder:
 )
 def generate_embeddings_batch(
     batch_size: int = 100,
-    offset: int = 0,
     city: Optional[str] = None,
-    max_batches: int = 100
+    max_batches: int = 100,
+    region: Optional[str] = None,
+    country: Optional[str] = None,
+    download_workers: int = 32,
+    encode_batch_size: int = 32
 ):
     """
     Process all images in batches
 
+    Each batch claims its own images with a lease, so several of these can run
+    at once (or alongside local_batch_embeddings.py) without overlap.
+
     Usage:
         modal run scripts/embeddings/modal_clip_embeddings.py::generate_embeddings_batch --batch-size 100 --city "Austin, TX"
+        modal run scripts/embeddings/modal_clip_embeddings.py::generate_embeddings_batch --country GB
+        modal run scripts/embeddings/modal_clip_embeddings.py::generate_embeddings_batch --batch-size 500 --encode-batch-size 64
     """
     embedder = CLIPEmbedder()
 
@@ -372,22 +837,27 @@ def generate_embeddings_batch(
     batch_num = 0
 
     print(f"🚀 Starting batch embedding generation")
-    print(f"   Batch size: {batch_size}")
-    print(f"   Starting offset: {offset}")
+    print(f"   Batch size: {batch_size} ({download_workers} download threads, up to {encode_batch_size} images per forward pass)")
     if city:
         print(f"   City filter: {city}")
+    if region:
+        print(f"   Region filter: {region}")
+    if country:
+        print(f"   Country filter: {country}")
     print()
 
     while batch_num < max_batches:
-        batch_offset = offset + (batch_num * batch_size)
-
         result = embedder.process_batch_from_db.remote(
             batch_size=batch_size,
-            offset=batch_offset,
-            city=city
+            city=city,
+            region=region,
+            country=country,
+            download_workers=download_workers,
+            encode_batch_size=encode_batch_size
         )
 
-        if result["processed"] == 0:
+        # Stop once nothing is left to claim (a batch where every image failed still counts)
+        if result["total"] == 0:
             print("✅ All images processed!")
             break
 
@@ -458,109 +928,423 @@ def generate_text_query_embedding(text: str):
     gpu="A10G",
     image=image,
     secrets=[modal.Secret.from_name("supabase")],
+    volumes={WEIGHTS_DIR: weights_volume},
     scaledown_window=600,  # Keep container alive for 10 minutes after last request (Modal 1.0+)
     # No keep_warm - only pay when actively used, not 24/7
 )
+@modal.concurrent(max_inputs=CLIP_MAX_CONCURRENT_INPUTS)  # Concurrent requests share forward passes
 class Model:
     @modal.enter()
     def load_model(self):
         """Load model once when container starts (cached across requests)"""
         import torch
-        import open_clip
 
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
         print(f"🔥 Loading CLIP model on {self.device}...")
 
-        self.model, _, self.preprocess = open_clip.create_model_and_transforms(
-            "ViT-L-14",
-            pretrained="laion2b_s32b_b82k",
-            device=self.device
-        )
-        self.model.eval()
-        self.tokenizer = open_clip.get_tokenizer("ViT-L-14")
+        self.model, self.preprocess, self.tokenizer, self.cold_start = _load_model(self.device)
 
-        print("✅ Model loaded and ready")
+        # The Normalize step of preprocess, for client-preprocessed uint8 tensors
+        from torchvision.transforms import Normalize
+        self.normalize = next(t for t in self.preprocess.transforms if isinstance(t, Normalize))
 
-    @modal.method()
-    def generate_image_embedding_from_bytes(self, image_data: bytes) -> List[float]:
-        """Generate embedding from image bytes"""
+        # Search traffic arrives one image or query at a time - batch it across requests
+        max_wait = CLIP_COALESCE_MAX_WAIT_MS / 1000
+        self.image_coalescer = RequestCoalescer(self._encode_image_tensors, max_wait, CLIP_COALESCE_MAX_BATCH)
+        self.text_coalescer = RequestCoalescer(self._encode_texts, max_wait, CLIP_COALESCE_MAX_BATCH)
+
+        # Style names and top searches are served from the cache from the first request
+        self.text_cache = TextEmbeddingCache(CLIP_TEXT_CACHE_SIZE)
+        self.text_cache.prewarm(prewarm_queries(), self._encode_texts)
+        print(f"🔥 Prewarmed {self.text_cache.prewarmed} text queries")
+
+        # Bulk jobs can send storage paths instead of image bytes - fetch them from here
+        import requests
+        from concurrent.futures import ThreadPoolExecutor
+        from requests.adapters import HTTPAdapter
+        self.supabase_url = os.environ["SUPABASE_URL"]
+        self.http = requests.Session()
+        self.http.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=STORAGE_FETCH_WORKERS))
+        self.fetch_pool = ThreadPoolExecutor(max_workers=STORAGE_FETCH_WORKERS, thread_name_prefix="fetch")
+
+        print(f"✅ Model loaded and ready (coalescing up to {CLIP_COALESCE_MAX_BATCH} requests / {CLIP_COALESCE_MAX_WAIT_MS:g}ms)")
+
+    def _image_tensor(self, image_data: bytes, media_type: Optional[str] = None):
+        """
+        Turn an upload into a normalized CHW tensor
+
+        Encoded images are decoded by open_image (pixel limit, CLIP_REDUCED_DECODE)
+        and go through the OpenCLIP preprocess; client-preprocessed uint8 tensors
+        (TENSOR_MEDIA_TYPE) only need ToTensor + Normalize.
+        """
         import torch
-        from PIL import Image
-        import io
+        import numpy as np
 
-        image = Image.open(io.BytesIO(image_data)).convert("RGB")
-        image_tensor = self.preprocess(image).unsqueeze(0).to(self.device)
+        if media_type == TENSOR_MEDIA_TYPE:
+            if len(image_data) != CLIP_IMAGE_SIZE * CLIP_IMAGE_SIZE * 3:
+                raise ValueError(f"Preprocessed tensor must be {CLIP_IMAGE_SIZE}x{CLIP_IMAGE_SIZE}x3 uint8")
+            pixels = np.frombuffer(image_data, dtype=np.uint8).reshape(CLIP_IMAGE_SIZE, CLIP_IMAGE_SIZE, 3)
+            tensor = torch.from_numpy(pixels.copy()).permute(2, 0, 1).float().div(255.0)
+            return self.normalize(tensor)
 
-        with torch.no_grad():
-            embedding = self.model.encode_image(image_tensor)
-            embedding = embedding / embedding.norm(dim=-1, keepdim=True)
-            embedding = embedding.cpu().numpy()[0].tolist()
+        return self.preprocess(open_image(image_data))
 
-        return embedding
+    def _encode_image_tensors(self, tensors: List) -> List[List[float]]:
+        """One forward pass over preprocessed CHW tensors, returning normalized embeddings"""
+        return _encode_image_batch(self.model, self.device, tensors)
 
-    @modal.method()
-    def generate_text_embedding_from_string(self, text: str) -> List[float]:
-        """Generate embedding from text string"""
+    def _encode_texts(self, texts: List[str]) -> List[List[float]]:
+        """One forward pass over text queries, returning normalized embeddings"""
         import torch
 
-        text_tokens = self.tokenizer([text]).to(self.device)
+        text_tokens = self.tokenizer(texts).to(self.device)
 
         with torch.no_grad():
-            embedding = self.model.encode_text(text_tokens)
-            embedding = embedding / embedding.norm(dim=-1, keepdim=True)
-            embedding = embedding.cpu().numpy()[0].tolist()
+            embeddings = self.model.encode_text(text_tokens)
+            embeddings = embeddings / embeddings.norm(dim=-1, keepdim=True)
+            return embeddings.cpu().numpy().tolist()
+
+    @modal.method()
+    def generate_image_embedding_from_bytes(self, image_data: bytes, media_type: Optional[str] = None) -> List[float]:
+        """Generate embedding from image bytes (or a client-preprocessed tensor)"""
+        return self._encode_image_tensors([self._image_tensor(image_data, media_type)])[0]
+
+    @modal.method()
+    def generate_image_embeddings_from_bytes_batch(
+        self,
+        images_data: List[bytes],
+        media_types: Optional[List[Optional[str]]] = None
+    ) -> List[Optional[List[float]]]:
+        """
+        Generate embeddings for several images with a single forward pass
+
+        Images that fail to decode get None instead of failing the whole batch.
+        media_types marks client-preprocessed tensors (TENSOR_MEDIA_TYPE) per image.
+        """
+        embeddings: List[Optional[List[float]]] = [None] * len(images_data)
+        media_types = media_types or [None] * len(images_data)
+        tensors = []
+        indices = []
 
+        for i, (image_data, media_type) in enumerate(zip(images_data, media_types)):
+            try:
+                tensors.append(self._image_tensor(image_data, media_type))
+                indices.append(i)
+            except Exception as e:
+                print(f"  ✗ Failed to decode image {i} in batch: {e}")
+
+        if not tensors:
+            return embeddings
+
+        for i, embedding in zip(indices, self._encode_image_tensors(tensors)):
+            embeddings[i] = embedding
+
+        return embeddings
+
+    @modal.method()
+    def generate_embeddings_from_storage(
+        self,
+        storage_paths: List[str]
+    ) -> Tuple[List[Optional[List[float]]], List[Optional[Tuple[str, bool]]]]:
+        """
+        Fetch originals straight from storage and embed them with a single forward pass
+
+        Downloads run on the container's pooled connections with the same SSRF checks
+        and size limits as CLIPEmbedder; each download thread also decodes its image.
+
+        Returns:
+            (embeddings, errors) in request order - an image has either an embedding or
+            an (error class, permanent) pair
+        """
+        def fetch(storage_path: str):
+            try:
+                image_url = _storage_url(self.supabase_url, storage_path)
+            except PermanentImageError:
+                return None, ("invalid_storage_path", True)
+            try:
+                image_data = _download_image(self.http, image_url)
+            except Exception as e:
+                return None, (_fetch_error_class(e), isinstance(e, PermanentImageError))
+            try:
+                return self.preprocess(open_image(image_data)), None
+            except Exception:
+                return None, ("undecodable", True)
+
+        fetched = list(self.fetch_pool.map(fetch, storage_paths))
+        embeddings: List[Optional[List[float]]] = [None] * len(storage_paths)
+        for storage_path, (_, error) in zip(storage_paths, fetched):
+            if error is not None:
+                print(f"  ✗ Failed to fetch {storage_path}: {error[0]}")
+
+        indices = [i for i, (tensor, _) in enumerate(fetched) if tensor is not None]
+        if indices:
+            tensors = [fetched[i][0] for i in indices]
+            for i, embedding in zip(indices, self._encode_image_tensors(tensors)):
+                embeddings[i] = embedding
+
+        return embeddings, [error for _, error in fetched]
+
+    @modal.method()
+    def generate_text_embedding_from_string(self, text: str) -> List[float]:
+        """Generate embedding from text string"""
+        embedding = self.text_cache.get(text)
+        if embedding is None:
+            embedding = self._encode_texts([text])[0]
+            self.text_cache.put(text, embedding)
         return embedding
 
     @modal.asgi_app()
     def fastapi_app(self):
-        from fastapi import FastAPI, HTTPException
+        from fastapi import FastAPI, HTTPException, Request
+        from fastapi.responses import PlainTextResponse, Response
         from pydantic import BaseModel
+        from starlette.concurrency import run_in_threadpool
         import base64
+        import json
 
         web_app = FastAPI()
 
         class ImageRequest(BaseModel):
             image_data: str  # base64 encoded
 
+        class BatchImageRequest(BaseModel):
+            images: List[str]  # base64 encoded
+
         class TextRequest(BaseModel):
             text: str
 
+        class StorageImage(BaseModel):
+            id: str
+            storage_path: str  # storage_original_path in portfolio-images
+
+        class StorageBatchRequest(BaseModel):
+            images: List[StorageImage]
+
+        async def read_images(request: Request, batch: bool) -> Tuple[List[bytes], List[Optional[str]]]:
+            """
+            Read image bytes (and each upload's media type) from any supported request body
+
+            - application/json: {"image_data": base64} or {"images": [base64, ...]}
+            - multipart/form-data: one or more "images" file fields
+            - anything else (image/*, application/octet-stream): the raw image bytes
+            - application/x-clip-tensor-u8 (raw body or per multipart field): a
+              client-preprocessed 224x224x3 tensor
+            """
+            content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+            try:
+                if content_type == "application/json":
+                    payload = await request.json()
+                    if batch:
+                        images = [base64.b64decode(data) for data in BatchImageRequest(**payload).images]
+                    else:
+                        images = [base64.b64decode(ImageRequest(**payload).image_data)]
+                    return images, [None] * len(images)
+
+                if content_type == "multipart/form-data":
+                    form = await request.form()
+                    uploads = form.getlist("images")
+                    return (
+                        [await upload.read() for upload in uploads],
+                        [(upload.content_type or "").lower() for upload in uploads]
+                    )
+
+                return [await request.body()], [content_type]
+            except Exception:
+                raise HTTPException(status_code=400, detail="Invalid image payload")
+
+        def embeddings_response(request: Request, embeddings: List[Optional[List[float]]], batch: bool):
+            """Encode embeddings as packed floats if the client asked for it, JSON otherwise"""
+            import numpy as np
+
+            media_type = _negotiate_embedding_media_type(request.headers.get("accept", ""))
+            if media_type is None:
+                return {"embeddings": embeddings} if batch else {"embedding": embeddings[0]}
+
+            matrix = np.zeros((len(embeddings), EMBEDDING_DIM), dtype=EMBEDDING_MEDIA_TYPES[media_type])
+            failed = []
+            for i, embedding in enumerate(embeddings):
+                if embedding is None:
+                    failed.append(str(i))
+                else:
+                    matrix[i] = embedding
+
+            headers = {
+                "X-Embedding-Dim": str(EMBEDDING_DIM),
+                "X-Embedding-Count": str(len(embeddings)),
+            }
+            if failed:
+                headers["X-Embedding-Failed"] = ",".join(failed)
+            return Response(content=matrix.tobytes(), media_type=media_type, headers=headers)
+
+        @web_app.get("/health")
+        def api_health():
+            """Health check (same contract as the local CLIP server)"""
+            return {
+                "status": "ok",
+                "gpu_available": self.device == "cuda",
+                "model_loaded": True,
+                "model_name": "ViT-L-14",
+                "embedding_dim": EMBEDDING_DIM,
+                "input_formats": ["image", TENSOR_MEDIA_TYPE, "storage_path"],
+                "coalescing": {
+                    "image": self.image_coalescer.stats(),
+                    "text": self.text_coalescer.stats(),
+                },
+                "text_cache": self.text_cache.stats(),
+                "cold_start": {
+                    key: round(value, 3) if isinstance(value, float) else value
+                    for key, value in self.cold_start.items()
+                },
+            }
+
+        @web_app.get("/metrics")
+        def api_metrics():
+            """Request coalescing gauges and counters (Prometheus text format)"""
+            lines = [
+                "# TYPE inkdex_clip_queue_depth gauge",
+                "# TYPE inkdex_clip_batch_in_flight gauge",
+                "# TYPE inkdex_clip_batches_total counter",
+                "# TYPE inkdex_clip_batched_items_total counter",
+                "# TYPE inkdex_clip_text_cache_hits_total counter",
+                "# TYPE inkdex_clip_text_cache_misses_total counter",
+                "# TYPE inkdex_clip_text_cache_entries gauge",
+            ]
+            for kind, coalescer in (("image", self.image_coalescer), ("text", self.text_coalescer)):
+                lines += [
+                    f'inkdex_clip_queue_depth{{kind="{kind}"}} {coalescer.depth}',
+                    f'inkdex_clip_batch_in_flight{{kind="{kind}"}} {coalescer.in_flight}',
+                    f'inkdex_clip_batches_total{{kind="{kind}"}} {coalescer.batches}',
+                    f'inkdex_clip_batched_items_total{{kind="{kind}"}} {coalescer.items}',
+                ]
+            cache = self.text_cache.stats()
+            lines += [
+                f"inkdex_clip_text_cache_hits_total {cache['hits']}",
+                f"inkdex_clip_text_cache_misses_total {cache['misses']}",
+                f"inkdex_clip_text_cache_entries {cache['size']}",
+            ]
+            return PlainTextResponse("\n".join(lines) + "\n")
+
         @web_app.post("/generate_single_embedding")
-        def api_generate_single_embedding(request: ImageRequest):
+        async def api_generate_single_embedding(request: Request):
             """
             Web endpoint for generating single image embedding via HTTP POST
 
-            Request body: {"image_data": "base64_encoded_image"}
-            Response: {"embedding": [768 floats]}
+            Request body: {"image_data": "base64_encoded_image"}, raw image bytes, or a
+                          raw application/x-clip-tensor-u8 tensor
+            Response: {"embedding": [768 floats]}, or 768 packed floats when the
+                      Accept header lists application/x-embedding-f32 / -f16.
+                      An image that can't be decoded gets 422 with X-Embedding-Failed: 0
+                      (permanent - retrying it elsewhere can't help)
             """
+            images_bytes, media_types = await read_images(request, batch=False)
+            if len(images_bytes) != 1 or not images_bytes[0]:
+                raise HTTPException(status_code=400, detail="Expected exactly one image")
+
+            try:
+                # Decode in the threadpool, then share a forward pass with concurrent requests
+                tensor = await run_in_threadpool(self._image_tensor, images_bytes[0], media_types[0])
+            except Exception as e:
+                raise HTTPException(
+                    status_code=422, detail=f"Could not decode image: {e}", headers={"X-Embedding-Failed": "0"}
+                )
+
+            try:
+                embedding = await self.image_coalescer.submit(tensor)
+            except Exception as e:
+                raise HTTPException(status_code=500, detail=str(e))
+
+            return embeddings_response(request, [embedding], batch=False)
+
+        @web_app.post("/generate_batch_embeddings")
+        async def api_generate_batch_embeddings(request: Request):
+            """
+            Web endpoint for generating embeddings for several images in one forward pass
+
+            Request body: {"images": ["base64_encoded_image", ...]} or multipart "images" files
+                          (encoded images or application/x-clip-tensor-u8 tensors)
+            Response: {"embeddings": [[768 floats] or null, ...]} (same order as request;
+                      null for images that failed to decode), or packed float rows when
+                      negotiated via Accept (failed rows are zero and listed in X-Embedding-Failed)
+            """
+            images_bytes, media_types = await read_images(request, batch=True)
+            if not images_bytes:
+                raise HTTPException(status_code=400, detail="No images provided")
+            if len(images_bytes) > MAX_BATCH_IMAGES:
+                raise HTTPException(status_code=413, detail=f"Too many images (max {MAX_BATCH_IMAGES})")
+
             try:
-                # Decode base64 image
-                image_bytes = base64.b64decode(request.image_data)
+                embeddings = await run_in_threadpool(
+                    self.generate_image_embeddings_from_bytes_batch.local, images_bytes, media_types
+                )
+            except Exception as e:
+                raise HTTPException(status_code=500, detail=str(e))
 
-                # Use cached model (no .remote() call - already in same container)
-                embedding = self.generate_image_embedding_from_bytes.local(image_bytes)
+            return embeddings_response(request, embeddings, batch=True)
+
+        @web_app.post("/generate_embeddings_from_storage")
+        async def api_generate_embeddings_from_storage(body: StorageBatchRequest, request: Request):
+            """
+            Web endpoint that downloads the images from Supabase storage itself, so the
+            bytes never pass through the caller (one transfer instead of two)
+
+            Request body: {"images": [{"id": "...", "storage_path": "original/..."}, ...]}
+            Response: {"embeddings": {id: [768 floats]}, "errors": {id: {"error": class, "permanent": bool}}}
+                      (every id in exactly one of the two), or packed float rows in request
+                      order when negotiated via Accept - failed rows are zero, listed in
+                      X-Embedding-Failed, and X-Embedding-Errors maps their indices to
+                      [class, permanent] (JSON)
+            """
+            if not body.images:
+                raise HTTPException(status_code=400, detail="No images provided")
+            if len(body.images) > MAX_BATCH_IMAGES:
+                raise HTTPException(status_code=413, detail=f"Too many images (max {MAX_BATCH_IMAGES})")
+            ids = [image.id for image in body.images]
+            if len(set(ids)) != len(ids):
+                raise HTTPException(status_code=400, detail="Duplicate image ids")
 
-                return {"embedding": embedding}
+            try:
+                embeddings, errors = await run_in_threadpool(
+                    self.generate_embeddings_from_storage.local, [image.storage_path for image in body.images]
+                )
             except Exception as e:
                 raise HTTPException(status_code=500, detail=str(e))
 
+            if _negotiate_embedding_media_type(request.headers.get("accept", "")) is None:
+                return {
+                    "embeddings": {
+                        image_id: embedding for image_id, embedding in zip(ids, embeddings) if embedding is not None
+                    },
+                    "errors": {
+                        image_id: {"error": error[0], "permanent": error[1]}
+                        for image_id, error in zip(ids, errors) if error is not None
+                    },
+                }
+
+            response = embeddings_response(request, embeddings, batch=True)
+            failed = {str(i): list(error) for i, error in enumerate(errors) if error is not None}
+            if failed:
+                response.headers["X-Embedding-Errors"] = json.dumps(failed, separators=(",", ":"))
+            return response
+
         @web_app.post("/generate_text_query_embedding")
-        def api_generate_text_query_embedding(request: TextRequest):
+        async def api_generate_text_query_embedding(body: TextRequest, request: Request):
             """
             Web endpoint for generating text query embedding via HTTP POST
 
             Request body: {"text": "tattoo style description"}
-            Response: {"embedding": [768 floats]}
+            Response: {"embedding": [768 floats]}, or packed floats when negotiated via Accept
             """
             try:
-                # Use cached model (no .remote() call - already in same container)
-                embedding = self.generate_text_embedding_from_string.local(request.text)
-
-                return {"embedding": embedding}
+                embedding = self.text_cache.get(body.text)
+                if embedding is None:
+                    # Shares a forward pass with concurrent queries
+                    embedding = await self.text_coalescer.submit(body.text)
+                    self.text_cache.put(body.text, embedding)
             except Exception as e:
                 raise HTTPException(status_code=500, detail=str(e))
 
+            return embeddings_response(request, [embedding], batch=False)
+
         return web_app
 
 
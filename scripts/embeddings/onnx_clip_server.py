@@ -0,0 +1,682 @@
+#!/usr/bin/env python3
+"""
+ONNX Runtime CPU Backend for CLIP Embeddings
+
+Serves the same HTTP contract as the Modal `Model` app and the local GPU server
+(/health, /generate_single_embedding, /generate_batch_embeddings,
+/generate_embeddings_from_storage, /generate_text_query_embedding) from ONNX exports of the OpenCLIP ViT-L-14
+(laion2b_s32b_b82k) image and text towers, so many-core CPU boxes can absorb text
+queries and overflow backfill when both GPUs are busy. Point LOCAL_CLIP_URL (bulk
+jobs) or the search client's local URL at it - nothing else changes.
+
+Commands:
+    export  - Export both towers from the PyTorch model (needs torch + open-clip-torch +
+              safetensors; loads from the clip_weights.py snapshot, offline once it exists)
+    serve   - Serve embeddings on CPU (onnxruntime, Pillow, numpy, aiohttp; open-clip-torch
+              for the tokenizer only, CPU torch is enough)
+    parity  - Compare ONNX against PyTorch on sample images and style queries
+              (fails below --min-cosine, default 0.999)
+
+Both exported graphs return L2-normalized 768-d embeddings, like the GPU servers.
+Images are resized/center-cropped by clip_preprocess.py (exact match with the OpenCLIP
+transform) and normalized here, so the server needs no torchvision.
+
+Usage:
+    python scripts/embeddings/onnx_clip_server.py export --model-dir models/onnx-clip
+    python scripts/embeddings/onnx_clip_server.py parity --model-dir models/onnx-clip --seeds assets/seeds
+    python scripts/embeddings/onnx_clip_server.py serve --model-dir models/onnx-clip --port 5000 --intra-op-threads 16
+
+Environment Variables:
+    CLIP_API_KEY: Require "Authorization: Bearer <key>" on embedding requests (optional)
+    CLIP_REDUCED_DECODE: "1" to decode JPEGs at reduced resolution (see clip_preprocess.py)
+    SUPABASE_URL: Project URL; enables fetching originals by storage path (optional)
+"""
+
+import argparse
+import asyncio
+import base64
+import ipaddress
+import json
+import os
+import re
+import socket
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+# Fix Windows console encoding for emojis
+if sys.platform == 'win32':
+    try:
+        sys.stdout.reconfigure(encoding='utf-8')
+        sys.stderr.reconfigure(encoding='utf-8')
+    except:
+        pass
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from clip_preprocess import (
+    CLIP_IMAGE_SIZE,
+    CLIP_MEAN,
+    CLIP_STD,
+    IMAGE_EXTENSIONS,
+    TENSOR_BYTES,
+    TENSOR_MEDIA_TYPE,
+    open_image,
+    preprocess_to_uint8,
+)
+from clip_weights import DEFAULT_WEIGHTS_DIR, load_clip_model
+
+MODEL_NAME = "ViT-L-14"
+PRETRAINED = "laion2b_s32b_b82k"
+EMBEDDING_DIM = 768
+CONTEXT_LENGTH = 77
+
+IMAGE_ENCODER_FILE = "image_encoder.onnx"
+TEXT_ENCODER_FILE = "text_encoder.onnx"
+DEFAULT_MODEL_DIR = "models/onnx-clip"
+ONNX_OPSET = 17
+
+# Same limit as the Modal server's /generate_batch_embeddings
+MAX_BATCH_IMAGES = 64
+
+# Binary wire format (negotiated via the Accept header), same as the Modal server
+EMBEDDING_MEDIA_TYPES = {
+    "application/x-embedding-f32": "<f4",
+    "application/x-embedding-f16": "<f2",
+}
+
+# Server-side fetches by storage path (/generate_embeddings_from_storage), same rules
+# as the Modal server: public originals bucket, valid object keys, size limit
+STORAGE_BUCKET = "portfolio-images"
+STORAGE_PATH_PATTERN = re.compile(r"^[A-Za-z0-9_-][A-Za-z0-9._/-]*$")
+PERMANENT_HTTP_STATUSES = {400, 404, 410}
+MAX_IMAGE_SIZE_MB = 20
+FETCH_TIMEOUT = 10
+FETCH_CONNECTIONS = 64
+
+# Text queries checked by `parity` alongside the images (one per seed style)
+PARITY_QUERIES = [
+    "anime tattoo", "biomechanical tattoo", "black and gray tattoo", "blackwork tattoo",
+    "fine line tattoo", "horror tattoo", "illustrative tattoo", "japanese tattoo",
+    "lettering tattoo", "neo traditional tattoo", "small minimalist flower on the wrist",
+]
+
+
+def export_models(model_dir: str, weights_dir: Optional[str] = DEFAULT_WEIGHTS_DIR):
+    """
+    Export the image and text towers of the PyTorch model to ONNX
+
+    Each graph takes a dynamic batch and returns L2-normalized embeddings
+    (pixel_values [N, 3, 224, 224] float32 -> embeddings [N, 768];
+    input_ids [N, 77] int64 -> embeddings [N, 768]).
+
+    Args:
+        model_dir: Output folder (created if missing)
+        weights_dir: Weight snapshot folder (see clip_weights.py; created on first use)
+    """
+    import torch
+
+    class ImageTower(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, pixel_values):
+            embeddings = self.model.encode_image(pixel_values)
+            return embeddings / embeddings.norm(dim=-1, keepdim=True)
+
+    class TextTower(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, input_ids):
+            embeddings = self.model.encode_text(input_ids)
+            return embeddings / embeddings.norm(dim=-1, keepdim=True)
+
+    print(f"🔥 Loading {MODEL_NAME} ({PRETRAINED}) on CPU...")
+    model, _, tokenizer, _ = load_clip_model("cpu", weights_dir, warmup=False)
+
+    os.makedirs(model_dir, exist_ok=True)
+    exports = [
+        (ImageTower(model), torch.randn(2, 3, CLIP_IMAGE_SIZE, CLIP_IMAGE_SIZE), "pixel_values", IMAGE_ENCODER_FILE),
+        (TextTower(model), tokenizer(["a tattoo", "fine line rose"]), "input_ids", TEXT_ENCODER_FILE),
+    ]
+
+    for tower, sample, input_name, filename in exports:
+        path = os.path.join(model_dir, filename)
+        started = time.time()
+        with torch.no_grad():
+            torch.onnx.export(
+                tower,
+                (sample,),
+                path,
+                input_names=[input_name],
+                output_names=["embeddings"],
+                dynamic_axes={input_name: {0: "batch"}, "embeddings": {0: "batch"}},
+                opset_version=ONNX_OPSET,
+                do_constant_folding=True,
+            )
+        size_mb = os.path.getsize(path) / 1024 / 1024
+        print(f"✅ Exported {path} ({size_mb:.0f} MB, {time.time() - started:.1f}s)")
+
+
+def load_tokenizer():
+    """OpenCLIP's BPE tokenizer for ViT-L-14 (returns a callable: texts -> [N, 77] int64 array)"""
+    import open_clip
+
+    tokenizer = open_clip.get_tokenizer(MODEL_NAME)
+    return lambda texts: tokenizer(texts).numpy()
+
+
+class OnnxCLIPEncoder:
+    """CPU inference over the exported image and text towers"""
+
+    def __init__(self, model_dir: str, intra_op_threads: int = 0, inter_op_threads: int = 0):
+        """
+        Args:
+            model_dir: Folder with image_encoder.onnx and text_encoder.onnx (see `export`)
+            intra_op_threads: Threads inside one operator (0 = one per physical core)
+            inter_op_threads: Threads across independent operators (0 = ONNX Runtime default)
+        """
+        import numpy as np
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = intra_op_threads
+        options.inter_op_num_threads = inter_op_threads
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        # Parallel execution only pays off with several inter-op threads
+        if inter_op_threads > 1:
+            options.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+
+        providers = ["CPUExecutionProvider"]
+        self.image_session = ort.InferenceSession(os.path.join(model_dir, IMAGE_ENCODER_FILE), options, providers=providers)
+        self.text_session = ort.InferenceSession(os.path.join(model_dir, TEXT_ENCODER_FILE), options, providers=providers)
+        self.tokenize = load_tokenizer()
+
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        self._mean = np.array(CLIP_MEAN, dtype=np.float32).reshape(3, 1, 1)
+        self._std = np.array(CLIP_STD, dtype=np.float32).reshape(3, 1, 1)
+
+    def pixels(self, image_data: bytes, media_type: Optional[str] = None):
+        """
+        Turn an upload into a normalized CHW float32 array
+
+        Encoded images are resized/center-cropped first; client-preprocessed uint8
+        tensors (TENSOR_MEDIA_TYPE) only need scaling + normalization.
+        """
+        import numpy as np
+
+        if media_type != TENSOR_MEDIA_TYPE:
+            image_data = preprocess_to_uint8(image_data)
+            if image_data is None:
+                raise ValueError("Could not decode image")
+        elif len(image_data) != TENSOR_BYTES:
+            raise ValueError(f"Preprocessed tensor must be {CLIP_IMAGE_SIZE}x{CLIP_IMAGE_SIZE}x3 uint8")
+
+        pixels = np.frombuffer(image_data, dtype=np.uint8).reshape(CLIP_IMAGE_SIZE, CLIP_IMAGE_SIZE, 3)
+        pixels = pixels.transpose(2, 0, 1).astype(np.float32) / 255.0
+        return (pixels - self._mean) / self._std
+
+    def encode_pixels(self, pixels: List) -> List[List[float]]:
+        """One forward pass over normalized CHW arrays"""
+        import numpy as np
+
+        batch = np.stack(pixels).astype(np.float32)
+        return self.image_session.run(["embeddings"], {"pixel_values": batch})[0].tolist()
+
+    def encode_images(
+        self,
+        images_data: List[bytes],
+        media_types: Optional[List[Optional[str]]] = None
+    ) -> List[Optional[List[float]]]:
+        """Embed several images in one pass (None for images that fail to decode)"""
+        embeddings: List[Optional[List[float]]] = [None] * len(images_data)
+        media_types = media_types or [None] * len(images_data)
+        pixels = []
+        indices = []
+
+        for i, (image_data, media_type) in enumerate(zip(images_data, media_types)):
+            try:
+                pixels.append(self.pixels(image_data, media_type))
+                indices.append(i)
+            except Exception as e:
+                print(f"  ✗ Failed to decode image {i} in batch: {e}")
+
+        if pixels:
+            for i, embedding in zip(indices, self.encode_pixels(pixels)):
+                embeddings[i] = embedding
+
+        return embeddings
+
+    def encode_texts(self, texts: List[str]) -> List[List[float]]:
+        """One forward pass over text queries"""
+        input_ids = self.tokenize(texts).astype("int64")
+        return self.text_session.run(["embeddings"], {"input_ids": input_ids})[0].tolist()
+
+
+def storage_url(supabase_url: str, storage_path: str) -> Optional[str]:
+    """Public URL of an original in the portfolio-images bucket (None for paths that aren't plain object keys)"""
+    if (
+        not isinstance(storage_path, str)
+        or not STORAGE_PATH_PATTERN.match(storage_path)
+        or any(part in ("", ".", "..") for part in storage_path.split("/"))
+    ):
+        return None
+    return f"{supabase_url}/storage/v1/object/public/{STORAGE_BUCKET}/{storage_path}"
+
+
+async def check_public_host(hostname: str):
+    """
+    SSRF check: the storage host must resolve to public addresses only
+
+    Raises:
+        ValueError: Unresolvable host or a loopback/private/link-local address
+    """
+    try:
+        infos = await asyncio.get_running_loop().getaddrinfo(hostname, 443, type=socket.SOCK_STREAM)
+    except socket.gaierror:
+        raise ValueError("Cannot resolve hostname") from None
+
+    for info in infos:
+        address = ipaddress.ip_address(info[4][0])
+        if address.is_loopback or address.is_private or address.is_link_local or address.is_unspecified:
+            raise ValueError("Private IP address not allowed")
+
+
+def create_app(
+    encoder: OnnxCLIPEncoder,
+    workers: int = 1,
+    api_key: Optional[str] = None,
+    supabase_url: Optional[str] = None
+):
+    """
+    aiohttp app serving the GPU servers' embedding contract from the ONNX encoder
+
+    Args:
+        encoder: Loaded ONNX encoder
+        workers: Requests run through ONNX Runtime at once (each uses intra_op_threads)
+        api_key: Bearer token required on embedding endpoints (None = open)
+        supabase_url: Project URL for fetching originals by storage path (None disables
+                      /generate_embeddings_from_storage)
+    """
+    import aiohttp
+    import numpy as np
+    from urllib.parse import urlparse
+    from aiohttp import web
+
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="onnx")
+    started_at = time.time()
+    # Pooled keep-alive connections to storage, opened on startup
+    storage: Dict[str, aiohttp.ClientSession] = {}
+
+    if supabase_url and urlparse(supabase_url).scheme != "https":
+        raise ValueError("Invalid Supabase URL format (must start with https://)")
+
+    async def run(func, *args):
+        return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+
+    @web.middleware
+    async def require_api_key(request: web.Request, handler):
+        if api_key and request.path != "/health":
+            if request.headers.get("Authorization") != f"Bearer {api_key}":
+                return web.json_response({"detail": "Unauthorized"}, status=401)
+        return await handler(request)
+
+    async def read_images(request: web.Request, batch: bool) -> Tuple[List[bytes], List[Optional[str]]]:
+        """Same request bodies as the Modal server (JSON base64, multipart "images", raw bytes/tensor)"""
+        content_type = request.content_type.lower()
+        try:
+            if content_type == "application/json":
+                payload = await request.json()
+                encoded = payload["images"] if batch else [payload["image_data"]]
+                return [base64.b64decode(data) for data in encoded], [None] * len(encoded)
+
+            if content_type == "multipart/form-data":
+                images, media_types = [], []
+                reader = await request.multipart()
+                async for part in reader:
+                    if part.name == "images":
+                        images.append(bytes(await part.read()))
+                        media_types.append((part.headers.get("Content-Type") or "").split(";")[0].strip().lower())
+                return images, media_types
+
+            return [await request.read()], [content_type]
+        except Exception:
+            raise web.HTTPBadRequest(text="Invalid image payload")
+
+    def embeddings_response(request: web.Request, embeddings: List[Optional[List[float]]], batch: bool) -> web.Response:
+        """Packed floats if the client asked for them, JSON otherwise"""
+        media_type = None
+        for part in request.headers.get("Accept", "").split(","):
+            candidate = part.split(";")[0].strip().lower()
+            if candidate in EMBEDDING_MEDIA_TYPES:
+                media_type = candidate
+                break
+
+        if media_type is None:
+            return web.json_response({"embeddings": embeddings} if batch else {"embedding": embeddings[0]})
+
+        matrix = np.zeros((len(embeddings), EMBEDDING_DIM), dtype=EMBEDDING_MEDIA_TYPES[media_type])
+        failed = []
+        for i, embedding in enumerate(embeddings):
+            if embedding is None:
+                failed.append(str(i))
+            else:
+                matrix[i] = embedding
+
+        headers = {"X-Embedding-Dim": str(EMBEDDING_DIM), "X-Embedding-Count": str(len(embeddings))}
+        if failed:
+            headers["X-Embedding-Failed"] = ",".join(failed)
+        return web.Response(body=matrix.tobytes(), content_type=media_type, headers=headers)
+
+    async def health(request: web.Request) -> web.Response:
+        return web.json_response({
+            "status": "ok",
+            "gpu_available": False,
+            "model_loaded": True,
+            "model_name": MODEL_NAME,
+            "embedding_dim": EMBEDDING_DIM,
+            "input_formats": ["image", TENSOR_MEDIA_TYPE] + (["storage_path"] if supabase_url else []),
+            "backend": "onnxruntime-cpu",
+            "intra_op_threads": encoder.intra_op_threads,
+            "inter_op_threads": encoder.inter_op_threads,
+            "workers": workers,
+            "auth_required": bool(api_key),
+            "uptime_seconds": round(time.time() - started_at),
+        })
+
+    async def single(request: web.Request) -> web.Response:
+        images_bytes, media_types = await read_images(request, batch=False)
+        if len(images_bytes) != 1 or not images_bytes[0]:
+            raise web.HTTPBadRequest(text="Expected exactly one image")
+
+        try:
+            pixels = await run(encoder.pixels, images_bytes[0], media_types[0])
+        except Exception as e:
+            # Same marker as a failed batch row: permanent, not a backend failure
+            return web.json_response(
+                {"detail": f"Could not decode image: {e}"}, status=422, headers={"X-Embedding-Failed": "0"}
+            )
+
+        try:
+            embedding = (await run(encoder.encode_pixels, [pixels]))[0]
+        except Exception as e:
+            return web.json_response({"detail": str(e)}, status=500)
+
+        return embeddings_response(request, [embedding], batch=False)
+
+    async def batch(request: web.Request) -> web.Response:
+        images_bytes, media_types = await read_images(request, batch=True)
+        if not images_bytes:
+            raise web.HTTPBadRequest(text="No images provided")
+        if len(images_bytes) > MAX_BATCH_IMAGES:
+            return web.json_response({"detail": f"Too many images (max {MAX_BATCH_IMAGES})"}, status=413)
+
+        try:
+            embeddings = await run(encoder.encode_images, images_bytes, media_types)
+        except Exception as e:
+            return web.json_response({"detail": str(e)}, status=500)
+
+        return embeddings_response(request, embeddings, batch=True)
+
+    async def text(request: web.Request) -> web.Response:
+        try:
+            query = (await request.json())["text"]
+            if not isinstance(query, str):
+                raise TypeError
+        except Exception:
+            raise web.HTTPBadRequest(text='Expected {"text": "..."}')
+
+        try:
+            embedding = (await run(encoder.encode_texts, [query]))[0]
+        except Exception as e:
+            return web.json_response({"detail": str(e)}, status=500)
+
+        return embeddings_response(request, [embedding], batch=False)
+
+    async def fetch_storage_image(storage_path: str) -> Tuple[Optional[bytes], Optional[Tuple[str, bool]]]:
+        """Download one original: (bytes, None) or (None, (error class, permanent))"""
+        image_url = storage_url(supabase_url, storage_path)
+        if image_url is None:
+            return None, ("invalid_storage_path", True)
+
+        limit = MAX_IMAGE_SIZE_MB * 1024 * 1024
+        try:
+            async with storage["session"].get(image_url, allow_redirects=False) as response:
+                if response.status != 200:
+                    return None, (f"download_http_{response.status}", response.status in PERMANENT_HTTP_STATUSES)
+                if response.content_length and response.content_length > limit:
+                    return None, ("download_too_large", True)
+
+                image_data = bytearray()
+                async for chunk in response.content.iter_chunked(64 * 1024):
+                    image_data.extend(chunk)
+                    if len(image_data) > limit:
+                        return None, ("download_too_large", True)
+                return bytes(image_data), None
+        except asyncio.TimeoutError:
+            return None, ("download_timeout", False)
+        except Exception as e:
+            return None, (f"download_{type(e).__name__}", False)
+
+    async def from_storage(request: web.Request) -> web.Response:
+        try:
+            images = (await request.json())["images"]
+            ids = [str(image["id"]) for image in images]
+            storage_paths = [image["storage_path"] for image in images]
+        except Exception:
+            raise web.HTTPBadRequest(text='Expected {"images": [{"id": "...", "storage_path": "..."}, ...]}')
+        if not ids:
+            raise web.HTTPBadRequest(text="No images provided")
+        if len(ids) > MAX_BATCH_IMAGES:
+            return web.json_response({"detail": f"Too many images (max {MAX_BATCH_IMAGES})"}, status=413)
+        if len(set(ids)) != len(ids):
+            raise web.HTTPBadRequest(text="Duplicate image ids")
+
+        try:
+            await check_public_host(urlparse(supabase_url).hostname)
+        except ValueError as e:
+            return web.json_response({"detail": str(e)}, status=500)
+
+        fetched = await asyncio.gather(*(fetch_storage_image(path) for path in storage_paths))
+        errors = [error for _, error in fetched]
+        indices = [i for i, (image_data, _) in enumerate(fetched) if image_data is not None]
+        embeddings: List[Optional[List[float]]] = [None] * len(ids)
+        if indices:
+            try:
+                encoded = await run(encoder.encode_images, [fetched[i][0] for i in indices])
+            except Exception as e:
+                return web.json_response({"detail": str(e)}, status=500)
+            for i, embedding in zip(indices, encoded):
+                embeddings[i] = embedding
+                if embedding is None:
+                    errors[i] = ("undecodable", True)
+
+        for storage_path, error in zip(storage_paths, errors):
+            if error is not None:
+                print(f"  ✗ Failed to fetch {storage_path}: {error[0]}")
+
+        if not any(part.split(";")[0].strip().lower() in EMBEDDING_MEDIA_TYPES
+                   for part in request.headers.get("Accept", "").split(",")):
+            return web.json_response({
+                "embeddings": {
+                    image_id: embedding for image_id, embedding in zip(ids, embeddings) if embedding is not None
+                },
+                "errors": {
+                    image_id: {"error": error[0], "permanent": error[1]}
+                    for image_id, error in zip(ids, errors) if error is not None
+                },
+            })
+
+        response = embeddings_response(request, embeddings, batch=True)
+        failed = {str(i): list(error) for i, error in enumerate(errors) if error is not None}
+        if failed:
+            response.headers["X-Embedding-Errors"] = json.dumps(failed, separators=(",", ":"))
+        return response
+
+    async def startup(app: web.Application):
+        if supabase_url:
+            storage["session"] = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=FETCH_CONNECTIONS, ttl_dns_cache=300),
+                timeout=aiohttp.ClientTimeout(total=FETCH_TIMEOUT),
+                headers={"User-Agent": "TattooDiscoveryBot/1.0"},
+            )
+
+    async def shutdown(app: web.Application):
+        executor.shutdown(wait=False)
+        if "session" in storage:
+            await storage.pop("session").close()
+
+    app = web.Application(middlewares=[require_api_key], client_max_size=64 * 1024 * 1024)
+    app.router.add_get("/health", health)
+    app.router.add_post("/generate_single_embedding", single)
+    app.router.add_post("/generate_batch_embeddings", batch)
+    app.router.add_post("/generate_text_query_embedding", text)
+    if supabase_url:
+        app.router.add_post("/generate_embeddings_from_storage", from_storage)
+    app.on_startup.append(startup)
+    app.on_shutdown.append(shutdown)
+    return app
+
+
+def cosine(a, b) -> float:
+    import numpy as np
+
+    a = np.asarray(a, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
+    return float(a @ b / (np.linalg.norm(a) * np.linalg.norm(b)))
+
+
+def check_parity(
+    model_dir: str,
+    seeds: str,
+    limit: Optional[int] = None,
+    min_cosine: float = 0.999,
+    weights_dir: Optional[str] = DEFAULT_WEIGHTS_DIR
+) -> bool:
+    """
+    Compare ONNX embeddings against the PyTorch model the GPU servers run
+
+    Args:
+        model_dir: Folder with the exported encoders
+        seeds: Folder of sample images (searched recursively, e.g. assets/seeds)
+        limit: Max images to check
+        min_cosine: Lowest acceptable cosine similarity per image / query
+        weights_dir: Weight snapshot folder for the PyTorch reference (see clip_weights.py)
+
+    Returns:
+        True if every image and query is at or above min_cosine
+    """
+    import torch
+
+    model, preprocess, tokenizer, _ = load_clip_model("cpu", weights_dir, warmup=False)
+    encoder = OnnxCLIPEncoder(model_dir)
+
+    paths = sorted(p for p in Path(seeds).rglob("*") if p.suffix.lower() in IMAGE_EXTENSIONS)
+    if limit:
+        paths = paths[:limit]
+
+    scores = []
+    skipped = 0
+    for path in paths:
+        image_bytes = path.read_bytes()
+        try:
+            # Reference: the exact path the Modal server takes for an encoded image
+            tensor = preprocess(open_image(image_bytes)).unsqueeze(0)
+        except Exception:
+            skipped += 1  # Format PIL can't decode here (e.g. AVIF without a plugin)
+            continue
+
+        with torch.no_grad():
+            reference = model.encode_image(tensor)
+            reference = (reference / reference.norm(dim=-1, keepdim=True))[0].numpy()
+
+        embedding = encoder.encode_images([image_bytes])[0]
+        scores.append((str(path), cosine(reference, embedding) if embedding is not None else 0.0))
+
+    with torch.no_grad():
+        references = model.encode_text(tokenizer(PARITY_QUERIES))
+        references = (references / references.norm(dim=-1, keepdim=True)).numpy()
+    for query, reference, embedding in zip(PARITY_QUERIES, references, encoder.encode_texts(PARITY_QUERIES)):
+        scores.append((f'text "{query}"', cosine(reference, embedding)))
+
+    failures = [(name, score) for name, score in scores if score < min_cosine]
+    worst = min(score for _, score in scores) if scores else None
+
+    print(f"🔍 Checked {len(scores) - len(PARITY_QUERIES)} images ({skipped} skipped, undecodable) and {len(PARITY_QUERIES)} queries")
+    if worst is not None:
+        print(f"   Lowest cosine similarity: {worst:.6f} (minimum {min_cosine})")
+    for name, score in sorted(failures, key=lambda item: item[1])[:10]:
+        print(f"   ✗ {name}: {score:.6f}")
+
+    if failures:
+        print(f"❌ {len(failures)} embeddings differ from the PyTorch model")
+        return False
+
+    print("✅ ONNX embeddings match the PyTorch model")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ONNX Runtime CPU backend for CLIP embeddings")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export", help="Export the image and text towers to ONNX")
+    export_parser.add_argument("--model-dir", default=DEFAULT_MODEL_DIR,
+                               help=f"Output folder (default: {DEFAULT_MODEL_DIR})")
+    export_parser.add_argument("--weights-dir", default=DEFAULT_WEIGHTS_DIR,
+                               help=f"PyTorch weight snapshot folder (default: {DEFAULT_WEIGHTS_DIR})")
+
+    parity_parser = subparsers.add_parser("parity", help="Compare ONNX against PyTorch embeddings")
+    parity_parser.add_argument("--model-dir", default=DEFAULT_MODEL_DIR,
+                               help=f"Folder with the exported encoders (default: {DEFAULT_MODEL_DIR})")
+    parity_parser.add_argument("--seeds", default="assets/seeds", help="Sample images (default: assets/seeds)")
+    parity_parser.add_argument("--limit", type=int, help="Max images to check")
+    parity_parser.add_argument("--min-cosine", type=float, default=0.999,
+                               help="Lowest acceptable cosine similarity (default: 0.999)")
+    parity_parser.add_argument("--weights-dir", default=DEFAULT_WEIGHTS_DIR,
+                               help=f"PyTorch weight snapshot folder (default: {DEFAULT_WEIGHTS_DIR})")
+
+    serve_parser = subparsers.add_parser("serve", help="Serve embeddings over HTTP on CPU")
+    serve_parser.add_argument("--model-dir", default=DEFAULT_MODEL_DIR,
+                              help=f"Folder with the exported encoders (default: {DEFAULT_MODEL_DIR})")
+    serve_parser.add_argument("--host", default="0.0.0.0", help="Bind address (default: 0.0.0.0)")
+    serve_parser.add_argument("--port", type=int, default=5000, help="Port (default: 5000)")
+    serve_parser.add_argument("--intra-op-threads", type=int, default=0,
+                              help="Threads per operator, 0 = one per physical core (default: 0)")
+    serve_parser.add_argument("--inter-op-threads", type=int, default=0,
+                              help="Threads across operators, 0 = ONNX Runtime default (default: 0)")
+    serve_parser.add_argument("--workers", type=int, default=1,
+                              help="Requests inferred at once; keep workers x intra-op threads <= cores (default: 1)")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        export_models(args.model_dir, args.weights_dir)
+        return 0
+
+    if args.command == "parity":
+        return 0 if check_parity(args.model_dir, args.seeds, args.limit, args.min_cosine, args.weights_dir) else 1
+
+    from aiohttp import web
+
+    print(f"🔥 Loading ONNX encoders from {args.model_dir}...")
+    started = time.time()
+    encoder = OnnxCLIPEncoder(args.model_dir, args.intra_op_threads, args.inter_op_threads)
+    print(f"✅ Encoders loaded in {time.time() - started:.1f}s "
+          f"(intra-op {args.intra_op_threads or 'auto'}, inter-op {args.inter_op_threads or 'auto'}, {args.workers} workers)")
+
+    supabase_url = os.getenv("SUPABASE_URL") or os.getenv("NEXT_PUBLIC_SUPABASE_URL")
+    app = create_app(encoder, args.workers, os.getenv("CLIP_API_KEY"), supabase_url)
+    if not supabase_url:
+        print("⚠️  SUPABASE_URL not set, fetching images by storage path is disabled")
+    web.run_app(app, host=args.host, port=args.port)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
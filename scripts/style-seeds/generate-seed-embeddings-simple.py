@@ -10,12 +10,16 @@ Usage:
 
 import json
 import os
+import sys
 import base64
 from pathlib import Path
 from typing import List, Dict, Any
 
 import modal
 
+# clip_weights.py lives with the embedding scripts (shipped into the image below)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "embeddings"))
+
 # Modal app configuration
 app = modal.App("style-seed-embeddings")
 
@@ -28,14 +32,21 @@ image = (
         "open_clip_torch==2.24.0",
         "Pillow==10.2.0",
         "numpy<2",  # Compatibility with torch 2.1.2
+        "safetensors==0.4.2",  # Weight snapshots (clip_weights.py)
     )
+    .add_local_python_source("clip_weights")
 )
 
+# Same weight snapshot volume as modal_clip_embeddings.py (see clip_weights.py)
+weights_volume = modal.Volume.from_name("clip-weights", create_if_missing=True)
+WEIGHTS_DIR = "/weights"
+
 
 @app.function(
     image=image,
     gpu="A10G",
     timeout=600,  # 10 minutes should be plenty for 57 images
+    volumes={WEIGHTS_DIR: weights_volume},
 )
 def generate_embeddings(images_data: List[Dict[str, Any]]) -> Dict[str, Any]:
     """
@@ -48,7 +59,6 @@ def generate_embeddings(images_data: List[Dict[str, Any]]) -> Dict[str, Any]:
         Dictionary with embeddings and metadata
     """
     import torch
-    import open_clip
     from PIL import Image
     import numpy as np
     import io
@@ -56,18 +66,18 @@ def generate_embeddings(images_data: List[Dict[str, Any]]) -> Dict[str, Any]:
     print(f"🚀 Starting embedding generation")
     print(f"📊 Processing {len(images_data)} seed images")
 
-    # Load CLIP model
-    print("🔧 Loading CLIP model...")
-    model, _, preprocess = open_clip.create_model_and_transforms(
-        "ViT-L-14",
-        pretrained="laion2b_s32b_b82k"
-    )
-    model.eval()
+    from clip_weights import format_timings, load_clip_model
 
     # Check GPU
     device = "cuda" if torch.cuda.is_available() else "cpu"
     print(f"💻 Using device: {device}")
-    model = model.to(device)
+
+    # Load CLIP model (from the weight snapshot, creating it on first use)
+    print("🔧 Loading CLIP model...")
+    model, preprocess, _, timings = load_clip_model(device, WEIGHTS_DIR)
+    if timings["snapshot_created"]:
+        weights_volume.commit()  # Make the snapshot visible to later runs
+    print(f"⏱️  Model load: {format_timings(timings)}")
 
     results = []
     successful = 0
@@ -0,0 +1,50 @@
+-- Bulk embedding writes for the embedding scripts
+-- local_batch_embeddings.py and modal_clip_embeddings.py used to issue one PostgREST
+-- update per image. This applies embedding + status for a whole chunk of images
+-- in a single round-trip.
+
+-- Allow 'failed' (already written by modal_clip_embeddings.py for images that
+-- cannot be embedded, but rejected by the original constraint)
+ALTER TABLE portfolio_images DROP CONSTRAINT IF EXISTS valid_status;
+ALTER TABLE portfolio_images ADD CONSTRAINT valid_status
+  CHECK (status = ANY (ARRAY['pending', 'active', 'hidden', 'deleted', 'failed']));
+
+COMMENT ON CONSTRAINT valid_status ON portfolio_images IS 'Valid image statuses:
+- pending: Image uploaded, awaiting embedding generation
+- active: Image has embedding and is searchable
+- hidden: Image hidden from search results
+- deleted: Soft-deleted image
+- failed: Embedding generation failed permanently (e.g. undecodable image)';
+
+-- updates: [{"id": uuid, "status": "active"|"failed"|"pending", "embedding": "[0.1,...]" | null}, ...]
+-- Only touches images that are still pending, so an image hidden or deleted
+-- while its embedding was being computed is not resurrected.
+CREATE OR REPLACE FUNCTION public.bulk_update_image_embeddings(updates jsonb)
+RETURNS integer
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = 'public'
+AS $$
+DECLARE
+  updated_count integer;
+BEGIN
+  UPDATE portfolio_images pi
+  SET
+    embedding = COALESCE(u.embedding::vector(768), pi.embedding),
+    status = u.status
+  FROM jsonb_to_recordset(updates) AS u(id uuid, status text, embedding text)
+  WHERE pi.id = u.id
+    AND pi.status = 'pending'
+    AND u.status IN ('active', 'failed', 'pending')
+    AND (u.status <> 'active' OR u.embedding IS NOT NULL);
+
+  GET DIAGNOSTICS updated_count = ROW_COUNT;
+  RETURN updated_count;
+END;
+$$;
+
+REVOKE EXECUTE ON FUNCTION public.bulk_update_image_embeddings(jsonb) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.bulk_update_image_embeddings(jsonb) TO service_role;
+
+COMMENT ON FUNCTION public.bulk_update_image_embeddings(jsonb)
+IS 'Applies embedding + status for many pending portfolio_images in one call. Used by embedding scripts.';
@@ -0,0 +1,112 @@
+-- Lease-based work claiming for embedding workers
+-- Replaces offset pagination over pending images (processed rows drop out of the
+-- pending set, so later offsets skipped unprocessed images). Each worker atomically
+-- claims the next N unclaimed pending images with a lease; expired leases return
+-- the images to the pool, so crashed workers never strand work.
+
+ALTER TABLE portfolio_images
+ADD COLUMN IF NOT EXISTS embedding_claimed_by TEXT,
+ADD COLUMN IF NOT EXISTS embedding_lease_expires_at TIMESTAMPTZ;
+
+COMMENT ON COLUMN portfolio_images.embedding_claimed_by IS
+  'Embedding worker currently holding a lease on this pending image (NULL = unclaimed)';
+
+COMMENT ON COLUMN portfolio_images.embedding_lease_expires_at IS
+  'When the embedding worker lease expires and the image returns to the pending pool';
+
+-- Keeps each claim a constant-cost index scan regardless of backlog position
+CREATE INDEX IF NOT EXISTS idx_portfolio_images_pending_embedding
+ON portfolio_images (created_at, id)
+WHERE status = 'pending' AND embedding IS NULL;
+
+-- Claim up to p_limit pending images for p_worker_id.
+-- SKIP LOCKED lets any number of workers claim concurrently without overlap.
+CREATE OR REPLACE FUNCTION public.claim_pending_images(
+  p_worker_id text,
+  p_limit integer DEFAULT 100,
+  p_lease_seconds integer DEFAULT 600,
+  p_artist_ids uuid[] DEFAULT NULL
+)
+RETURNS TABLE (id uuid, storage_original_path text, artist_id uuid)
+LANGUAGE sql
+SECURITY DEFINER
+SET search_path = 'public'
+AS $$
+  WITH claimable AS (
+    SELECT pi.id
+    FROM portfolio_images pi
+    WHERE pi.status = 'pending'
+      AND pi.embedding IS NULL
+      AND (pi.embedding_lease_expires_at IS NULL OR pi.embedding_lease_expires_at < now())
+      AND (p_artist_ids IS NULL OR pi.artist_id = ANY (p_artist_ids))
+    ORDER BY pi.created_at, pi.id
+    LIMIT p_limit
+    FOR UPDATE SKIP LOCKED
+  )
+  UPDATE portfolio_images pi
+  SET
+    embedding_claimed_by = p_worker_id,
+    embedding_lease_expires_at = now() + make_interval(secs => p_lease_seconds)
+  FROM claimable c
+  WHERE pi.id = c.id
+  RETURNING pi.id, pi.storage_original_path, pi.artist_id;
+$$;
+
+-- Return a worker's unfinished claims to the pool (called on clean shutdown)
+CREATE OR REPLACE FUNCTION public.release_image_claims(p_worker_id text)
+RETURNS integer
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = 'public'
+AS $$
+DECLARE
+  released_count integer;
+BEGIN
+  UPDATE portfolio_images
+  SET
+    embedding_claimed_by = NULL,
+    embedding_lease_expires_at = NULL
+  WHERE embedding_claimed_by = p_worker_id;
+
+  GET DIAGNOSTICS released_count = ROW_COUNT;
+  RETURN released_count;
+END;
+$$;
+
+-- Completed writes also clear the lease
+CREATE OR REPLACE FUNCTION public.bulk_update_image_embeddings(updates jsonb)
+RETURNS integer
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = 'public'
+AS $$
+DECLARE
+  updated_count integer;
+BEGIN
+  UPDATE portfolio_images pi
+  SET
+    embedding = COALESCE(u.embedding::vector(768), pi.embedding),
+    status = u.status,
+    embedding_claimed_by = NULL,
+    embedding_lease_expires_at = NULL
+  FROM jsonb_to_recordset(updates) AS u(id uuid, status text, embedding text)
+  WHERE pi.id = u.id
+    AND pi.status = 'pending'
+    AND u.status IN ('active', 'failed', 'pending')
+    AND (u.status <> 'active' OR u.embedding IS NOT NULL);
+
+  GET DIAGNOSTICS updated_count = ROW_COUNT;
+  RETURN updated_count;
+END;
+$$;
+
+REVOKE EXECUTE ON FUNCTION public.claim_pending_images(text, integer, integer, uuid[]) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.claim_pending_images(text, integer, integer, uuid[]) TO service_role;
+REVOKE EXECUTE ON FUNCTION public.release_image_claims(text) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.release_image_claims(text) TO service_role;
+
+COMMENT ON FUNCTION public.claim_pending_images(text, integer, integer, uuid[])
+IS 'Atomically leases the next unclaimed pending images to an embedding worker (SKIP LOCKED). Expired leases are reclaimable.';
+
+COMMENT ON FUNCTION public.release_image_claims(text)
+IS 'Releases all image leases held by an embedding worker.';
@@ -0,0 +1,136 @@
+-- Server-side location filtering for embedding workers
+-- The --city option used to fetch every artist id in the city and send the whole list
+-- back with each claim (and with the pending count), which blew past URL length limits
+-- for big cities. Workers now pass a city, region and/or country and the database
+-- resolves the matching artists via artist_locations, so region-sharded backfills can
+-- run side by side.
+
+-- Pending images per artist, for location-filtered claims and counts
+CREATE INDEX IF NOT EXISTS idx_portfolio_images_pending_embedding_artist
+ON portfolio_images (artist_id, created_at, id)
+WHERE status = 'pending' AND embedding IS NULL;
+
+-- Artists with a location matching the filter (NULL when no filter is given).
+-- p_city accepts "Austin" or "Austin, TX" (the part after the comma is the region).
+CREATE OR REPLACE FUNCTION public.embedding_location_artist_ids(
+  p_city text DEFAULT NULL,
+  p_region text DEFAULT NULL,
+  p_country_code text DEFAULT NULL
+)
+RETURNS uuid[]
+LANGUAGE plpgsql
+STABLE
+SECURITY DEFINER
+SET search_path = 'public'
+AS $$
+DECLARE
+  v_city text := NULLIF(btrim(split_part(p_city, ',', 1)), '');
+  v_region text := COALESCE(NULLIF(btrim(p_region), ''), NULLIF(btrim(split_part(p_city, ',', 2)), ''));
+  v_country text := UPPER(NULLIF(btrim(p_country_code), ''));
+  v_artist_ids uuid[];
+BEGIN
+  IF v_city IS NULL AND v_region IS NULL AND v_country IS NULL THEN
+    RETURN NULL;
+  END IF;
+
+  SELECT COALESCE(array_agg(DISTINCT al.artist_id), '{}')
+  INTO v_artist_ids
+  FROM artist_locations al
+  WHERE (v_city IS NULL OR LOWER(al.city) = LOWER(v_city))
+    AND (v_region IS NULL OR LOWER(al.region) = LOWER(v_region))
+    AND (v_country IS NULL OR al.country_code = v_country);
+
+  RETURN v_artist_ids;
+END;
+$$;
+
+-- Replaces the p_artist_ids variant from 20260120_002
+DROP FUNCTION IF EXISTS public.claim_pending_images(text, integer, integer, uuid[]);
+
+-- Claim up to p_limit pending images for p_worker_id, optionally within a location.
+-- SKIP LOCKED lets any number of workers claim concurrently without overlap.
+CREATE OR REPLACE FUNCTION public.claim_pending_images(
+  p_worker_id text,
+  p_limit integer DEFAULT 100,
+  p_lease_seconds integer DEFAULT 600,
+  p_city text DEFAULT NULL,
+  p_region text DEFAULT NULL,
+  p_country_code text DEFAULT NULL
+)
+RETURNS TABLE (id uuid, storage_original_path text, artist_id uuid)
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = 'public'
+AS $$
+#variable_conflict use_column
+DECLARE
+  v_artist_ids uuid[] := embedding_location_artist_ids(p_city, p_region, p_country_code);
+BEGIN
+  IF v_artist_ids = '{}' THEN
+    RETURN;  -- No artists in this location
+  END IF;
+
+  RETURN QUERY
+  WITH claimable AS (
+    SELECT pi.id
+    FROM portfolio_images pi
+    WHERE pi.status = 'pending'
+      AND pi.embedding IS NULL
+      AND (pi.embedding_lease_expires_at IS NULL OR pi.embedding_lease_expires_at < now())
+      AND (v_artist_ids IS NULL OR pi.artist_id = ANY (v_artist_ids))
+    ORDER BY pi.created_at, pi.id
+    LIMIT p_limit
+    FOR UPDATE SKIP LOCKED
+  )
+  UPDATE portfolio_images pi
+  SET
+    embedding_claimed_by = p_worker_id,
+    embedding_lease_expires_at = now() + make_interval(secs => p_lease_seconds)
+  FROM claimable c
+  WHERE pi.id = c.id
+  RETURNING pi.id, pi.storage_original_path, pi.artist_id;
+END;
+$$;
+
+-- Pending images (claimed or not), optionally within a location
+CREATE OR REPLACE FUNCTION public.count_pending_embedding_images(
+  p_city text DEFAULT NULL,
+  p_region text DEFAULT NULL,
+  p_country_code text DEFAULT NULL
+)
+RETURNS bigint
+LANGUAGE plpgsql
+STABLE
+SECURITY DEFINER
+SET search_path = 'public'
+AS $$
+DECLARE
+  v_artist_ids uuid[] := embedding_location_artist_ids(p_city, p_region, p_country_code);
+  v_count bigint;
+BEGIN
+  SELECT COUNT(*)
+  INTO v_count
+  FROM portfolio_images pi
+  WHERE pi.status = 'pending'
+    AND pi.embedding IS NULL
+    AND (v_artist_ids IS NULL OR pi.artist_id = ANY (v_artist_ids));
+
+  RETURN v_count;
+END;
+$$;
+
+REVOKE EXECUTE ON FUNCTION public.embedding_location_artist_ids(text, text, text) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.embedding_location_artist_ids(text, text, text) TO service_role;
+REVOKE EXECUTE ON FUNCTION public.claim_pending_images(text, integer, integer, text, text, text) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.claim_pending_images(text, integer, integer, text, text, text) TO service_role;
+REVOKE EXECUTE ON FUNCTION public.count_pending_embedding_images(text, text, text) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.count_pending_embedding_images(text, text, text) TO service_role;
+
+COMMENT ON FUNCTION public.embedding_location_artist_ids(text, text, text)
+IS 'Artist ids with a location matching the city ("Austin" or "Austin, TX"), region and/or country filter. NULL when no filter is given.';
+
+COMMENT ON FUNCTION public.claim_pending_images(text, integer, integer, text, text, text)
+IS 'Atomically leases the next unclaimed pending images to an embedding worker (SKIP LOCKED), optionally filtered by city/region/country. Expired leases are reclaimable.';
+
+COMMENT ON FUNCTION public.count_pending_embedding_images(text, text, text)
+IS 'Counts images still waiting for an embedding, optionally filtered by city/region/country.';
@@ -0,0 +1,129 @@
+-- Priority lanes for embedding claims
+-- Images from newly onboarded artists and manual dashboard imports used to wait behind
+-- the whole scraped backlog. Pending images are now split into three classes by
+-- import_source, and each claim hands out slots by class weight (onboarding > sync >
+-- backfill). Slots a class can't fill go to the other classes, so backfill keeps its
+-- throughput whenever the interactive lanes are empty.
+
+-- Priority class of an image, from its import_source
+CREATE OR REPLACE FUNCTION public.embedding_priority_class(p_import_source text)
+RETURNS text
+LANGUAGE sql
+IMMUTABLE
+SET search_path = ''
+AS $$
+  SELECT CASE
+    WHEN p_import_source IN ('oauth_onboarding', 'manual_import') THEN 'onboarding'
+    WHEN p_import_source = 'oauth_sync' THEN 'sync'
+    ELSE 'backfill'
+  END;
+$$;
+
+-- Oldest pending images per class (one index scan per lane per claim)
+CREATE INDEX IF NOT EXISTS idx_portfolio_images_pending_embedding_class
+ON portfolio_images (public.embedding_priority_class(import_source), created_at, id)
+WHERE status = 'pending' AND embedding IS NULL;
+
+-- Return type changes (priority_class, queued_seconds), so the old version must go
+DROP FUNCTION IF EXISTS public.claim_pending_images(text, integer, integer, text, text, text);
+
+-- Claim up to p_limit pending images for p_worker_id, optionally within a location.
+-- Pass 1 gives each class up to its weighted share of p_limit; pass 2 hands any
+-- unfilled slots to the classes in priority order. SKIP LOCKED lets any number of
+-- workers claim concurrently without overlap.
+CREATE OR REPLACE FUNCTION public.claim_pending_images(
+  p_worker_id text,
+  p_limit integer DEFAULT 100,
+  p_lease_seconds integer DEFAULT 600,
+  p_city text DEFAULT NULL,
+  p_region text DEFAULT NULL,
+  p_country_code text DEFAULT NULL,
+  p_onboarding_weight integer DEFAULT 8,
+  p_sync_weight integer DEFAULT 3,
+  p_backfill_weight integer DEFAULT 1
+)
+RETURNS TABLE (
+  id uuid,
+  storage_original_path text,
+  artist_id uuid,
+  priority_class text,
+  queued_seconds double precision
+)
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = 'public'
+AS $$
+#variable_conflict use_column
+DECLARE
+  v_artist_ids uuid[] := embedding_location_artist_ids(p_city, p_region, p_country_code);
+  v_classes text[] := ARRAY['onboarding', 'sync', 'backfill'];
+  v_weights integer[] := ARRAY[
+    GREATEST(p_onboarding_weight, 0),
+    GREATEST(p_sync_weight, 0),
+    GREATEST(p_backfill_weight, 0)
+  ];
+  v_total_weight integer;
+  v_remaining integer := p_limit;
+  v_quota integer;
+  v_claimed integer;
+  v_pass integer;
+  i integer;
+BEGIN
+  IF v_artist_ids = '{}' THEN
+    RETURN;  -- No artists in this location
+  END IF;
+
+  v_total_weight := GREATEST(v_weights[1] + v_weights[2] + v_weights[3], 1);
+
+  FOR v_pass IN 1..2 LOOP
+    FOR i IN 1..array_length(v_classes, 1) LOOP
+      EXIT WHEN v_remaining <= 0;
+
+      IF v_pass = 1 THEN
+        v_quota := LEAST(v_remaining, CEIL(p_limit * v_weights[i]::numeric / v_total_weight)::integer);
+      ELSE
+        v_quota := v_remaining;
+      END IF;
+      CONTINUE WHEN v_quota <= 0;
+
+      RETURN QUERY
+      WITH claimable AS (
+        SELECT pi.id
+        FROM portfolio_images pi
+        WHERE pi.status = 'pending'
+          AND pi.embedding IS NULL
+          AND embedding_priority_class(pi.import_source) = v_classes[i]
+          AND (pi.embedding_lease_expires_at IS NULL OR pi.embedding_lease_expires_at < now())
+          AND (v_artist_ids IS NULL OR pi.artist_id = ANY (v_artist_ids))
+        ORDER BY pi.created_at, pi.id
+        LIMIT v_quota
+        FOR UPDATE SKIP LOCKED
+      )
+      UPDATE portfolio_images pi
+      SET
+        embedding_claimed_by = p_worker_id,
+        embedding_lease_expires_at = now() + make_interval(secs => p_lease_seconds)
+      FROM claimable c
+      WHERE pi.id = c.id
+      RETURNING
+        pi.id,
+        pi.storage_original_path,
+        pi.artist_id,
+        v_classes[i],
+        EXTRACT(EPOCH FROM now() - pi.created_at)::double precision;
+
+      GET DIAGNOSTICS v_claimed = ROW_COUNT;
+      v_remaining := v_remaining - v_claimed;
+    END LOOP;
+  END LOOP;
+END;
+$$;
+
+REVOKE EXECUTE ON FUNCTION public.claim_pending_images(text, integer, integer, text, text, text, integer, integer, integer) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.claim_pending_images(text, integer, integer, text, text, text, integer, integer, integer) TO service_role;
+
+COMMENT ON FUNCTION public.embedding_priority_class(text)
+IS 'Embedding queue class for an import_source: onboarding (oauth_onboarding, manual_import), sync (oauth_sync) or backfill (everything else).';
+
+COMMENT ON FUNCTION public.claim_pending_images(text, integer, integer, text, text, text, integer, integer, integer)
+IS 'Atomically leases the next unclaimed pending images to an embedding worker (SKIP LOCKED), split across onboarding/sync/backfill lanes by weight and optionally filtered by city/region/country. Returns each image''s class and how long it has been queued.';
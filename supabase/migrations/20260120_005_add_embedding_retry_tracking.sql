@@ -0,0 +1,198 @@
+-- Retry tracking and dead-lettering for embedding failures
+-- A failed image used to either stay pending (local workers retried it on every pass,
+-- paying another download timeout and a Modal attempt) or be marked failed for good
+-- after one error (Modal batch job). Failures are now recorded per image: transient
+-- errors back off exponentially before the image can be claimed again, permanent
+-- errors (missing object, undecodable image) and images out of attempts are
+-- dead-lettered with status 'failed'.
+
+ALTER TABLE portfolio_images
+ADD COLUMN IF NOT EXISTS embedding_attempts INTEGER NOT NULL DEFAULT 0,
+ADD COLUMN IF NOT EXISTS embedding_last_error TEXT,
+ADD COLUMN IF NOT EXISTS embedding_next_attempt_at TIMESTAMPTZ;
+
+COMMENT ON COLUMN portfolio_images.embedding_attempts IS
+  'Failed embedding attempts so far (see record_embedding_failures)';
+
+COMMENT ON COLUMN portfolio_images.embedding_last_error IS
+  'Error class of the last failed embedding attempt (e.g. download_http_404, download_timeout, local_undecodable)';
+
+COMMENT ON COLUMN portfolio_images.embedding_next_attempt_at IS
+  'Pending image is not claimed again before this time (retry backoff, NULL = eligible now)';
+
+-- Record failed embedding attempts.
+-- failures: [{"id": uuid, "error": "download_timeout", "permanent": false}, ...]
+-- Transient failures are retried after p_base_delay_seconds * 2^(attempts - 1) (+/- 25%
+-- jitter, capped at p_max_delay_seconds). Permanent failures and images that reach
+-- p_max_attempts are dead-lettered (status 'failed'). Leases are cleared either way.
+-- Returns the number of images dead-lettered.
+CREATE OR REPLACE FUNCTION public.record_embedding_failures(
+  failures jsonb,
+  p_max_attempts integer DEFAULT 5,
+  p_base_delay_seconds integer DEFAULT 300,
+  p_max_delay_seconds integer DEFAULT 86400
+)
+RETURNS integer
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = 'public'
+AS $$
+DECLARE
+  dead_lettered integer;
+BEGIN
+  WITH failed AS (
+    UPDATE portfolio_images pi
+    SET
+      embedding_attempts = pi.embedding_attempts + 1,
+      embedding_last_error = left(f.error, 200),
+      status = CASE
+        WHEN COALESCE(f.permanent, false) OR pi.embedding_attempts + 1 >= p_max_attempts THEN 'failed'
+        ELSE pi.status
+      END,
+      embedding_next_attempt_at = CASE
+        WHEN COALESCE(f.permanent, false) OR pi.embedding_attempts + 1 >= p_max_attempts THEN NULL
+        ELSE now() + make_interval(secs =>
+          LEAST(p_max_delay_seconds, p_base_delay_seconds * power(2, pi.embedding_attempts))
+          * (0.75 + random() * 0.5)
+        )
+      END,
+      embedding_claimed_by = NULL,
+      embedding_lease_expires_at = NULL
+    FROM jsonb_to_recordset(failures) AS f(id uuid, error text, permanent boolean)
+    WHERE pi.id = f.id
+      AND pi.status = 'pending'
+    RETURNING pi.status
+  )
+  SELECT COUNT(*) FILTER (WHERE status = 'failed')
+  INTO dead_lettered
+  FROM failed;
+
+  RETURN dead_lettered;
+END;
+$$;
+
+-- Move dead-lettered images back to the pending queue (e.g. after fixing the cause).
+-- p_error filters by last error class; NULL requeues every dead-lettered image.
+CREATE OR REPLACE FUNCTION public.requeue_failed_embeddings(p_error text DEFAULT NULL)
+RETURNS integer
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = 'public'
+AS $$
+DECLARE
+  requeued_count integer;
+BEGIN
+  UPDATE portfolio_images
+  SET
+    status = 'pending',
+    embedding_attempts = 0,
+    embedding_next_attempt_at = NULL
+  WHERE status = 'failed'
+    AND embedding IS NULL
+    AND (p_error IS NULL OR embedding_last_error = p_error);
+
+  GET DIAGNOSTICS requeued_count = ROW_COUNT;
+  RETURN requeued_count;
+END;
+$$;
+
+-- Same as 20260120_004, plus: images still backing off are not claimable
+CREATE OR REPLACE FUNCTION public.claim_pending_images(
+  p_worker_id text,
+  p_limit integer DEFAULT 100,
+  p_lease_seconds integer DEFAULT 600,
+  p_city text DEFAULT NULL,
+  p_region text DEFAULT NULL,
+  p_country_code text DEFAULT NULL,
+  p_onboarding_weight integer DEFAULT 8,
+  p_sync_weight integer DEFAULT 3,
+  p_backfill_weight integer DEFAULT 1
+)
+RETURNS TABLE (
+  id uuid,
+  storage_original_path text,
+  artist_id uuid,
+  priority_class text,
+  queued_seconds double precision
+)
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = 'public'
+AS $$
+#variable_conflict use_column
+DECLARE
+  v_artist_ids uuid[] := embedding_location_artist_ids(p_city, p_region, p_country_code);
+  v_classes text[] := ARRAY['onboarding', 'sync', 'backfill'];
+  v_weights integer[] := ARRAY[
+    GREATEST(p_onboarding_weight, 0),
+    GREATEST(p_sync_weight, 0),
+    GREATEST(p_backfill_weight, 0)
+  ];
+  v_total_weight integer;
+  v_remaining integer := p_limit;
+  v_quota integer;
+  v_claimed integer;
+  v_pass integer;
+  i integer;
+BEGIN
+  IF v_artist_ids = '{}' THEN
+    RETURN;  -- No artists in this location
+  END IF;
+
+  v_total_weight := GREATEST(v_weights[1] + v_weights[2] + v_weights[3], 1);
+
+  FOR v_pass IN 1..2 LOOP
+    FOR i IN 1..array_length(v_classes, 1) LOOP
+      EXIT WHEN v_remaining <= 0;
+
+      IF v_pass = 1 THEN
+        v_quota := LEAST(v_remaining, CEIL(p_limit * v_weights[i]::numeric / v_total_weight)::integer);
+      ELSE
+        v_quota := v_remaining;
+      END IF;
+      CONTINUE WHEN v_quota <= 0;
+
+      RETURN QUERY
+      WITH claimable AS (
+        SELECT pi.id
+        FROM portfolio_images pi
+        WHERE pi.status = 'pending'
+          AND pi.embedding IS NULL
+          AND embedding_priority_class(pi.import_source) = v_classes[i]
+          AND (pi.embedding_lease_expires_at IS NULL OR pi.embedding_lease_expires_at < now())
+          AND (pi.embedding_next_attempt_at IS NULL OR pi.embedding_next_attempt_at <= now())
+          AND (v_artist_ids IS NULL OR pi.artist_id = ANY (v_artist_ids))
+        ORDER BY pi.created_at, pi.id
+        LIMIT v_quota
+        FOR UPDATE SKIP LOCKED
+      )
+      UPDATE portfolio_images pi
+      SET
+        embedding_claimed_by = p_worker_id,
+        embedding_lease_expires_at = now() + make_interval(secs => p_lease_seconds)
+      FROM claimable c
+      WHERE pi.id = c.id
+      RETURNING
+        pi.id,
+        pi.storage_original_path,
+        pi.artist_id,
+        v_classes[i],
+        EXTRACT(EPOCH FROM now() - pi.created_at)::double precision;
+
+      GET DIAGNOSTICS v_claimed = ROW_COUNT;
+      v_remaining := v_remaining - v_claimed;
+    END LOOP;
+  END LOOP;
+END;
+$$;
+
+REVOKE EXECUTE ON FUNCTION public.record_embedding_failures(jsonb, integer, integer, integer) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.record_embedding_failures(jsonb, integer, integer, integer) TO service_role;
+REVOKE EXECUTE ON FUNCTION public.requeue_failed_embeddings(text) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.requeue_failed_embeddings(text) TO service_role;
+
+COMMENT ON FUNCTION public.record_embedding_failures(jsonb, integer, integer, integer)
+IS 'Records failed embedding attempts: transient failures back off exponentially, permanent ones (and images out of attempts) are dead-lettered with status failed. Returns the number dead-lettered.';
+
+COMMENT ON FUNCTION public.requeue_failed_embeddings(text)
+IS 'Returns dead-lettered images (status failed, no embedding) to the pending queue, optionally only those whose last error matches p_error.';
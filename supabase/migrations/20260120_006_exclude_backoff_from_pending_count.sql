@@ -0,0 +1,34 @@
+-- Pending count excludes images still backing off after a failure
+-- count_pending_embedding_images (20260120_003) counted every pending image, including
+-- those claim_pending_images skips until embedding_next_attempt_at (20260120_005). Runs
+-- sized their progress total, ETA and "nothing left" check from work they could not claim.
+
+CREATE OR REPLACE FUNCTION public.count_pending_embedding_images(
+  p_city text DEFAULT NULL,
+  p_region text DEFAULT NULL,
+  p_country_code text DEFAULT NULL
+)
+RETURNS bigint
+LANGUAGE plpgsql
+STABLE
+SECURITY DEFINER
+SET search_path = 'public'
+AS $$
+DECLARE
+  v_artist_ids uuid[] := embedding_location_artist_ids(p_city, p_region, p_country_code);
+  v_count bigint;
+BEGIN
+  SELECT COUNT(*)
+  INTO v_count
+  FROM portfolio_images pi
+  WHERE pi.status = 'pending'
+    AND pi.embedding IS NULL
+    AND (pi.embedding_next_attempt_at IS NULL OR pi.embedding_next_attempt_at <= now())
+    AND (v_artist_ids IS NULL OR pi.artist_id = ANY (v_artist_ids));
+
+  RETURN v_count;
+END;
+$$;
+
+COMMENT ON FUNCTION public.count_pending_embedding_images(text, text, text)
+IS 'Counts images waiting for an embedding that can be claimed now (claimed or not, excluding retry backoff), optionally filtered by city/region/country.';